@@ -0,0 +1,69 @@
+import asyncio
+from collections import deque
+from starlette.routing import Match
+
+# Admission control: every route belongs to a priority class with its own concurrency limit and queue,
+# so a burst on an expensive route waits in its own queue instead of taking the whole threadpool.
+# Runs on the event loop only, the counters need no lock.
+
+class PriorityClass:
+    def __init__(self, name: str, limit=None, max_queue: int = 0, queue_timeout: float = 0, retry_after: int = 1, shed_when_waiting: str = None):
+        self.name = name
+        self.limit = limit  # None admits everything
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        # Reject at once while this (more important) class has requests waiting
+        self.shed_when_waiting = shed_when_waiting
+        self.in_flight = 0
+        self.rejections = {}
+        self._waiters = deque()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def _reject(self, reason: str) -> str:
+        self.rejections[reason] = self.rejections.get(reason, 0) + 1
+        return reason
+
+    async def acquire(self, classes: dict):
+        # Returns None once admitted, otherwise why the request was rejected
+        if self.shed_when_waiting and classes[self.shed_when_waiting].queue_depth:
+            return self._reject("shed")
+        if self.limit is None or (self.in_flight < self.limit and not self._waiters):
+            self.in_flight += 1
+            return None
+        if len(self._waiters) >= self.max_queue:
+            return self._reject("queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as error:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif not waiter.cancelled():
+                # A slot was handed over just as the wait ended, pass it on
+                self.release()
+            if isinstance(error, asyncio.CancelledError):
+                raise
+            return self._reject("timeout")
+        # release() handed its slot over, in_flight already counts this request
+        return None
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+def match_route(routes, scope):
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route
+    return None
@@ -0,0 +1,466 @@
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+# Runs against the in-memory engine unless STORAGE_ENGINE says otherwise, see storage.py
+os.environ.setdefault("STORAGE_ENGINE", "memory")
+# The benchmark tutor also covers the /admin routes
+os.environ.setdefault("ADMIN_USERNAMES", "bench_tutor")
+
+from fastapi.routing import APIRoute
+from fastapi.testclient import TestClient
+import main
+from config import *
+from models import UserFile
+from completions import encode_completions, register_content
+from cleanup import create_room_cleanup_job
+from migrations import run_migrations
+from utils import create_access_token, create_refresh_token, hash_password
+
+# Usage:
+#   python benchmark.py                              every route, 200 requests each, results in benchmark_results/
+#   python benchmark.py --only lectures --requests 1000 --concurrency 8
+#   python benchmark.py --compare benchmark_results/<old>.json   exits 1 when a route got slower than --threshold
+
+TUTOR = "bench_tutor"
+PASSWORD = "benchmark-password"
+DIFFICULTIES = ["easy", "intermediate", "advanced"]
+
+# Volumes at --scale 1
+VOLUMES = {
+    "rooms": 4,
+    "students_per_room": 300,
+    "lectures_per_room": 45,
+    "slides_per_lecture": 30,
+    "quiz_per_lecture": 10,
+    "projects_per_room": 20,
+    "steps_per_project": 8,
+    "files_per_student": 50,
+    "students_with_files": 20,
+    "large_file_bytes": 6 * 1024 * 1024
+}
+
+class Scenario:
+    def __init__(self, route: str, method: str, path, body=None, params=None, user=None, tutor=False, setup=None, requests=None):
+        # path, body, params and user may be callables of the request number
+        self.route = route
+        self.method = method
+        self.path = path
+        self.body = body
+        self.params = params
+        self.user = user
+        self.tutor = tutor
+        self.setup = setup
+        self.requests = requests
+
+    @property
+    def name(self):
+        return f"{self.method} {self.route}"
+
+    def request(self, i: int, tokens: dict):
+        value = lambda attribute: attribute(i) if callable(attribute) else attribute
+        headers = {}
+        user = value(self.user) or (TUTOR if self.tutor else None)
+        if user:
+            headers["Authorization"] = f"Bearer {tokens.setdefault(user, create_access_token(user))}"
+        return {"method": self.method, "url": value(self.path), "json": value(self.body), "params": value(self.params), "headers": headers}
+
+def room_code(r: int) -> str:
+    return f"BNCH{r:02d}"
+
+def student(r: int, n: int) -> str:
+    return f"student{r}_{n}"
+
+def lecture_title(n: int) -> str:
+    return f"Lecture {n:03d}"
+
+def project_name(n: int) -> str:
+    return f"Project {n:03d}"
+
+def text(size: int, seed: int) -> str:
+    words = ["print", "for", "loop", "value", "list", "range", "string", "function", "return", "index"]
+    rng = random.Random(seed)
+    return " ".join(rng.choice(words) for _ in range(size // 6))
+
+def lecture_document(room: str, n: int, volumes: dict):
+    return {
+        "title": lecture_title(n),
+        "difficulty": DIFFICULTIES[n % len(DIFFICULTIES)],
+        "slides": [{"name": f"Slide {s}", "content": text(1000, n * 1000 + s)} for s in range(volumes["slides_per_lecture"])],
+        "quiz": [{"question": f"Question {q}?", "answer": "a", "options": ["a", "b", "c", "d"]} for q in range(volumes["quiz_per_lecture"])],
+        "required": [lecture_title(n - 3)] if n >= 3 else [],
+        "passmark": 7,
+        "room": room
+    }
+
+def project_document(room: str, n: int, volumes: dict):
+    return {
+        "name": project_name(n),
+        "description": text(300, n),
+        "difficulty": DIFFICULTIES[n % len(DIFFICULTIES)],
+        "steps": [
+            {"title": f"Step {s}", "description": text(200, s), "code": "x = ____", "options": ["1", "2"], "answer": "1", "hint": "Try 1"}
+            for s in range(volumes["steps_per_project"])
+        ],
+        "solution": "x = 1",
+        "room": room
+    }
+
+def scaled(scale: float):
+    return {name: max(1, int(value * scale)) if name not in ("rooms", "large_file_bytes") else value for name, value in VOLUMES.items()}
+
+def seed(volumes: dict):
+    rng = random.Random(0)
+    today = datetime.now(timezone.utc)
+    month = today.strftime("%Y-%m")
+
+    tutor_credentials_collection.insert_one({"username": TUTOR, "password": hash_password(PASSWORD), "verified": True, "approved": True})
+    # One bcrypt hash shared by every student keeps seeding fast, logins still verify it
+    password = hash_password(PASSWORD)
+    user_credentials_collection.insert_many([
+        {"username": student(r, n), "email": f"{student(r, n)}@example.com", "password": password, "verified": True}
+        for r in range(volumes["rooms"]) for n in range(volumes["students_per_room"])
+    ])
+
+    for r in range(volumes["rooms"]):
+        code = room_code(r)
+        classroom_data_collection.insert_one({
+            "owner": TUTOR,
+            "name": f"Benchmark room {r}",
+            "capacity": volumes["students_per_room"] * 10,
+            "timezone": "UTC",
+            "code": code,
+            "members": volumes["students_per_room"]
+        })
+        lecture_collection.insert_many([lecture_document(code, n, volumes) for n in range(volumes["lectures_per_room"])])
+        guided_projects_collection.insert_many([project_document(code, n, volumes) for n in range(volumes["projects_per_room"])])
+        daily_puzzle_collection.insert_many([
+            {"date": f"{month}-{day:02d}", "name": f"Puzzle {day}", "description": text(400, day), "tests": ["assert solve(1) == 1"] * 5, "room": code}
+            for day in range(1, 29)
+        ])
+
+        lectures = [lecture_title(n) for n in range(volumes["lectures_per_room"])]
+        projects = [project_name(n) for n in range(volumes["projects_per_room"])]
+        puzzles = [f"{month}-{day:02d}" for day in range(1, 29)]
+        register_content(content_id_collection, code, "lectures", lectures)
+        register_content(content_id_collection, code, "projects", projects)
+        register_content(content_id_collection, code, "puzzles", puzzles)
+        user_data_collection.insert_many([
+            {
+                "username": student(r, n),
+                "room": code,
+                "level": rng.choice(DIFFICULTIES),
+                **unflatten(encode_completions(content_id_collection, code, {
+                    "lectures": rng.sample(lectures, rng.randint(0, len(lectures) // 2)),
+                    "projects": rng.sample(projects, rng.randint(0, len(projects) // 2)),
+                    "puzzles": rng.sample(puzzles, rng.randint(0, 10))
+                }))
+            }
+            for n in range(volumes["students_per_room"])
+        ])
+
+    code = room_code(0)
+    for n in range(volumes["students_with_files"]):
+        owner = student(0, n)
+        files = [
+            UserFile(owner=owner, name=f"src/module_{f}.py", content=text(4000, n * 100 + f), purpose="project")
+            for f in range(volumes["files_per_student"])
+        ]
+        main.write_user_files(False, owner, code, files)
+
+    # Random bytes barely compress, so this one is stored in chunks
+    large = base64.b64encode(random.Random(1).randbytes(volumes["large_file_bytes"] * 3 // 4)).decode()
+    main.write_user_files(False, student(0, 0), code, [UserFile(owner=student(0, 0), name="data/large.txt", content=large, purpose="data")])
+
+def unflatten(fields: dict):
+    document = {}
+    for path, value in fields.items():
+        parent, key = path.split(".")
+        document.setdefault(parent, {})[key] = value
+    return document
+
+def scenarios(volumes: dict):
+    code = room_code(0)
+    students = volumes["students_per_room"]
+    with_files = volumes["students_with_files"]
+    month = datetime.now(timezone.utc).strftime("%Y-%m")
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    each_student = lambda i: student(0, i % students)
+    each_file_owner = lambda i: student(0, i % with_files)
+    lecture = lambda i: lecture_title(i % volumes["lectures_per_room"])
+
+    def create_users(prefix: str, collection, extra: dict):
+        def setup(count: int):
+            collection.insert_many([{"username": f"{prefix}{i}", "token": f"{prefix}{i}", "verified": False, **extra} for i in range(count)])
+        return setup
+
+    def create_tutors(count: int):
+        tutor_credentials_collection.insert_many([{"username": f"room_tutor_{i}", "verified": True, "approved": True} for i in range(count)])
+
+    def create_joiners(count: int):
+        user_credentials_collection.insert_many([{"username": f"joiner_{i}", "verified": True} for i in range(count)])
+
+    def create_doomed_rooms(count: int):
+        classroom_data_collection.insert_many([{"owner": TUTOR, "name": f"doomed {i}", "capacity": 10, "code": f"D{i}"} for i in range(count)])
+
+    def new_lecture(i: int):
+        return {**lecture_document(code, i, volumes), "title": f"New lecture {i}"}
+
+    def new_project(i: int):
+        return {**project_document(code, i, volumes), "name": f"New project {i}"}
+
+    def challenge_date(i: int):
+        return (datetime(2100, 1, 1) + timedelta(days=i)).strftime("%Y-%m-%d")
+
+    def create_cleanup_jobs(count: int):
+        for i in range(count):
+            create_room_cleanup_job(room_cleanup_collection, f"C{i}", TUTOR)
+
+    profile_ids = []
+
+    def create_profiles(count: int):
+        for i in range(min(count, PROFILE_HISTORY)):
+            profiler = main.SamplingProfiler(PROFILE_INTERVAL, PROFILE_MAX_DURATION)
+            profiler.start()
+            time.sleep(PROFILE_INTERVAL * 4)
+            profiler.stop()
+            profile_ids.append(main.profile_store.add(profiler, method="GET", route="/", path="/", status=200))
+
+    return [
+        Scenario("/", "GET", "/"),
+        Scenario("/health/live", "GET", "/health/live"),
+        Scenario("/health/ready", "GET", "/health/ready"),
+        Scenario("/metrics", "GET", "/metrics"),
+        Scenario("/register", "POST", "/register", params={"testing": True}, requests=20,
+                 body=lambda i: {"email": f"new{i}@gmail.com", "username": f"new_{i}", "password": PASSWORD}),
+        Scenario("/login", "POST", "/login", body=lambda i: {"username": each_student(i), "password": PASSWORD}, requests=50),
+        Scenario("/verify/{token}", "GET", lambda i: f"/verify/verify_{i}",
+                 setup=create_users("verify_", user_credentials_collection, {})),
+        Scenario("/refresh", "POST", "/refresh", params=lambda i: {"refresh_token": create_refresh_token(each_student(i))}),
+        Scenario("/daily-puzzle/{room}/{date}", "GET", f"/daily-puzzle/{code}/{today}", user=each_student),
+        Scenario("/daily-puzzles/{room}/{month}", "GET", f"/daily-puzzles/{code}/{month}", user=each_student),
+        Scenario("/user-files/{room}/{username}", "GET", lambda i: f"/user-files/{code}/{each_file_owner(i)}", user=each_file_owner),
+        Scenario("/user-files/{room}/{username}?metadata", "GET", lambda i: f"/user-files/{code}/{each_file_owner(i)}",
+                 params={"metadata": True, "limit": 20}, user=each_file_owner),
+        Scenario("/user-file/{room}/{username}", "GET", lambda i: f"/user-file/{code}/{each_file_owner(i)}",
+                 params=lambda i: {"name": f"src/module_{i % volumes['files_per_student']}.py", "purpose": "project"}, user=each_file_owner),
+        Scenario("/download-file/{room}/{username}", "GET", f"/download-file/{code}/{student(0, 0)}",
+                 params={"name": "data/large.txt", "purpose": "data"}, user=student(0, 0), requests=20),
+        Scenario("/user-files-manifest/{room}/{username}", "GET", lambda i: f"/user-files-manifest/{code}/{each_file_owner(i)}", user=each_file_owner),
+        Scenario("/upload-files", "POST", "/upload-files", user=each_file_owner, body=lambda i: {
+            "room": code,
+            "files": [
+                # An autosave: one file changed, the rest unchanged
+                {"owner": each_file_owner(i), "name": f"src/module_{f}.py", "content": text(4000, (i % with_files) * 100 + f) + (f"\n# {i}" if f == 0 else ""), "purpose": "project"}
+                for f in range(5)
+            ]
+        }),
+        Scenario("/write-behind/stats", "GET", "/write-behind/stats", tutor=True),
+        Scenario("/admin/slow-queries", "GET", "/admin/slow-queries", tutor=True),
+        Scenario("/admin/profiles", "GET", "/admin/profiles", tutor=True),
+        Scenario("/admin/profiles/{profile_id}", "GET", lambda i: f"/admin/profiles/{profile_ids[i % len(profile_ids)]}", tutor=True, setup=create_profiles),
+        Scenario("/lectures/{room}/{difficulty}", "GET", lambda i: f"/lectures/{code}/{DIFFICULTIES[i % 3]}", user=each_student),
+        Scenario("/lectures/{room}/{difficulty}?summary", "GET", lambda i: f"/lectures/{code}/{DIFFICULTIES[i % 3]}", params={"summary": True}, user=each_student),
+        Scenario("/lecture/{room}/{part}", "GET", f"/lecture/{code}/slides", params=lambda i: {"title": lecture(i)}, user=each_student),
+        Scenario("/guided-projects/{room}", "GET", f"/guided-projects/{code}", user=each_student),
+        Scenario("/user-data/{username}/{room}", "GET", lambda i: f"/user-data/{each_student(i)}/{code}", user=each_student),
+        Scenario("/user-data", "POST", "/user-data", user=each_student, body=lambda i: {
+            "username": each_student(i), "room": room_code(1), "level": "easy",
+            "completions": {"lectures": [lecture_title(0)], "projects": [], "puzzles": []}
+        }),
+        Scenario("/update-lecture-completion", "POST", "/update-lecture-completion", user=each_student,
+                 body=lambda i: {"username": each_student(i), "room": code, "lecture": lecture(i)}),
+        Scenario("/update-project-completion", "POST", "/update-project-completion", user=each_student,
+                 body=lambda i: {"username": each_student(i), "room": code, "project": project_name(i % volumes["projects_per_room"])}),
+        Scenario("/update-puzzle-completion", "POST", "/update-puzzle-completion", user=each_student,
+                 body=lambda i: {"username": each_student(i), "room": code, "puzzle": f"{month}-{1 + i % 28:02d}"}),
+        Scenario("/update-completions", "POST", "/update-completions", user=each_student, body=lambda i: {
+            "username": each_student(i), "room": code,
+            "events": [{"type": "lecture", "title": lecture(i + 1)}, {"type": "project", "title": project_name(i % 7)}, {"type": "puzzle", "title": f"{month}-03"}]
+        }),
+        Scenario("/execute-code", "POST", "/execute-code", user=each_student, requests=20,
+                 body={"code": "print(sum(range(1000)))"}),
+        Scenario("/register-tutor", "POST", "/register-tutor", params={"testing": True}, requests=20, body=lambda i: {
+            "email": f"tutor{i}@gmail.com", "username": f"new_tutor_{i}", "password": PASSWORD, "type": "teacher", "institution": "School"
+        }),
+        Scenario("/login-tutor", "POST", "/login-tutor", body={"username": TUTOR, "password": PASSWORD}, requests=50),
+        Scenario("/verify-tutor/{token}", "GET", lambda i: f"/verify-tutor/tutor_verify_{i}",
+                 setup=create_users("tutor_verify_", tutor_credentials_collection, {"approved": False})),
+        Scenario("/create-room", "POST", "/create-room", user=lambda i: f"room_tutor_{i}", setup=create_tutors,
+                 body=lambda i: {"owner": f"room_tutor_{i}", "name": f"Room {i}", "capacity": 30, "timezone": "Europe/Bucharest"}),
+        Scenario("/rooms/{owner}", "GET", f"/rooms/{TUTOR}", tutor=True),
+        Scenario("/room/{code}", "GET", f"/room/{code}", user=each_student),
+        Scenario("/join-room", "POST", "/join-room", user=lambda i: f"joiner_{i}", setup=create_joiners,
+                 body=lambda i: {"username": f"joiner_{i}", "code": room_code(2)}),
+        Scenario("/delete-room/{code}", "DELETE", lambda i: f"/delete-room/D{i}", tutor=True, setup=create_doomed_rooms),
+        Scenario("/room-cleanup/{code}", "GET", lambda i: f"/room-cleanup/C{i}", tutor=True, setup=create_cleanup_jobs),
+        Scenario("/leaderboard/{room}", "GET", f"/leaderboard/{code}", user=each_student),
+        Scenario("/create-challenge", "POST", "/create-challenge", tutor=True, body=lambda i: {
+            "date": challenge_date(i), "name": "Challenge", "description": "Solve it", "room": room_code(3), "tests": ["assert True"]
+        }),
+        Scenario("/create-lecture", "POST", "/create-lecture", tutor=True, body=new_lecture),
+        Scenario("/create-project", "POST", "/create-project", tutor=True, body=new_project),
+        Scenario("/import-content", "POST", "/import-content", tutor=True, requests=50, body=lambda i: {
+            "room": code,
+            "lectures": [{**new_lecture(i * 10 + n), "title": f"Imported lecture {i} {n}"} for n in range(5)],
+            "projects": [{**new_project(i * 10 + n), "name": f"Imported project {i} {n}"} for n in range(5)]
+        }),
+        Scenario("/inventory/{username}/{room}", "GET", lambda i: f"/inventory/{each_student(i)}/{code}", user=each_student),
+        Scenario("/bootstrap/{username}/{room}", "GET", lambda i: f"/bootstrap/{each_student(i)}/{code}", user=each_student)
+    ]
+
+def uncovered_routes(scenario_list):
+    covered = {(scenario.method, scenario.route.split("?")[0]) for scenario in scenario_list}
+    return sorted(
+        f"{method} {route.path}"
+        for route in main.app.routes if isinstance(route, APIRoute)
+        for method in route.methods
+        if (method, route.path) not in covered
+    )
+
+def percentile(ordered, fraction: float) -> float:
+    # Nearest rank
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+def run_scenario(client: TestClient, scenario: Scenario, requests: int, concurrency: int, warmup: int, tokens: dict):
+    total = warmup + requests
+    if scenario.setup:
+        scenario.setup(total)
+
+    def call(i: int):
+        request = scenario.request(i, tokens)
+        started = time.perf_counter()
+        response = client.request(**request)
+        return time.perf_counter() - started, response.status_code
+
+    for i in range(warmup):
+        call(i)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, range(warmup, total)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency * 1000 for latency, _ in results)
+    statuses = {}
+    for _, status_code in results:
+        statuses[str(status_code)] = statuses.get(str(status_code), 0) + 1
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "status": statuses,
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "max_ms": round(latencies[-1], 3),
+        "rps": round(requests / elapsed, 1)
+    }
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(results: dict, baseline: dict, threshold: float):
+    regressions = []
+    print(f"\nCompared with {baseline.get('commit')} ({baseline.get('created_at')}):")
+    for name, result in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        p95_change = result["p95_ms"] / previous["p95_ms"] - 1 if previous["p95_ms"] else 0
+        rps_change = result["rps"] / previous["rps"] - 1 if previous["rps"] else 0
+        slower = p95_change > threshold
+        if slower:
+            regressions.append(name)
+        print(f"  {'!' if slower else ' '} {name:<50} p95 {p95_change:+7.1%}   req/s {rps_change:+7.1%}")
+    return regressions
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark every API route against a seeded local backend")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per route (slow routes use fewer)")
+    parser.add_argument("--concurrency", type=int, default=1, help="requests in flight at once")
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured requests per route")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the seeded data volumes")
+    parser.add_argument("--only", action="append", default=[], help="only routes containing this text, repeatable")
+    parser.add_argument("--output", help="results file, defaults to benchmark_results/<time>-<commit>.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed p95 slowdown before --compare fails")
+    parser.add_argument("--reset", action="store_true", help="allow dropping and reseeding a real Mongo database")
+    args = parser.parse_args()
+
+    if storage.name != "memory":
+        if not args.reset:
+            sys.exit(f"Seeding drops every collection in {MONGO_DB_NAME}, pass --reset to benchmark against Mongo")
+        for name in storage.db.list_collection_names():
+            storage.db.drop_collection(name)
+
+    volumes = scaled(args.scale)
+    print(f"Seeding {storage.name} storage: {json.dumps(volumes)}")
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_migrations()
+    seed(volumes)
+    main.start_up()
+
+    client = TestClient(main.app)
+    scenario_list = scenarios(volumes)
+    missing = uncovered_routes(scenario_list)
+    if missing:
+        print(f"Routes without a benchmark: {', '.join(missing)}")
+
+    selected = [scenario for scenario in scenario_list if not args.only or any(text in scenario.name for text in args.only)]
+    tokens = {}
+    results = {}
+    print(f"\n{'route':<58}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}  status")
+    for scenario in selected:
+        requests = min(args.requests, scenario.requests) if scenario.requests else args.requests
+        result = run_scenario(client, scenario, requests, args.concurrency, args.warmup, tokens)
+        results[scenario.name] = result
+        print(f"{scenario.name:<58}{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}{result['rps']:>9.1f}  {result['status']}")
+
+    commit = current_commit()
+    report = {
+        "commit": commit,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "engine": storage.name,
+        "python": platform.python_version(),
+        "settings": {"requests": args.requests, "concurrency": args.concurrency, "warmup": args.warmup, "scale": args.scale},
+        "volumes": volumes,
+        "results": results
+    }
+    output = args.output or os.path.join("benchmark_results", f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved {output}")
+
+    main.user_file_buffer.stop()
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            sys.exit(f"{len(regressions)} routes regressed by more than {args.threshold:.0%}")
+
+if __name__ == "__main__":
+    main_cli()
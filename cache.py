@@ -0,0 +1,63 @@
+import threading
+import time
+
+MISSING = object()
+
+_caches = []
+
+class ExpiringCache:
+    def __init__(self, name: str, max_entries: int = 10000):
+        self.name = name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+        _caches.append(self)
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > time.time():
+                self.hits += 1
+                # Keep recently used entries away from eviction
+                self._entries[key] = self._entries.pop(key)
+                return entry[0]
+            if entry:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, expires_at: float):
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                now = time.time()
+                for expired in [k for k, (_, expiry) in self._entries.items() if expiry <= now]:
+                    del self._entries[expired]
+                if len(self._entries) >= self.max_entries:
+                    # Still full, drop the least recently used entry
+                    del self._entries[next(iter(self._entries))]
+            self._entries[key] = (value, expires_at)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+def caches():
+    return list(_caches)
+
+def clear_caches():
+    for cache in _caches:
+        cache.clear()
+
+daily_puzzle_cache = ExpiringCache("daily_puzzle")
+room_cache = ExpiringCache("room")
+# Two entries per content item, title -> id and id -> title
+content_id_cache = ExpiringCache("content_id", max_entries=100000)
@@ -0,0 +1,127 @@
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from pymongo import ReturnDocument
+from config import *
+
+logger = logging.getLogger(__name__)
+
+# Deleting a room leaves a job document behind, the room's content is then removed in small batches.
+# Every batch is deleted by _id and counted on the job, so a job interrupted by a crash or restart
+# is picked up again once its lease expires and continues with whatever is still left.
+
+ROOM_CLEANUP_ORDER = ["user_files", "user_data", "lectures", "guided_projects", "daily_puzzles", "content_ids"]
+
+def room_cleanup_job_id(room: str) -> str:
+    return f"room-cleanup:{room}"
+
+def room_cleanup_query(name: str, room: str):
+    if name == "content_ids":
+        # Id counters are keyed by _id only
+        counters = [f"counter:{room}:{kind}" for kind in COMPLETION_FIELDS.values()]
+        return {"$or": [{"room": room}, {"_id": {"$in": counters}}]}
+    return {"room": room}
+
+def create_room_cleanup_job(job_collection: Collection, room: str, requested_by: str):
+    job = {
+        "_id": room_cleanup_job_id(room),
+        "target_room": room,
+        "requested_by": requested_by,
+        "status": "pending",
+        "deleted": {name: 0 for name in ROOM_CLEANUP_ORDER},
+        "created_at": datetime.now(timezone.utc),
+        "lease_until": None
+    }
+    job_collection.replace_one({"_id": job["_id"]}, job, upsert=True)
+    return job
+
+def get_room_cleanup_job(job_collection: Collection, room: str):
+    return job_collection.find_one({"_id": room_cleanup_job_id(room)}, {"_id": 0, "lease_until": 0})
+
+def room_cleanup_pending(job_collection: Collection, room: str) -> bool:
+    return job_collection.count_documents({"_id": room_cleanup_job_id(room), "status": {"$ne": "done"}}, limit=1) > 0
+
+def room_code_reserved(job_collection: Collection, room: str) -> bool:
+    # Caches on other instances may hold the old room's data until ROOM_CACHE_TTL after the cleanup
+    recently = datetime.now(timezone.utc) - timedelta(seconds=ROOM_CACHE_TTL)
+    return job_collection.count_documents(
+        {"_id": room_cleanup_job_id(room), "$or": [{"status": {"$ne": "done"}}, {"finished_at": {"$gt": recently}}]},
+        limit=1
+    ) > 0
+
+def _claim(job_collection: Collection, room: str):
+    now = datetime.now(timezone.utc)
+    return job_collection.find_one_and_update(
+        {
+            "_id": room_cleanup_job_id(room),
+            "status": {"$ne": "done"},
+            "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]
+        },
+        {"$set": {"status": "running", "lease_until": now + timedelta(seconds=ROOM_CLEANUP_LEASE)}},
+        return_document=ReturnDocument.AFTER
+    )
+
+def _delete_batch(name: str, collections: dict, query: dict) -> int:
+    collection = collections[name]
+    batch = list(collection.find(query, {"_id": 1, "chunk_version": 1}).limit(ROOM_CLEANUP_BATCH_SIZE))
+    if not batch:
+        return 0
+
+    if name == "user_files":
+        # Chunks go first so a crash never leaves chunks without a file pointing at them
+        versions = [document["chunk_version"] for document in batch if document.get("chunk_version")]
+        if versions:
+            collections["user_file_chunks"].delete_many({"version": {"$in": versions}})
+
+    return collection.delete_many({"_id": {"$in": [document["_id"] for document in batch]}}).deleted_count
+
+def run_room_cleanup(job_collection: Collection, collections: dict, room: str) -> bool:
+    # Returns False when another worker holds the job
+    if not _claim(job_collection, room):
+        return False
+
+    job_id = room_cleanup_job_id(room)
+    for name in ROOM_CLEANUP_ORDER:
+        query = room_cleanup_query(name, room)
+        while True:
+            deleted = _delete_batch(name, collections, query)
+            if not deleted:
+                break
+
+            job_collection.update_one(
+                {"_id": job_id},
+                {
+                    "$inc": {f"deleted.{name}": deleted},
+                    "$set": {"lease_until": datetime.now(timezone.utc) + timedelta(seconds=ROOM_CLEANUP_LEASE)}
+                }
+            )
+            if deleted < ROOM_CLEANUP_BATCH_SIZE:
+                break
+            # Leave room for regular traffic between batches
+            time.sleep(ROOM_CLEANUP_PAUSE)
+
+    job_collection.update_one(
+        {"_id": job_id},
+        {"$set": {"status": "done", "finished_at": datetime.now(timezone.utc), "lease_until": None}}
+    )
+    logger.info("Cleaned up room %s", room)
+    return True
+
+def resume_room_cleanups(job_collection: Collection, collections: dict, stop):
+    # Runs until stop is set. Jobs still leased by a crashed process become claimable once the lease
+    # runs out, and jobs that fail while the app is running are picked up by a later sweep.
+    pending = {"_id": {"$regex": "^room-cleanup:"}, "status": {"$ne": "done"}}
+    while True:
+        remaining = True
+        try:
+            for job in job_collection.find(pending, {"target_room": 1}):
+                try:
+                    run_room_cleanup(job_collection, collections, job["target_room"])
+                except Exception:
+                    logger.exception("Cleaning up room %s failed, retrying after the lease expires", job["target_room"])
+            remaining = job_collection.count_documents(pending, limit=1) > 0
+        except Exception:
+            logger.exception("Looking for pending room cleanups failed")
+
+        if stop.wait(ROOM_CLEANUP_LEASE if remaining else ROOM_CLEANUP_SWEEP_INTERVAL):
+            return
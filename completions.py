@@ -0,0 +1,172 @@
+import time
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from config import *
+from cache import content_id_cache
+
+# Completions are stored as bitsets over stable per-room content ids:
+#   completion_bits.<kind>   -> little-endian bytes, bit n set when content id n is completed
+#   completion_counts.<kind> -> number of set bits, used for scoring
+# Older documents still hold the titles in completions.<kind> and are converted on their next write.
+
+# Ids are assigned when content is created (register_content), completions only look them up,
+# so titles a client makes up never get an id and can't grow the bitsets.
+# Cached ids expire after ROOM_CACHE_TTL: deleting a room removes its ids, and its code is only handed
+# out again once that long has passed, so no instance still holds ids of the old room (see create_room).
+
+def clear_content_id_cache():
+    content_id_cache.clear()
+
+def from_bits(bits) -> int:
+    return int.from_bytes(bits or b"", "little")
+
+def to_bits(value: int) -> bytes:
+    return value.to_bytes((value.bit_length() + 7) // 8, "little")
+
+def bits_to_ids(value: int):
+    ids = []
+    while value:
+        lowest = value & -value
+        ids.append(lowest.bit_length() - 1)
+        value ^= lowest
+    return ids
+
+def _remember(id_collection: Collection, room: str, kind: str, title: str, content_id: int):
+    expires_at = time.time() + ROOM_CACHE_TTL
+    content_id_cache.set((id_collection.full_name, room, kind, "title", title), content_id, expires_at)
+    content_id_cache.set((id_collection.full_name, room, kind, "id", content_id), title, expires_at)
+
+def _cached_ids(id_collection: Collection, room: str, kind: str, titles):
+    known = {}
+    for title in titles:
+        content_id = content_id_cache.get((id_collection.full_name, room, kind, "title", title), None)
+        if content_id is not None:
+            known[title] = content_id
+    return known
+
+def get_content_ids(id_collection: Collection, room: str, kind: str, titles):
+    # Titles without an id are left out, they are not content of the room
+    titles = list(dict.fromkeys(titles))
+    known = _cached_ids(id_collection, room, kind, titles)
+    missing = [title for title in titles if title not in known]
+
+    if missing:
+        for entry in id_collection.find({"room": room, "kind": kind, "title": {"$in": missing}}, {"_id": 0, "title": 1, "cid": 1}):
+            _remember(id_collection, room, kind, entry["title"], entry["cid"])
+            known[entry["title"]] = entry["cid"]
+
+    return {title: known[title] for title in titles if title in known}
+
+def register_content(id_collection: Collection, room: str, kind: str, titles):
+    # Called when content is created, gives every new title the next free id of the room
+    titles = list(dict.fromkeys(titles))
+    known = get_content_ids(id_collection, room, kind, titles)
+    missing = [title for title in titles if title not in known]
+
+    if missing:
+        # Reserve a block of ids with a single counter increment
+        counter = id_collection.find_one_and_update(
+            {"_id": f"counter:{room}:{kind}"},
+            {"$inc": {"next": len(missing)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        first_id = counter["next"] - len(missing)
+        for offset, title in enumerate(missing):
+            try:
+                id_collection.insert_one({"room": room, "kind": kind, "title": title, "cid": first_id + offset})
+                known[title] = first_id + offset
+            except DuplicateKeyError:
+                # Another request registered the same title first, use its id
+                known[title] = id_collection.find_one({"room": room, "kind": kind, "title": title})["cid"]
+            _remember(id_collection, room, kind, title, known[title])
+
+    return known
+
+def get_content_titles(id_collection: Collection, room: str, kind: str, ids):
+    titles = {}
+    missing = []
+    for content_id in ids:
+        title = content_id_cache.get((id_collection.full_name, room, kind, "id", content_id), None)
+        if title is None:
+            missing.append(content_id)
+        else:
+            titles[content_id] = title
+
+    if missing:
+        for entry in id_collection.find({"room": room, "kind": kind, "cid": {"$in": missing}}, {"_id": 0, "title": 1, "cid": 1}):
+            _remember(id_collection, room, kind, entry["title"], entry["cid"])
+            titles[entry["cid"]] = entry["title"]
+
+    return [titles[content_id] for content_id in ids if content_id in titles]
+
+def _completion_value(id_collection: Collection, user: dict, room: str, kind: str) -> int:
+    value = from_bits((user.get("completion_bits") or {}).get(kind))
+    legacy_titles = (user.get("completions") or {}).get(kind) or []
+    for content_id in get_content_ids(id_collection, room, kind, legacy_titles).values():
+        value |= 1 << content_id
+    return value
+
+def read_completions(id_collection: Collection, user: dict, room: str):
+    completions = {}
+    for kind in COMPLETION_FIELDS.values():
+        value = _completion_value(id_collection, user, room, kind)
+        completions[kind] = get_content_titles(id_collection, room, kind, bits_to_ids(value))
+    return completions
+
+def encode_completions(id_collection: Collection, room: str, completions: dict):
+    fields = {}
+    for kind in COMPLETION_FIELDS.values():
+        value = 0
+        for content_id in get_content_ids(id_collection, room, kind, completions.get(kind) or []).values():
+            value |= 1 << content_id
+        fields[f"completion_bits.{kind}"] = to_bits(value)
+        fields[f"completion_counts.{kind}"] = value.bit_count()
+    return fields
+
+def add_completions(collection: Collection, id_collection: Collection, username: str, room: str, additions: dict):
+    # Returns the user document as read before the update and the titles that were newly completed
+    for _ in range(COMPLETION_UPDATE_RETRIES):
+        user = collection.find_one(
+            {"username": username, "room": room},
+            {"_id": 0, "level": 1, "completions": 1, "completion_bits": 1}
+        )
+        if not user:
+            return None, None
+
+        stored_bits = user.get("completion_bits") or {}
+        legacy = user.get("completions")
+
+        # Only write if nothing changed since the read, otherwise retry
+        query = {"username": username, "room": room}
+        fields = {}
+        added = {kind: [] for kind in COMPLETION_FIELDS.values()}
+
+        for kind in COMPLETION_FIELDS.values():
+            titles = additions.get(kind) or []
+            if not titles and not (legacy or {}).get(kind):
+                continue
+
+            value = _completion_value(id_collection, user, room, kind)
+            for title, content_id in get_content_ids(id_collection, room, kind, titles).items():
+                if not value >> content_id & 1:
+                    value |= 1 << content_id
+                    added[kind].append(title)
+
+            query[f"completion_bits.{kind}"] = stored_bits[kind] if kind in stored_bits else {"$exists": False}
+            fields[f"completion_bits.{kind}"] = to_bits(value)
+            fields[f"completion_counts.{kind}"] = value.bit_count()
+
+        if not any(added.values()):
+            return user, added
+
+        update = {"$set": fields}
+        if legacy is not None:
+            query["completions"] = legacy
+            update["$unset"] = {"completions": ""}
+
+        if collection.update_one(query, update).modified_count:
+            return user, added
+
+    raise HTTPException(status_code=409, detail="Completions were updated concurrently, please retry")
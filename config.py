@@ -1,45 +1,147 @@
-from pymongo import MongoClient
+from pymongo import ReadPreference
 from pymongo.collection import Collection
 from dotenv import load_dotenv
 import os
 from fastapi_mail import ConnectionConfig
+from functools import lru_cache
+from monitoring import command_timings, pool_stats
+from slow_queries import SlowQueryLog
+from storage import MemoryStorage, create_storage
 
 load_dotenv()
 
 # MongoDB Configuration
+STORAGE_ENGINE = os.getenv("STORAGE_ENGINE", "mongo")  # "memory" runs without a database, see storage.py
 MONGO_URI = os.getenv("MONGO_URI")
-client = MongoClient(MONGO_URI)
-db = client["test_db"]
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "test_db")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "")  # e.g. "zstd,snappy,zlib", empty disables wire compression
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "30000"))
+MONGO_CONTENT_READ_PREFERENCE = os.getenv("MONGO_CONTENT_READ_PREFERENCE", "primary")  # e.g. "secondaryPreferred" to offload content reads
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "false").lower() == "true"  # explain the first occurrence of each slow shape
+SLOW_QUERY_MAX_SHAPES = 500
 
-user_credentials_collection: Collection = db["user_credentials"]
-daily_puzzle_collection: Collection = db["daily_puzzles"]
-user_file_collection: Collection = db["user_files"]
-lecture_collection: Collection = db["lectures"]
-guided_projects_collection: Collection = db["guided_projects"]
-user_data_collection: Collection = db["user_data"]
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST
+}
 
-classroom_data_collection: Collection = db["classroom_data"]
-tutor_credentials_collection: Collection = db["tutor_credentials"]
+slow_query_log = SlowQueryLog(SLOW_QUERY_MS, SLOW_QUERY_MAX_SHAPES, SLOW_QUERY_EXPLAIN)
 
-mock_collection: Collection = db["test_collection"]
+def mongo_client_options():
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        # Don't connect at import, the lifespan connects on startup
+        "connect": False,
+        "event_listeners": [pool_stats, command_timings, slow_query_log]
+    }
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    return options
+
+storage = create_storage(STORAGE_ENGINE, MONGO_URI, MONGO_DB_NAME, mongo_client_options())
+if storage.name == "mongo":
+    slow_query_log.explain_client = storage.client
+
+user_credentials_collection: Collection = storage.collection("user_credentials")
+daily_puzzle_collection: Collection = storage.collection("daily_puzzles")
+user_file_collection: Collection = storage.collection("user_files")
+user_file_chunk_collection: Collection = storage.collection("user_file_chunks")
+lecture_collection: Collection = storage.collection("lectures")
+guided_projects_collection: Collection = storage.collection("guided_projects")
+user_data_collection: Collection = storage.collection("user_data")
+content_id_collection: Collection = storage.collection("content_ids")
+idempotency_collection: Collection = storage.collection("idempotency_keys")
+room_cleanup_collection: Collection = storage.collection("room_cleanup_jobs")
+
+classroom_data_collection: Collection = storage.collection("classroom_data")
+tutor_credentials_collection: Collection = storage.collection("tutor_credentials")
+
+# Content is rarely written and tolerates replication lag, so its read-heavy endpoints may use secondaries.
+# Auth, user data and completions always read from the primary through the collections above.
+content_read_preference = READ_PREFERENCES[MONGO_CONTENT_READ_PREFERENCE]
+lecture_read_collection: Collection = storage.collection("lectures", read_preference=content_read_preference)
+guided_projects_read_collection: Collection = storage.collection("guided_projects", read_preference=content_read_preference)
+
+# Requests with testing=True use these instead, one in-memory collection per entity like the real database
+test_storage = MemoryStorage("testing")
 
 SECRET_KEY = os.getenv("SECRET_KEY")
+ADMIN_USERNAMES = {name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip()}  # tutors allowed on /admin endpoints
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 REFRESH_TOKEN_EXPIRE_DAYS = 7
 
+COMPLETION_FIELDS = {"lecture": "lectures", "project": "projects", "puzzle": "puzzles"}
+COMPLETION_UPDATE_RETRIES = 5
+USER_FILE_COMPRESSION_THRESHOLD = 1024  # bytes
+USER_FILE_CHUNK_THRESHOLD = 4 * 1024 * 1024  # stored bytes, larger files are split into chunks
+USER_FILE_CHUNK_SIZE = 255 * 1024
+USER_FILE_CHUNK_GRACE = 300  # seconds replaced chunks are kept for downloads still streaming them
+USER_FILE_PAGE_LIMIT = 500  # largest page /user-files returns
+USER_FILE_WRITE_BEHIND = os.getenv("USER_FILE_WRITE_BEHIND", "false").lower() == "true"
+USER_FILE_WRITE_BEHIND_WINDOW = float(os.getenv("USER_FILE_WRITE_BEHIND_WINDOW", "2"))  # seconds
+ROOM_CACHE_TTL = 300  # seconds, bounds staleness across instances
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60  # seconds
+IDEMPOTENCY_CACHE_SIZE = 10000
+IDEMPOTENCY_LEASE = 120  # seconds before a pending key left by a crashed worker can be claimed again, outlasts the slowest request
+IDEMPOTENCY_RETRYABLE_STATUSES = {408, 409, 425, 429}  # released like 5xx, a retry with the same key executes again
+ROOM_CLEANUP_BATCH_SIZE = 500
+ROOM_CLEANUP_PAUSE = 0.05  # seconds between batches
+ROOM_CLEANUP_LEASE = 60  # seconds before an abandoned cleanup can be resumed
+ROOM_CLEANUP_SWEEP_INTERVAL = 600  # seconds between checks for failed or abandoned cleanups while none are pending
+PROFILE_HEADER = "X-Profile"  # "1" on a request with an admin token profiles it
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))  # share of all requests profiled, 0 disables sampling
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000  # seconds between stack samples
+PROFILE_MAX_DURATION = 30  # seconds, sampling stops after this even if the request hasn't finished
+PROFILE_HISTORY = 50  # profiles kept in memory
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() == "true"
+# Priority classes share anyio's threadpool (40 threads), keep the limits below it so probes always get through
+PRIORITY_CLASSES = {
+    "critical": {"limit": None},
+    "interactive": {"limit": int(os.getenv("INTERACTIVE_CONCURRENCY", "28")), "max_queue": 200, "queue_timeout": 2, "retry_after": 1},
+    "heavy": {"limit": int(os.getenv("HEAVY_CONCURRENCY", "6")), "max_queue": 50, "queue_timeout": 5, "retry_after": 5, "shed_when_waiting": "interactive"}
+}
+# Route templates outside this map are interactive
+ROUTE_PRIORITIES = {
+    "/health/live": "critical",
+    "/health/ready": "critical",
+    "/metrics": "critical",
+    "/execute-code": "heavy",
+    "/login": "heavy",  # bcrypt
+    "/login-tutor": "heavy",
+    "/register": "heavy",
+    "/register-tutor": "heavy",
+    "/upload-files": "heavy",
+    "/download-file/{room}/{username}": "heavy",
+    "/import-content": "heavy"
+}
+ROOM_PREWARM_LIMIT = int(os.getenv("ROOM_PREWARM_LIMIT", "200"))  # most populated rooms cached at startup
+STARTUP_RETRY_DELAY = 1  # seconds before retrying start-up, doubles up to STARTUP_RETRY_MAX_DELAY
+STARTUP_RETRY_MAX_DELAY = 30
+BOOTSTRAP_FIELDS = ["userData", "lectures", "guidedProjects", "dailyPuzzle", "inventory", "leaderboard"]
+
 DANGEROUS_MODULES = {"os", "sys", "shutil", "subprocess", "socket", "ctypes"}
 DANGEROUS_BUILTINS = {"eval", "exec", "compile", "open", "__import__", "input", "globals", "locals"}
 
-# Email Configuration
-conf = ConnectionConfig(
-    MAIL_USERNAME=os.getenv("MAIL_USERNAME"),
-    MAIL_PASSWORD=os.getenv("MAIL_PASSWORD"),
-    MAIL_FROM=os.getenv("MAIL_FROM"),
-    MAIL_FROM_NAME=os.getenv("MAIL_FROM_NAME"),
-    MAIL_PORT=587,
-    MAIL_SERVER="smtp.gmail.com",
-    MAIL_STARTTLS=True,
-    MAIL_SSL_TLS=False,
-    USE_CREDENTIALS=True
-)
+# Email Configuration, built on the first email sent
+@lru_cache(maxsize=None)
+def get_mail_config():
+    return ConnectionConfig(
+        MAIL_USERNAME=os.getenv("MAIL_USERNAME"),
+        MAIL_PASSWORD=os.getenv("MAIL_PASSWORD"),
+        MAIL_FROM=os.getenv("MAIL_FROM"),
+        MAIL_FROM_NAME=os.getenv("MAIL_FROM_NAME"),
+        MAIL_PORT=587,
+        MAIL_SERVER="smtp.gmail.com",
+        MAIL_STARTTLS=True,
+        MAIL_SSL_TLS=False,
+        USE_CREDENTIALS=True
+    )
@@ -0,0 +1,5 @@
+import os
+
+# Tests run against the in-memory engine unless STORAGE_ENGINE says otherwise, see storage.py.
+# Set before config is imported, which builds the storage engine.
+os.environ.setdefault("STORAGE_ENGINE", "memory")
@@ -0,0 +1,67 @@
+import hashlib
+import time
+from datetime import datetime, timedelta, timezone
+from pymongo.errors import DuplicateKeyError
+from cache import ExpiringCache, MISSING
+from config import *
+
+IDEMPOTENT_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+# Completed responses by record id, so replays of recent keys skip the database
+idempotency_cache = ExpiringCache("idempotency", max_entries=IDEMPOTENCY_CACHE_SIZE)
+
+def idempotency_record_id(key: str, method: str, path: str, authorization: str) -> str:
+    # Keys are scoped to the caller and the route, a key reused by another user never replays their response
+    scope = hashlib.sha256(f"{authorization}|{method}|{path}".encode("utf-8")).hexdigest()[:32]
+    return f"{scope}:{key}"
+
+def request_fingerprint(query: str, body: bytes) -> str:
+    return hashlib.sha256(query.encode("utf-8") + b"|" + body).hexdigest()
+
+def claim_idempotency_key(collection: Collection, record_id: str, fingerprint: str):
+    # Returns None when this request now owns the key, otherwise the existing record
+    record = idempotency_cache.get(record_id)
+    if record is not MISSING:
+        return record
+
+    now = datetime.now(timezone.utc)
+    try:
+        collection.insert_one({
+            "_id": record_id,
+            "fingerprint": fingerprint,
+            "state": "pending",
+            "created_at": now,
+            "claimed_at": now
+        })
+        return None
+    except DuplicateKeyError:
+        pass
+
+    # A pending key whose owner crashed is taken over once its lease has run out
+    taken_over = collection.find_one_and_update(
+        {
+            "_id": record_id,
+            "state": "pending",
+            "fingerprint": fingerprint,
+            "claimed_at": {"$lt": now - timedelta(seconds=IDEMPOTENCY_LEASE)}
+        },
+        {"$set": {"claimed_at": now}}
+    )
+    if taken_over:
+        return None
+    return collection.find_one({"_id": record_id})
+
+def complete_idempotency_key(collection: Collection, record_id: str, fingerprint: str, status_code: int, body: bytes, content_type: str):
+    record = {
+        "fingerprint": fingerprint,
+        "state": "completed",
+        "status_code": status_code,
+        "body": body,
+        "content_type": content_type
+    }
+    collection.update_one({"_id": record_id}, {"$set": record})
+    idempotency_cache.set(record_id, record, time.time() + IDEMPOTENCY_KEY_TTL)
+
+def release_idempotency_key(collection: Collection, record_id: str):
+    # Failed requests give the key back so a retry executes again
+    collection.delete_one({"_id": record_id, "state": "pending"})
@@ -1,38 +1,304 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from email_validator import validate_email, EmailNotValidError
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from contextlib import asynccontextmanager
 from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+from bson import ObjectId
+from urllib.parse import quote
 from config import *
 from models import *
 from utils import *
+from completions import *
+from cache import *
+from write_behind import WriteBehindBuffer
+from idempotency import *
+from cleanup import *
+from migrations import ensure_content_indexes, ensure_daily_puzzle_index, ensure_indexes
+from slow_queries import current_request_scope
+from profiling import ProfileStore, SamplingProfiler, call_tree, top_functions
+from admission import PriorityClass, match_route
+from single_flight import single_flight
+from monitoring import CallbackCounter, Gauge, code_execution_duration, http_request_duration, http_requests, pool_stats, render_metrics
+import anyio
+import asyncio
+import logging
+import random
+import time
 import subprocess
+import threading
 import uuid
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    stop = threading.Event()
+    # The instance is live right away and reports ready once Mongo answers and the caches are warm
+    threading.Thread(target=start_up, args=(stop,), name="start-up", daemon=True).start()
+    # Finish room cleanups interrupted by a previous shutdown or crash, and retry ones that fail later on
+    threading.Thread(
+        target=resume_room_cleanups,
+        args=(room_cleanup_collection, get_room_scoped_collections(False), stop),
+        name="room-cleanup",
+        daemon=True
+    ).start()
+    yield
+    stop.set()
+    # Persist acknowledged uploads before the process exits
+    user_file_buffer.stop()
+    storage.close()
+
+app = FastAPI(lifespan=lifespan)
 
 def get_user_credentials_collection(testing: bool):
-    return mock_collection if testing else user_credentials_collection
+    return test_storage.collection("user_credentials") if testing else user_credentials_collection
 
 def get_daily_puzzle_collection(testing: bool):
-    return mock_collection if testing else daily_puzzle_collection
+    return test_storage.collection("daily_puzzles") if testing else daily_puzzle_collection
 
 def get_user_file_collection(testing: bool):
-    return mock_collection if testing else user_file_collection
+    return test_storage.collection("user_files") if testing else user_file_collection
+
+def get_user_file_chunk_collection(testing: bool):
+    return test_storage.collection("user_file_chunks") if testing else user_file_chunk_collection
 
 def get_lecture_collection(testing: bool):
-    return mock_collection if testing else lecture_collection
+    return test_storage.collection("lectures") if testing else lecture_collection
 
 def get_guided_projects_collection(testing: bool):
-    return mock_collection if testing else guided_projects_collection
+    return test_storage.collection("guided_projects") if testing else guided_projects_collection
+
+def get_lecture_read_collection(testing: bool):
+    return test_storage.collection("lectures", content_read_preference) if testing else lecture_read_collection
+
+def get_guided_projects_read_collection(testing: bool):
+    return test_storage.collection("guided_projects", content_read_preference) if testing else guided_projects_read_collection
 
 def get_user_data_collection(testing: bool):
-    return mock_collection if testing else user_data_collection
+    return test_storage.collection("user_data") if testing else user_data_collection
+
+def get_content_id_collection(testing: bool):
+    return test_storage.collection("content_ids") if testing else content_id_collection
+
+def get_idempotency_collection(testing: bool):
+    return test_storage.collection("idempotency_keys") if testing else idempotency_collection
+
+def get_room_cleanup_collection(testing: bool):
+    return test_storage.collection("room_cleanup_jobs") if testing else room_cleanup_collection
+
+def get_room_scoped_collections(testing: bool):
+    return {
+        "user_data": get_user_data_collection(testing),
+        "user_files": get_user_file_collection(testing),
+        "user_file_chunks": get_user_file_chunk_collection(testing),
+        "lectures": get_lecture_collection(testing),
+        "guided_projects": get_guided_projects_collection(testing),
+        "daily_puzzles": get_daily_puzzle_collection(testing),
+        "content_ids": get_content_id_collection(testing)
+    }
 
 def get_tutor_credentials_collection(testing: bool):
-    return mock_collection if testing else tutor_credentials_collection
+    return test_storage.collection("tutor_credentials") if testing else tutor_credentials_collection
 
 def get_classroom_data_collection(testing: bool):
-    return mock_collection if testing else classroom_data_collection
+    return test_storage.collection("classroom_data") if testing else classroom_data_collection
+
+@app.middleware("http")
+async def idempotency_middleware(request: Request, call_next):
+    key = request.headers.get("Idempotency-Key")
+    if not key or request.method not in IDEMPOTENT_METHODS:
+        return await call_next(request)
+
+    testing = request.query_params.get("testing", "").lower() in ("1", "true")
+    collection = get_idempotency_collection(testing)
+    record_id = idempotency_record_id(key, request.method, request.url.path, request.headers.get("Authorization", ""))
+    fingerprint = request_fingerprint(str(request.query_params), await request.body())
+
+    record = await run_in_threadpool(claim_idempotency_key, collection, record_id, fingerprint)
+    if record:
+        if record["fingerprint"] != fingerprint:
+            return JSONResponse(status_code=422, content={"detail": "Idempotency-Key was already used for a different request"})
+        if record["state"] != "completed":
+            return JSONResponse(status_code=409, content={"detail": "A request with this Idempotency-Key is still in progress"})
+        return Response(
+            content=record["body"],
+            status_code=record["status_code"],
+            media_type=record["content_type"],
+            headers={"Idempotent-Replayed": "true"}
+        )
+
+    try:
+        response = await call_next(request)
+    except Exception:
+        await run_in_threadpool(release_idempotency_key, collection, record_id)
+        raise
+
+    if response.status_code >= 500 or response.status_code in IDEMPOTENCY_RETRYABLE_STATUSES:
+        # Transient failures (e.g. concurrent completion updates) are not stored, the retry runs again
+        await run_in_threadpool(release_idempotency_key, collection, record_id)
+        return response
+
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    await run_in_threadpool(
+        complete_idempotency_key,
+        collection,
+        record_id,
+        fingerprint,
+        response.status_code,
+        body,
+        response.headers.get("content-type")
+    )
+    return Response(content=body, status_code=response.status_code, headers=dict(response.headers))
+
+requests_in_flight = 0
+profile_store = ProfileStore(PROFILE_HISTORY)
+
+async def should_profile(request: Request) -> bool:
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return True
+    if request.headers.get(PROFILE_HEADER) != "1":
+        return False
+    authorization = request.headers.get("Authorization", "")
+    return authorization.startswith("Bearer ") and await run_in_threadpool(is_admin_token, authorization[len("Bearer "):])
+
+# The middlewares below that must see the whole response are plain ASGI: an @app.middleware("http")
+# returns once the headers are sent, before a StreamingResponse (e.g. /download-file) sends its body.
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not await should_profile(Request(scope)):
+            await self.app(scope, receive, send)
+            return
+
+        profiler = SamplingProfiler(PROFILE_INTERVAL, PROFILE_MAX_DURATION, lambda: requests_in_flight)
+        profile_id = uuid.uuid4().hex
+        status_code = 500
+
+        async def send_with_profile_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", profile_id.encode("latin-1"))]
+            await send(message)
+
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            await run_in_threadpool(profiler.stop)
+            route = scope.get("route")
+            profile_store.add(
+                profiler,
+                profile_id=profile_id,
+                method=scope["method"],
+                route=route.path if route else "unmatched",
+                path=scope["path"],
+                status=status_code
+            )
+
+app.add_middleware(ProfilingMiddleware)
+
+priority_classes = {name: PriorityClass(name, **settings) for name, settings in PRIORITY_CLASSES.items()}
+
+# Outside idempotency and profiling so a rejected request costs no database or threadpool work
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ADMISSION_CONTROL:
+            await self.app(scope, receive, send)
+            return
+
+        route = match_route(app.router.routes, scope)
+        if route:
+            # Lets the metrics label rejected requests by route too, the router sets it again
+            scope["route"] = route
+        priority = priority_classes[ROUTE_PRIORITIES.get(route.path, "interactive") if route else "interactive"]
+        rejected = await priority.acquire(priority_classes)
+        if rejected:
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": "Server is busy, please retry later"},
+                headers={"Retry-After": str(priority.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            # Held until the last body chunk is sent, streamed downloads included
+            await self.app(scope, receive, send)
+        finally:
+            priority.release()
+
+app.add_middleware(AdmissionMiddleware)
+
+# Registered after the idempotency middleware so it wraps it and replays are timed too
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        global requests_in_flight
+        requests_in_flight += 1
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        # The router fills in the route on this same scope, the slow-query log reads it from there
+        current_request_scope.set(scope)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            requests_in_flight -= 1
+            # Label by route template, not by path, so ids in the URL don't create a series each
+            route = scope.get("route")
+            path = route.path if route else "unmatched"
+            http_request_duration.observe(time.perf_counter() - started, method=scope["method"], route=path)
+            http_requests.inc(method=scope["method"], route=path, status=str(status_code))
+
+app.add_middleware(MetricsMiddleware)
+
+def threadpool_usage():
+    # Sync endpoints and run_in_threadpool share anyio's default limiter, only readable on the event loop
+    try:
+        limiter = anyio.to_thread.current_default_thread_limiter()
+    except RuntimeError:
+        return []
+    return [
+        (("busy",), limiter.borrowed_tokens),
+        (("size",), limiter.total_tokens),
+        (("waiting",), limiter.statistics().tasks_waiting)
+    ]
+
+Gauge("http_requests_in_flight", "Requests currently being handled.", [], lambda: [((), requests_in_flight)])
+Gauge("threadpool_threads", "Worker threads for sync endpoints: busy, size, and tasks waiting for one.", ["state"], threadpool_usage)
+Gauge("admission_in_flight", "Requests admitted and running, by priority class.", ["priority"], lambda: [((name,), priority.in_flight) for name, priority in priority_classes.items()])
+Gauge("admission_queue_depth", "Requests waiting for a slot, by priority class.", ["priority"], lambda: [((name,), priority.queue_depth) for name, priority in priority_classes.items()])
+CallbackCounter(
+    "admission_rejections_total",
+    "Requests answered with 503, by priority class and reason (queue_full, timeout, shed).",
+    ["priority", "reason"],
+    lambda: [((name, reason), count) for name, priority in priority_classes.items() for reason, count in sorted(priority.rejections.items())]
+)
+CallbackCounter("cache_hits_total", "In-process cache hits.", ["cache"], lambda: [((cache.name,), cache.hits) for cache in caches()])
+CallbackCounter("cache_misses_total", "In-process cache misses.", ["cache"], lambda: [((cache.name,), cache.misses) for cache in caches()])
+Gauge("cache_entries", "Entries held by in-process caches.", ["cache"], lambda: [((cache.name,), len(cache)) for cache in caches()])
+Gauge("write_behind_pending", "Acknowledged uploads not yet written.", [], lambda: [((), user_file_buffer.stats()["pending"])])
 
 @app.post("/register")
 async def register_user(user: UserRegister, testing: bool = False):
@@ -113,67 +379,417 @@ def refresh_token(refresh_token: str):
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid refresh token")
 
+def resolve_room(code: str, testing: bool):
+    # Only fields that never change after creation are cached
+    room = room_cache.get((testing, code))
+    if room is MISSING:
+        room = get_classroom_data_collection(testing).find_one(
+            {"code": code},
+            {"_id": 0, "owner": 1, "name": 1, "capacity": 1, "timezone": 1, "code": 1}
+        )
+        if not room:
+            return None
+        room_cache.set((testing, code), room, time.time() + ROOM_CACHE_TTL)
+    return dict(room)
+
+def get_room_timezone(room: str, testing: bool):
+    return (resolve_room(room, testing) or {}).get("timezone", "UTC")
+
+startup_state = {"ready": False, "prewarmedRooms": 0, "error": None}
+
+def ping_database() -> float:
+    started = time.perf_counter()
+    storage.ping()
+    return round((time.perf_counter() - started) * 1000, 2)
+
+def daily_puzzle_expiry(timezone_name: str, puzzle) -> float:
+    # Puzzles are kept until the room's midnight. Misses only for ROOM_CACHE_TTL, another instance
+    # may create that day's puzzle and can only invalidate its own cache.
+    expires_at = next_local_midnight(timezone_name)
+    return expires_at if puzzle else min(expires_at, time.time() + ROOM_CACHE_TTL)
+
+def prewarm_caches(testing: bool) -> int:
+    # The most populated rooms and their puzzle of the day, so the first requests after a deploy hit the cache
+    rooms = list(get_classroom_data_collection(testing).find(
+        {"code": {"$exists": True}},
+        {"_id": 0, "owner": 1, "name": 1, "capacity": 1, "timezone": 1, "code": 1}
+    ).sort("members", -1).limit(ROOM_PREWARM_LIMIT))
+
+    expires_at = time.time() + ROOM_CACHE_TTL
+    rooms_by_date = {}
+    for room in rooms:
+        room_cache.set((testing, room["code"]), room, expires_at)
+        rooms_by_date.setdefault(local_today(room.get("timezone", "UTC")), []).append(room)
+
+    collection = get_daily_puzzle_collection(testing)
+    for date, date_rooms in rooms_by_date.items():
+        puzzles = {
+            puzzle.pop("room"): puzzle
+            for puzzle in collection.find(
+                {"date": date, "room": {"$in": [room["code"] for room in date_rooms]}},
+                {"_id": 0, "room": 1, "name": 1, "description": 1, "tests": 1}
+            )
+        }
+        for room in date_rooms:
+            puzzle = puzzles.get(room["code"])
+            daily_puzzle_cache.set((testing, room["code"], date), puzzle, daily_puzzle_expiry(room.get("timezone", "UTC"), puzzle))
+
+    return len(rooms)
+
+def start_up(stop: threading.Event = None):
+    # Mongo may not be reachable yet when the instance boots, keep trying until it is or the app shuts down
+    stop = stop or threading.Event()
+    delay = STARTUP_RETRY_DELAY
+    while True:
+        try:
+            ping_database()
+            missing = ensure_indexes()
+            if missing:
+                logger.warning("Unique indexes could not be built, duplicates exist (run migrations.py): %s", ", ".join(missing))
+            startup_state["prewarmedRooms"] = prewarm_caches(False)
+            startup_state["error"] = None
+            startup_state["ready"] = True
+            return
+        except Exception as e:
+            logger.exception("Start-up failed, retrying in %s seconds", delay)
+            startup_state["error"] = str(e)
+
+        if stop.wait(delay):
+            return
+        delay = min(delay * 2, STARTUP_RETRY_MAX_DELAY)
+
 @app.get("/daily-puzzle/{room}/{date}")
 def get_daily_puzzle(room: str, date: str, testing: bool = False, _: str = Depends(verify_token)):
-    try:
-        datetime.strptime(date, "%Y-%m-%d")
-    except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
-    
-    collection = get_daily_puzzle_collection(testing)
-    puzzle = collection.find_one({"date": date, "room": room})
+    # Misses are cached as None so every student asking for a day without a puzzle doesn't hit the database
+    puzzle = daily_puzzle_cache.get((testing, room, date))
+
+    if puzzle is MISSING:
+        try:
+            # strptime also accepts unpadded dates like 2025-3-1, which never match a stored date
+            valid = datetime.strptime(date, "%Y-%m-%d").strftime("%Y-%m-%d") == date
+        except ValueError:
+            valid = False
+        if not valid:
+            raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
+        
+        collection = get_daily_puzzle_collection(testing)
+        puzzle = collection.find_one({"date": date, "room": room}, {"_id": 0, "name": 1, "description": 1, "tests": 1})
+        daily_puzzle_cache.set((testing, room, date), puzzle, daily_puzzle_expiry(get_room_timezone(room, testing), puzzle))
     
     if not puzzle:
         raise HTTPException(status_code=404, detail="No puzzle available")
 
     return {"name" : puzzle["name"], "description" : puzzle["description"], "tests" : puzzle["tests"]}
 
+@app.get("/daily-puzzles/{room}/{month}")
+def get_daily_puzzles(room: str, month: str, testing: bool = False, _: str = Depends(verify_token)):
+    try:
+        first_day = datetime.strptime(month, "%Y-%m")
+        valid = first_day.strftime("%Y-%m") == month
+    except ValueError:
+        valid = False
+    if not valid:
+        raise HTTPException(status_code=400, detail="Invalid month format. Use YYYY-MM.")
+
+    collection = get_daily_puzzle_collection(testing)
+    # Dates are stored as YYYY-MM-DD strings, so the month is a contiguous range on the (room, date) index
+    puzzles_cursor = collection.find(
+        {"room": room, "date": {"$gte": f"{month}-01", "$lte": f"{month}-31"}},
+        {"_id": 0, "date": 1, "name": 1, "description": 1, "tests": 1}
+    ).sort("date", 1)
+    puzzles = [DailyPuzzle(**puzzle) for puzzle in puzzles_cursor]
+
+    # Prime the per-day cache, including the days without a puzzle
+    timezone_name = get_room_timezone(room, testing)
+    by_date = {puzzle.date: puzzle.model_dump(exclude={"date"}) for puzzle in puzzles}
+    day = first_day
+    while day.month == first_day.month:
+        date = day.strftime("%Y-%m-%d")
+        daily_puzzle_cache.set((testing, room, date), by_date.get(date), daily_puzzle_expiry(timezone_name, by_date.get(date)))
+        day += timedelta(days=1)
+
+    return {"puzzles": puzzles, "room": room}
+
+def flush_pending_user_files(testing: bool, owner: str, room: str):
+    # Reads see the owner's acknowledged but not yet flushed uploads
+    if user_file_buffer.has_pending((testing, owner, room)):
+        user_file_buffer.flush((testing, owner, room))
+
+def present_user_file(file: dict):
+    encoding = file.pop("encoding", None)
+    if file.pop("chunk_version", None):
+        # Too large to inline, the client fetches it through /download-file
+        file.pop("chunk_count", None)
+        file.pop("content", None)
+        file["chunked"] = True
+    else:
+        file["content"] = decompress_content(file["content"], encoding)
+    return file
+
 @app.get("/user-files/{room}/{username}")
-def get_user_files(room: str, username: str, testing: bool = False, current_user: str = Depends(verify_token)):
+def get_user_files(room: str, username: str, metadata: bool = False, limit: int = Query(None, ge=1, le=USER_FILE_PAGE_LIMIT), after: str = Query(None, max_length=24), testing: bool = False, current_user: str = Depends(verify_token)):
     collection = get_user_file_collection(testing)
     
     if username != current_user:
         raise HTTPException(status_code=403, detail="Forbidden: Cannot access another user's files")
+
+    flush_pending_user_files(testing, username, room)
+
+    query = {"room" : room, "owner" : username}
+    if after:
+        if not ObjectId.is_valid(after):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query["_id"] = {"$gt": ObjectId(after)}
+
+    if metadata:
+        # File tree only, content stays in the database
+        projection = {"name": 1, "purpose": 1, "size": 1, "updated_at": 1, "chunk_version": 1}
+    else:
+        projection = None
     
-    files_cursor = collection.find(
-        {"room" : room, "owner" : username},
-        {"_id": 0}
-    )
+    files_cursor = collection.find(query, projection).sort("_id", 1)
+    if limit:
+        files_cursor = files_cursor.limit(limit)
     
-    files = list(files_cursor)
+    files = []
+    last_id = None
+    for file in files_cursor:
+        last_id = file.pop("_id")
+        if metadata:
+            files.append(UserFileMetadata(**file, chunked=bool(file.get("chunk_version"))))
+        else:
+            files.append(present_user_file(file))
+
+    # A full page means there may be more files after the last one
+    next_cursor = str(last_id) if limit and len(files) == limit else None
     
-    return {"files": files, "room": room}
+    return {"files": files, "room": room, "next": next_cursor}
 
-@app.post("/upload-files")
-async def upload_user_files(fileList: UserFileList, testing: bool = False, current_user: str = Depends(verify_token)):
+@app.get("/user-file/{room}/{username}")
+def get_user_file(room: str, username: str, name: str, purpose: str, testing: bool = False, current_user: str = Depends(verify_token)):
+    collection = get_user_file_collection(testing)
+
+    if username != current_user:
+        raise HTTPException(status_code=403, detail="Forbidden: Cannot access another user's files")
+
+    flush_pending_user_files(testing, username, room)
+
+    file = collection.find_one({"room": room, "owner": username, "name": name, "purpose": purpose}, {"_id": 0})
+
+    if not file:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    return present_user_file(file)
+
+@app.get("/download-file/{room}/{username}")
+def download_user_file(room: str, username: str, name: str, purpose: str, testing: bool = False, current_user: str = Depends(verify_token)):
+    collection = get_user_file_collection(testing)
+    chunk_collection = get_user_file_chunk_collection(testing)
+
+    if username != current_user:
+        raise HTTPException(status_code=403, detail="Forbidden: Cannot access another user's files")
+
+    flush_pending_user_files(testing, username, room)
+
+    file = collection.find_one(
+        {"room": room, "owner": username, "name": name, "purpose": purpose},
+        {"_id": 0, "content": 1, "encoding": 1, "chunk_version": 1}
+    )
+
+    if not file:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    return StreamingResponse(
+        iter_file_content(chunk_collection, file),
+        media_type="text/plain; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{quote(name)}"'}
+    )
+
+@app.get("/user-files-manifest/{room}/{username}")
+def get_user_files_manifest(room: str, username: str, testing: bool = False, current_user: str = Depends(verify_token)):
+    collection = get_user_file_collection(testing)
+
+    if username != current_user:
+        raise HTTPException(status_code=403, detail="Forbidden: Cannot access another user's files")
+
+    flush_pending_user_files(testing, username, room)
+
+    files_cursor = collection.find(
+        {"room": room, "owner": username},
+        {"_id": 0, "name": 1, "purpose": 1, "hash": 1, "size": 1, "updated_at": 1}
+    )
+
+    manifest = []
+    for file in files_cursor:
+        if "hash" not in file:
+            # Uploaded before hashes were stored, hash the content once here
+            stored = collection.find_one({"room": room, "owner": username, "name": file["name"], "purpose": file["purpose"]}, {"_id": 0, "content": 1, "encoding": 1}) or {}
+            content = decompress_content(stored.get("content", ""), stored.get("encoding"))
+            file["hash"] = hash_content(content)
+            file["size"] = len(content.encode("utf-8"))
+        manifest.append(UserFileManifestEntry(**file))
+
+    return {"files": manifest, "room": room}
+
+def write_user_files(testing: bool, owner: str, room: str, files):
     collection = get_user_file_collection(testing)
+    chunk_collection = get_user_file_chunk_collection(testing)
+
+    # One query for the stored hashes of the uploaded files, unchanged files are not rewritten
+    stored_files = {}
+    if files:
+        stored_cursor = collection.find(
+            {"owner": owner, "room": room, "name": {"$in": [file.name for file in files]}},
+            {"_id": 0, "name": 1, "purpose": 1, "hash": 1, "chunk_version": 1}
+        )
+        stored_files = {(stored["name"], stored["purpose"]): stored for stored in stored_cursor}
     
     operations = []
+    chunked_operations = []
+    replaced_versions = []
+    skipped = 0
+    updated_at = datetime.now(timezone.utc)
     
-    for file in fileList.files:
-        # Skip files that are mistakenly/maliciously of another user's
-        if file.owner != current_user:
+    for file in files:
+        stored = stored_files.get((file.name, file.purpose), {})
+        content_hash = hash_content(file.content)
+        if stored.get("hash") == content_hash:
+            skipped += 1
             continue
-        operations.append(
-            UpdateOne(
-                {"owner": file.owner, "room": fileList.room, "name": file.name, "purpose": file.purpose},
-                {"$set": file.model_dump()},
-                upsert=True
-            )
-        )
-    
+
+        content, encoding = compress_content(file.content)
+        fields = {
+            **file.model_dump(),
+            "content": content,
+            "encoding": encoding,
+            "hash": content_hash,
+            "size": len(file.content.encode("utf-8")),
+            "updated_at": updated_at
+        }
+        update = {"$set": fields, "$unset": {"chunk_version": "", "chunk_count": ""}}
+
+        # Only applies while the file still points at the chunks read above, so a concurrent upload
+        # of the same file can't leave the chunks it wrote unreferenced
+        query = {
+            "owner": owner, "room": room, "name": file.name, "purpose": file.purpose,
+            "chunk_version": stored["chunk_version"] if stored.get("chunk_version") else {"$exists": False}
+        }
+        if stored.get("chunk_version"):
+            replaced_versions.append(stored["chunk_version"])
+
+        data = content if isinstance(content, bytes) else content.encode("utf-8")
+        if len(data) > USER_FILE_CHUNK_THRESHOLD:
+            # Chunks are written under a fresh version before the file points at them
+            version = uuid.uuid4().hex
+            file_chunks = split_into_chunks(data, USER_FILE_CHUNK_SIZE)
+            del fields["content"]
+            fields["chunk_version"] = version
+            fields["chunk_count"] = len(file_chunks)
+            update["$unset"] = {"content": ""}
+            chunks = [{"version": version, "n": n, "data": chunk} for n, chunk in enumerate(file_chunks)]
+            chunked_operations.append((query, update, not stored, version, chunks))
+        else:
+            operations.append(UpdateOne(query, update, upsert=not stored))
+
+    if not operations and not chunked_operations:
+        return {"message": "No operations", "skipped": skipped}
+
+    matched = upserted = 0
     if operations:
         result = collection.bulk_write(operations)
-    else:
-        return {"message": "No operations"}
+        matched, upserted = result.matched_count, result.upserted_count
+
+    for query, update, upsert, version, chunks in chunked_operations:
+        # One at a time, the result says whether this upload or a concurrent one won
+        chunk_collection.insert_many(chunks)
+        try:
+            result = collection.update_one(query, update, upsert=upsert)
+        except Exception:
+            chunk_collection.delete_many({"version": version})
+            raise
+        if result.matched_count or result.upserted_id is not None:
+            matched += result.matched_count
+            upserted += result.upserted_id is not None
+        else:
+            chunk_collection.delete_many({"version": version})
+
+    if replaced_versions:
+        # No file points at these any more, but downloads may still be streaming them.
+        # The TTL index on retired_at removes them after USER_FILE_CHUNK_GRACE.
+        chunk_collection.update_many({"version": {"$in": replaced_versions}}, {"$set": {"retired_at": datetime.now(timezone.utc)}})
     
     return {
-        "message": f"Successfully updated {result.matched_count} files, inserted {result.upserted_count} new files."
+        "message": f"Successfully updated {matched} files, inserted {upserted} new files.",
+        "skipped": skipped
     }
 
+def flush_user_files(group, files):
+    testing, owner, room = group
+    write_user_files(testing, owner, room, files)
+
+user_file_buffer = WriteBehindBuffer("user_files", USER_FILE_WRITE_BEHIND_WINDOW, flush_user_files)
+
+@app.post("/upload-files")
+async def upload_user_files(fileList: UserFileList, testing: bool = False, current_user: str = Depends(verify_token)):
+    # Skip files that are mistakenly/maliciously of another user's
+    files = [file for file in fileList.files if file.owner == current_user]
+
+    if USER_FILE_WRITE_BEHIND:
+        # Acknowledge now, repeated autosaves of the same file within the window become one write
+        for file in files:
+            user_file_buffer.submit((testing, current_user, fileList.room), (file.name, file.purpose), file)
+        return {"message": f"Queued {len(files)} files", "queued": len(files)}
+
+    return await run_in_threadpool(write_user_files, testing, current_user, fileList.room, files)
+
+@app.get("/write-behind/stats")
+def get_write_behind_stats(_: str = Depends(verify_admin_token)):
+    return {"enabled": USER_FILE_WRITE_BEHIND, "userFiles": user_file_buffer.stats()}
+
+@app.get("/admin/slow-queries")
+def get_slow_queries(limit: int = 20, sort: str = "totalMs", _: str = Depends(verify_admin_token)):
+    if sort not in ("totalMs", "maxMs", "count"):
+        raise HTTPException(status_code=400, detail="sort must be one of totalMs, maxMs, count")
+    return {
+        "thresholdMs": slow_query_log.threshold_ms,
+        "explain": slow_query_log.explain,
+        "queries": slow_query_log.top(limit, sort)
+    }
+
+@app.get("/admin/profiles")
+def get_profiles(route: Optional[str] = None, _: str = Depends(verify_admin_token)):
+    return {"sampleRate": PROFILE_SAMPLE_RATE, "profiles": profile_store.summaries(route)}
+
+@app.get("/admin/profiles/{profile_id}")
+def get_profile(profile_id: str, format: str = "json", _: str = Depends(verify_admin_token)):
+    profile = profile_store.get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "folded":
+        # For flamegraph.pl or speedscope
+        return Response(content="".join(f"{stack} {count}\n" for stack, count in profile["folded"].items()), media_type="text/plain")
+    if format != "json":
+        raise HTTPException(status_code=400, detail="format must be json or folded")
+    summary = {key: value for key, value in profile.items() if key != "folded"}
+    return {**summary, "topFunctions": top_functions(profile["folded"]), "callTree": call_tree(profile["folded"])}
+
 @app.get("/lectures/{room}/{difficulty}")
-def get_lectures(room: str, difficulty: str, testing: bool = False, _: str = Depends(verify_token)):
-    collection = get_lecture_collection(testing)
+@single_flight("room", "difficulty", "summary", "testing")
+def get_lectures(room: str, difficulty: str, summary: bool = False, testing: bool = False, _: str = Depends(verify_token)):
+    collection = get_lecture_read_collection(testing)
+
+    if summary:
+        # List views only need the titles and unlock rules, leave slides and quizzes in the database
+        lectures_cursor = collection.find(
+            {"room": room, "difficulty": difficulty},
+            {"_id": 0, "title": 1, "required": 1, "passmark": 1}
+        )
+        lectures = [LectureSummary(**lecture) for lecture in lectures_cursor]
+
+        if not lectures:
+            raise HTTPException(status_code=404, detail="No lectures found for the given difficulty.")
+
+        return {"lectures": lectures}
     
     count = collection.count_documents({"room": room, "difficulty": difficulty})
     
@@ -210,9 +826,28 @@ def get_lectures(room: str, difficulty: str, testing: bool = False, _: str = Dep
     
     return {"lectures": lectures}
 
+# Titles are free text and may contain "/", so the title is a query parameter
+@app.get("/lecture/{room}/{part}")
+@single_flight("room", "title", "part", "testing")
+def get_lecture_part(room: str, part: str, title: str, testing: bool = False, _: str = Depends(verify_token)):
+    collection = get_lecture_read_collection(testing)
+
+    if part not in ["slides", "quiz"]:
+        raise HTTPException(status_code=400, detail="Invalid lecture part. Choose from slides or quiz.")
+
+    lecture = collection.find_one({"room": room, "title": title}, {"_id": 0, "title": 1, part: 1})
+
+    if not lecture:
+        raise HTTPException(status_code=404, detail="Lecture not found")
+
+    if part == "slides":
+        return {"title": lecture["title"], "slides": [SlideData(**slide) for slide in lecture.get("slides", [])]}
+    return {"title": lecture["title"], "quiz": [QuizData(**quiz) for quiz in lecture.get("quiz", [])]}
+
 @app.get("/guided-projects/{room}")
+@single_flight("room", "testing")
 def get_guided_projects(room: str, testing: bool = False, _: str = Depends(verify_token)):
-    collection = get_guided_projects_collection(testing)
+    collection = get_guided_projects_read_collection(testing)
 
     count = collection.count_documents({"room": room})
 
@@ -248,119 +883,196 @@ def get_guided_projects(room: str, testing: bool = False, _: str = Depends(verif
 @app.get("/user-data/{username}/{room}")
 def get_user_data(username: str, room: str, testing: bool = False, current_user: str = Depends(verify_token)):
     collection = get_user_data_collection(testing)
+    id_collection = get_content_id_collection(testing)
 
     if username != current_user:
         raise HTTPException(status_code=403, detail="Forbidden: Cannot access another user's data")
 
-    count = collection.count_documents({"username" : username, "room": room})
+    user_data = collection.find_one(
+        {"username": username, "room": room},
+        {"_id": 0, "username": 1, "room": 1, "completions": 1, "completion_bits": 1, "level": 1}
+    )
 
-    if count == 0:
+    if not user_data:
         raise HTTPException(status_code=404, detail="No user data found")
-    elif count > 1:
-        raise HTTPException(status_code=409, detail="More than one user data found -> problem :(")
-
-    user_data_cursor = collection.find_one({"username" : username, "room": room})
-    user_data = UserData(
-            username=user_data_cursor.get("username"),
-            completions=CompletionData(
-                lectures=user_data_cursor["completions"]["lectures"],
-                projects=user_data_cursor["completions"]["projects"],
-                puzzles=user_data_cursor["completions"]["puzzles"]
-            ),
-            room=user_data_cursor.get("room"),
-            level=user_data_cursor.get("level")
-    )
 
-    return user_data
+    return UserData(
+        username=user_data.get("username"),
+        completions=CompletionData(**read_completions(id_collection, user_data, room)),
+        room=user_data.get("room"),
+        level=user_data.get("level")
+    )
 
 @app.post("/user-data")
 def create_user_data(user_data: UserData, testing: bool = False, current_user: str = Depends(verify_token)):
     collection = get_user_data_collection(testing)
+    id_collection = get_content_id_collection(testing)
 
     if user_data.username != current_user:
         raise HTTPException(status_code=403, detail="Forbidden: Cannot access another user's data")
 
-    result = collection.update_one(
-        {"username": user_data.username, "room": user_data.room, "level": "easy"},
-        {"$set": {
-            "completions.lectures": user_data.completions.lectures,
-            "completions.projects": user_data.completions.projects,
-            "completions.puzzles": user_data.completions.puzzles
-        }},
-        upsert=True  # Creates a new document if one doesn’t exist
-    )
+    # Creating the user's data makes them a member, which takes a seat like /join-room
+    member = collection.find_one({"username": user_data.username, "room": user_data.room}, {"_id": 1})
+    if not member:
+        room = resolve_room(user_data.room, testing)
+        if not room:
+            raise HTTPException(status_code=404, detail="Room code doesn't exist")
+        take_room_seat(get_classroom_data_collection(testing), room)
+
+    try:
+        result = collection.update_one(
+            {"username": user_data.username, "room": user_data.room, "level": "easy"},
+            {
+                "$set": encode_completions(id_collection, user_data.room, user_data.completions.model_dump()),
+                "$unset": {"completions": ""}
+            },
+            upsert=True  # Creates a new document if one doesn’t exist
+        )
+    except DuplicateKeyError:
+        # The unique (username, room) index rejected a second document for this user
+        if not member:
+            release_room_seat(get_classroom_data_collection(testing), user_data.room)
+        raise HTTPException(status_code=409, detail="User data already exists for this room")
 
     if result.matched_count:
         return {"message": "User data updated successfully"}
     else:
         return {"message": "User data created successfully"}
 
+def promote_if_complete(collection, lectures_collection, username: str, room: str, current_difficulty: str, completed_lectures):
+    lectures_in_difficulty = lectures_collection.find(
+        {"room": room, "difficulty": current_difficulty},
+        {"_id": 0, "title": 1}
+    )
+    lecture_titles = [lecture["title"] for lecture in lectures_in_difficulty]
+
+    # Check if all lectures in this difficulty are completed
+    if lecture_titles and all(title in completed_lectures for title in lecture_titles):
+        next_level = get_next_level(current_difficulty)
+        if next_level:
+            collection.update_one(
+                {"username": username, "room": room},
+                {"$set": {"level": next_level}}
+            )
+            return next_level
+    return None
+
+def promote_after_completion(collection, lectures_collection, id_collection, username: str, room: str, user: dict, added_lectures):
+    completed_lectures = set(read_completions(id_collection, user, room)["lectures"])
+    completed_lectures.update(added_lectures)
+    return promote_if_complete(collection, lectures_collection, username, room, user.get("level", "easy"), completed_lectures)
+
 @app.post("/update-lecture-completion")
 def update_lecture_completion(request: LectureCompletionRequest, testing: bool = False, current_user: str = Depends(verify_token)):
     collection = get_user_data_collection(testing)
     lectures_collection = get_lecture_collection(testing)
+    id_collection = get_content_id_collection(testing)
 
     if request.username != current_user:
         raise HTTPException(status_code=403, detail="Forbidden: Cannot access another user's data")
 
-    result = collection.update_one(
-        {"username": request.username, "room": request.room},
-        {"$addToSet": {"completions.lectures": request.lecture}}
-    )
+    user, added = add_completions(collection, id_collection, request.username, request.room, {"lectures": [request.lecture]})
 
     # If update was successful, check for promotion
-    if result.modified_count:
-        # Get user document
-        user = collection.find_one({"username": request.username, "room": request.room})
-
-        current_difficulty = user.get("level", "easy")
-        completed_lectures = user.get("completions", {}).get("lectures", [])
-
-        lectures_in_difficulty = list(lectures_collection.find({
-            "room": request.room,
-            "difficulty": current_difficulty
-        }))
-        lecture_titles = [lecture["title"] for lecture in lectures_in_difficulty]
-
-        # Check if all lectures in this difficulty are completed
-        if lecture_titles and all(title in completed_lectures for title in lecture_titles):
-            next_level = get_next_level(current_difficulty)
-            if next_level:
-                collection.update_one(
-                    {"username": request.username, "room": request.room},
-                    {"$set": {"level": next_level}}
-                )
-                return {"message": f"Promoted to {next_level} level"}
+    if user and added["lectures"]:
+        next_level = promote_after_completion(
+            collection,
+            lectures_collection,
+            id_collection,
+            request.username,
+            request.room,
+            user,
+            added["lectures"]
+        )
+        if next_level:
+            return {"message": f"Promoted to {next_level} level"}
+        return {"message": "Lectures completion updated successfully"}
 
-    return {"message": "Lectures completion updated successfully"} if result.modified_count else {"message": "No changes made"}
+    return {"message": "No changes made"}
 
 @app.post("/update-project-completion")
 def update_project_completion(request: ProjectCompletionRequest, testing: bool = False, current_user: str = Depends(verify_token)):
     collection = get_user_data_collection(testing)
+    id_collection = get_content_id_collection(testing)
 
     if request.username != current_user:
         raise HTTPException(status_code=403, detail="Forbidden: Cannot access another user's data")
 
-    result = collection.update_one(
-        {"username": request.username, "room": request.room},
-        {"$addToSet": {"completions.projects": request.project}}
-    )
+    user, added = add_completions(collection, id_collection, request.username, request.room, {"projects": [request.project]})
     
-    return {"message": "Projects completion updated successfully"} if result.modified_count else {"message": "No changes made"}
+    return {"message": "Projects completion updated successfully"} if user and added["projects"] else {"message": "No changes made"}
 
 @app.post("/update-puzzle-completion")
 def update_puzzle_completion(request: PuzzleCompletionRequest, testing: bool = False, current_user: str = Depends(verify_token)):
     collection = get_user_data_collection(testing)
+    id_collection = get_content_id_collection(testing)
 
     if request.username != current_user:
         raise HTTPException(status_code=403, detail="Forbidden: Cannot access another user's data")
     
-    result = collection.update_one(
-        {"username": request.username, "room": request.room},
-        {"$addToSet": {"completions.puzzles": request.puzzle}}
-    )
+    user, added = add_completions(collection, id_collection, request.username, request.room, {"puzzles": [request.puzzle]})
     
-    return {"message": "Puzzles completion updated successfully"} if result.modified_count else {"message": "No changes made"}
+    return {"message": "Puzzles completion updated successfully"} if user and added["puzzles"] else {"message": "No changes made"}
+
+@app.post("/update-completions")
+def update_completions(request: CompletionBatchRequest, testing: bool = False, current_user: str = Depends(verify_token)):
+    collection = get_user_data_collection(testing)
+    lectures_collection = get_lecture_collection(testing)
+    id_collection = get_content_id_collection(testing)
+
+    if request.username != current_user:
+        raise HTTPException(status_code=403, detail="Forbidden: Cannot access another user's data")
+
+    # Group the events per completion list so they can be applied in a single update
+    additions = {field: [] for field in COMPLETION_FIELDS.values()}
+    for event in request.events:
+        field = COMPLETION_FIELDS.get(event.type)
+        if field and event.title not in additions[field]:
+            additions[field].append(event.title)
+
+    # Titles without a content id are not content of the room, report them as invalid
+    known = {field: set(get_content_ids(id_collection, request.room, field, titles)) for field, titles in additions.items()}
+    additions = {field: [title for title in titles if title in known[field]] for field, titles in additions.items()}
+
+    if not any(additions.values()):
+        results = [CompletionResult(type=event.type, title=event.title, status="invalid") for event in request.events]
+        return {"message": "No changes made", "results": results}
+
+    user, added = add_completions(collection, id_collection, request.username, request.room, additions)
+
+    if not user:
+        raise HTTPException(status_code=404, detail="No user data found")
+
+    newly_completed = {field: set(titles) for field, titles in added.items()}
+
+    results = []
+    for event in request.events:
+        field = COMPLETION_FIELDS.get(event.type)
+        if not field or event.title not in known[field]:
+            status = "invalid"
+        elif event.title in newly_completed[field]:
+            status = "completed"
+            newly_completed[field].discard(event.title)
+        else:
+            status = "unchanged"
+        results.append(CompletionResult(type=event.type, title=event.title, status=status))
+
+    if added["lectures"]:
+        next_level = promote_after_completion(
+            collection,
+            lectures_collection,
+            id_collection,
+            request.username,
+            request.room,
+            user,
+            added["lectures"]
+        )
+        if next_level:
+            return {"message": f"Promoted to {next_level} level", "results": results}
+
+    if any(added.values()):
+        return {"message": "Completions updated successfully", "results": results}
+    return {"message": "No changes made", "results": results}
 
 @app.post("/execute-code")
 def execute_code(request: CodeRequest, _: str = Depends(verify_token)):
@@ -374,7 +1086,13 @@ def execute_code(request: CodeRequest, _: str = Depends(verify_token)):
         with open(temp_file, "w") as f:
             f.write(request.code)
         
-        result = subprocess.run(["python", temp_file], capture_output=True, text=True, timeout=10)
+        started = time.perf_counter()
+        try:
+            result = subprocess.run(["python", temp_file], capture_output=True, text=True, timeout=10)
+        except subprocess.TimeoutExpired:
+            code_execution_duration.observe(time.perf_counter() - started, outcome="timeout")
+            raise
+        code_execution_duration.observe(time.perf_counter() - started, outcome="success" if result.returncode == 0 else "error")
 
         if result.returncode != 0:
             clean_error = extract_error_message(result.stderr)
@@ -475,23 +1193,28 @@ def create_room(request: RoomData, testing: bool = False, current_tutor: str = D
 
     if collection.find_one({"name": request.name}):
         raise HTTPException(status_code=400, detail="Name for classroom already taken")
+
+    if not verify_valid_timezone(request.timezone):
+        raise HTTPException(status_code=400, detail="Invalid timezone. Use an IANA name such as Europe/Bucharest.")
     
     if testing:
         access_code = 'ABC123'
     else:
         access_code = generate_access_code()
 
-    # Make sure code is unique
-    while collection.find_one({"code": access_code}):
+    # Make sure code is unique, including rooms whose content was removed too recently
+    while collection.find_one({"code": access_code}) or room_code_reserved(get_room_cleanup_collection(testing), access_code):
         access_code = generate_access_code()
 
     room_data = {
         "owner": request.owner,
         "name": request.name,
         "capacity": request.capacity,
+        "timezone": request.timezone,
         "code" : access_code
     }
     collection.insert_one(room_data)
+    room_cache.invalidate((testing, access_code))
 
     return {"message": "Classroom created with success!", "code": access_code}
 
@@ -513,34 +1236,99 @@ def get_rooms(owner: str, testing: bool = False, current_tutor: str = Depends(ve
 
 @app.get("/room/{code}")
 def get_room_by_code(code: str, testing: bool = False, _: str = Depends(verify_token)):
-    collection = get_classroom_data_collection(testing)
+    room = resolve_room(code, testing)
 
-    room = collection.find_one(
-        {"code": code},
-        {"_id": 0}
+    if not room:
+        raise HTTPException(status_code=404, detail="Room code doesn't exist")
+
+    return room
+
+def take_room_seat(collection, room: dict):
+    # Take a seat only while the counter is below capacity, concurrent joins cannot overfill the room
+    result = collection.update_one(
+        {"code": room["code"], "$or": [{"members": {"$lt": room["capacity"]}}, {"members": {"$exists": False}}]},
+        {"$inc": {"members": 1}}
     )
+    if not result.modified_count:
+        raise HTTPException(status_code=409, detail="Room is full")
+
+def release_room_seat(collection, code: str):
+    collection.update_one({"code": code}, {"$inc": {"members": -1}})
+
+@app.post("/join-room")
+def join_room(request: JoinRoomRequest, testing: bool = False, current_user: str = Depends(verify_token)):
+    collection = get_classroom_data_collection(testing)
+    user_data_collection = get_user_data_collection(testing)
+    id_collection = get_content_id_collection(testing)
+
+    if request.username != current_user:
+        raise HTTPException(status_code=403, detail="Forbidden: Cannot access another user's data")
 
+    room = resolve_room(request.code, testing)
     if not room:
         raise HTTPException(status_code=404, detail="Room code doesn't exist")
 
-    return room
+    if user_data_collection.find_one({"username": request.username, "room": request.code}, {"_id": 1}):
+        return {"message": "Already a member of this room", "room": request.code}
+
+    take_room_seat(collection, room)
+
+    try:
+        result = user_data_collection.update_one(
+            {"username": request.username, "room": request.code},
+            {"$setOnInsert": {"level": "easy", **encode_completions(id_collection, request.code, {})}},
+            upsert=True
+        )
+        joined = result.upserted_id is not None
+    except DuplicateKeyError:
+        joined = False
+
+    if not joined:
+        # A concurrent join for the same user created the data first, give the seat back
+        release_room_seat(collection, request.code)
+        return {"message": "Already a member of this room", "room": request.code}
+
+    return {"message": "Joined room successfully", "room": request.code}
+
+def cleanup_room(testing: bool, code: str):
+    # Uploads still buffered for the room would otherwise be written after the cleanup
+    user_file_buffer.flush()
+    if run_room_cleanup(get_room_cleanup_collection(testing), get_room_scoped_collections(testing), code):
+        clear_content_id_cache()
+        daily_puzzle_cache.clear()
 
 @app.delete("/delete-room/{code}")
-def delete_room_by_code(code: str, testing: bool = False, current_tutor: str = Depends(verify_tutor_token)):
+def delete_room_by_code(code: str, background_tasks: BackgroundTasks, testing: bool = False, current_tutor: str = Depends(verify_tutor_token)):
     collection = get_classroom_data_collection(testing)
 
-    room = collection.find_one({"code": code})
+    room = resolve_room(code, testing)
     if not room:
         raise HTTPException(status_code=404, detail="Room not found")
     
     if room.get("owner") != current_tutor:
         raise HTTPException(status_code=403, detail="Forbidden: Cannot access another tutor's rooms")
 
+    # The job is recorded before the room disappears so a crash in between cannot orphan its content
+    create_room_cleanup_job(get_room_cleanup_collection(testing), code, current_tutor)
     collection.delete_one({"code": code})
+    room_cache.invalidate((testing, code))
+    background_tasks.add_task(cleanup_room, testing, code)
     
     return {"message": "Room deleted successfully"}
 
+@app.get("/room-cleanup/{code}")
+def get_room_cleanup(code: str, testing: bool = False, current_tutor: str = Depends(verify_tutor_token)):
+    job = get_room_cleanup_job(get_room_cleanup_collection(testing), code)
+    if not job:
+        raise HTTPException(status_code=404, detail="No cleanup found for this room")
+
+    if job.get("requested_by") != current_tutor:
+        raise HTTPException(status_code=403, detail="Forbidden: Cannot access another tutor's rooms")
+
+    return job
+
 @app.get("/leaderboard/{room}")
+@single_flight("room", "testing")
 def get_leaderboard(room: str, testing: bool = False, _: str = Depends(verify_token)):
     collection = get_user_data_collection(testing)
 
@@ -551,9 +1339,9 @@ def get_leaderboard(room: str, testing: bool = False, _: str = Depends(verify_to
             "username": 1,
             "score": {
                 "$add": [
-                    {"$multiply": [{"$size": {"$ifNull": ["$completions.lectures", []]}}, 5]},
-                    {"$multiply": [{"$size": {"$ifNull": ["$completions.puzzles", []]}}, 20]},
-                    {"$multiply": [{"$size": {"$ifNull": ["$completions.projects", []]}}, 10]}
+                    {"$multiply": [{"$ifNull": ["$completion_counts.lectures", {"$size": {"$ifNull": ["$completions.lectures", []]}}]}, 5]},
+                    {"$multiply": [{"$ifNull": ["$completion_counts.puzzles", {"$size": {"$ifNull": ["$completions.puzzles", []]}}]}, 20]},
+                    {"$multiply": [{"$ifNull": ["$completion_counts.projects", {"$size": {"$ifNull": ["$completions.projects", []]}}]}, 10]}
                 ]
             }
         }},
@@ -567,12 +1355,60 @@ def get_leaderboard(room: str, testing: bool = False, _: str = Depends(verify_to
 
     return leaderboard
 
+def validate_challenge(challenge: ChallengeData):
+    if not verify_valid_date(challenge.date):
+        return "Invalid date format. Use YYYY-MM-DD."
+    return None
+
+def validate_lecture(lecture: LectureData):
+    if lecture.difficulty not in ["easy", "intermediate", "advanced"]:
+        return "Invalid difficulty level. Choose from easy, intermediate, or advanced."
+    return None
+
+def validate_project(project: GuidedProjectData):
+    if project.difficulty not in ["easy", "intermediate", "advanced"]:
+        return "Invalid difficulty level. Choose from easy, intermediate, or advanced."
+    
+    for step in project.steps:
+        if step.code.count('____') != 1:
+            return "Each step's code must contain exactly one '____' as placeholder."
+    return None
+
+def challenge_document(challenge: ChallengeData):
+    return {
+        "date": challenge.date,
+        "name": challenge.name,
+        "description": challenge.description,
+        "tests": challenge.tests,
+        "room": challenge.room
+    }
+
+def lecture_document(lecture: LectureData):
+    return {
+        "title": lecture.title,
+        "difficulty": lecture.difficulty,
+        "slides": [slide.model_dump() for slide in lecture.slides],
+        "quiz": [quiz.model_dump() for quiz in lecture.quiz],
+        "required": lecture.required,
+        "passmark": lecture.passmark,
+        "room": lecture.room
+    }
+
+def project_document(project: GuidedProjectData):
+    return {
+        "name": project.name,
+        "description": project.description,
+        "difficulty": project.difficulty,
+        "steps": [step.model_dump() for step in project.steps],
+        "solution": project.solution,
+        "room": project.room
+    }
+
 @app.post("/create-challenge")
 def create_challenge(challenge: ChallengeData, testing: bool = False, current_tutor: str = Depends(verify_tutor_token)):
     collection = get_daily_puzzle_collection(testing)
-    classroom_date = get_classroom_data_collection(testing)
 
-    room = classroom_date.find_one({"code": challenge.room})
+    room = resolve_room(challenge.room, testing)
     if not room:
         raise HTTPException(status_code=404, detail="Room not found")
     
@@ -583,27 +1419,21 @@ def create_challenge(challenge: ChallengeData, testing: bool = False, current_tu
     if existing_challenge:
         raise HTTPException(status_code=400, detail="Challenge for this date already exists")
     
-    if not verify_valid_date(challenge.date):
-        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.") 
-
-    new_challenge = {
-        "date": challenge.date,
-        "name": challenge.name,
-        "description": challenge.description,
-        "tests": challenge.tests,
-        "room": challenge.room
-    }
+    error = validate_challenge(challenge)
+    if error:
+        raise HTTPException(status_code=400, detail=error) 
     
-    collection.insert_one(new_challenge)
+    collection.insert_one(challenge_document(challenge))
+    register_content(get_content_id_collection(testing), challenge.room, "puzzles", [challenge.date])
+    daily_puzzle_cache.invalidate((testing, challenge.room, challenge.date))
     
     return {"message": "Challenge created successfully!"}
 
 @app.post("/create-lecture")
 def create_lecture(lecture: LectureData, testing: bool = False, current_tutor: str = Depends(verify_tutor_token)):
     collection = get_lecture_collection(testing)
-    classroom_data = get_classroom_data_collection(testing)
 
-    room = classroom_data.find_one({"code": lecture.room})
+    room = resolve_room(lecture.room, testing)
     if not room:
         raise HTTPException(status_code=404, detail="Room not found")
     
@@ -614,29 +1444,20 @@ def create_lecture(lecture: LectureData, testing: bool = False, current_tutor: s
     if existing_lecture:
         raise HTTPException(status_code=400, detail="Lecture with this title already exists in the room")
     
-    if lecture.difficulty not in ["easy", "intermediate", "advanced"]:
-        raise HTTPException(status_code=400, detail="Invalid difficulty level. Choose from easy, intermediate, or advanced.")
-
-    new_lecture = {
-        "title": lecture.title,
-        "difficulty": lecture.difficulty,
-        "slides": [slide.model_dump() for slide in lecture.slides],
-        "quiz": [quiz.model_dump() for quiz in lecture.quiz],
-        "required": lecture.required,
-        "passmark": lecture.passmark,
-        "room": lecture.room
-    }
+    error = validate_lecture(lecture)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
     
-    collection.insert_one(new_lecture)
+    collection.insert_one(lecture_document(lecture))
+    register_content(get_content_id_collection(testing), lecture.room, "lectures", [lecture.title])
     
     return {"message": "Lecture created successfully!"}
 
 @app.post("/create-project")
 def create_project(project: GuidedProjectData, testing: bool = False, current_tutor: str = Depends(verify_tutor_token)):
     collection = get_guided_projects_collection(testing)
-    classroom_data = get_classroom_data_collection(testing)
 
-    room = classroom_data.find_one({"code": project.room})
+    room = resolve_room(project.room, testing)
     if not room:
         raise HTTPException(status_code=404, detail="Room not found")
     
@@ -647,40 +1468,102 @@ def create_project(project: GuidedProjectData, testing: bool = False, current_tu
     if existing_project:
         raise HTTPException(status_code=400, detail="Project with this name already exists in the room")
     
-    if project.difficulty not in ["easy", "intermediate", "advanced"]:
-        raise HTTPException(status_code=400, detail="Invalid difficulty level. Choose from easy, intermediate, or advanced.")
-    
-    for step in project.steps:
-        if step.code.count('____') != 1:
-            raise HTTPException(status_code=400, detail="Each step's code must contain exactly one '____' as placeholder.")
-
-    new_project = {
-        "name": project.name,
-        "description": project.description,
-        "difficulty": project.difficulty,
-        "steps": [step.model_dump() for step in project.steps],
-        "solution": project.solution,
-        "room": project.room
-    }
+    error = validate_project(project)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
     
-    collection.insert_one(new_project)
+    collection.insert_one(project_document(project))
+    register_content(get_content_id_collection(testing), project.room, "projects", [project.name])
     
     return {"message": "Project created successfully!"}
 
+@app.post("/import-content")
+def import_content(pack: ContentPack, testing: bool = False, current_tutor: str = Depends(verify_tutor_token)):
+    room = resolve_room(pack.room, testing)
+    if not room:
+        raise HTTPException(status_code=404, detail="Room not found")
+    
+    if room.get("owner") != current_tutor:
+        raise HTTPException(status_code=403, detail="Forbidden: Cannot access another tutor's rooms")
+
+    # Content that already exists is only detected by the unique indexes, never import without them
+    try:
+        ensure_content_indexes(get_lecture_collection(testing), get_guided_projects_collection(testing))
+        ensure_daily_puzzle_index(get_daily_puzzle_collection(testing))
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Duplicate content exists, run the migrations before importing")
+
+    sections = [
+        ("lecture", "lectures", pack.lectures, lambda item: item.title, validate_lecture, lecture_document, get_lecture_collection(testing)),
+        ("project", "projects", pack.projects, lambda item: item.name, validate_project, project_document, get_guided_projects_collection(testing)),
+        ("challenge", "puzzles", pack.challenges, lambda item: item.date, validate_challenge, challenge_document, get_daily_puzzle_collection(testing))
+    ]
+
+    results = []
+    for kind, completion_kind, items, key_of, validate, to_document, collection in sections:
+        # Validate everything first, then one insert_many per collection
+        documents = []
+        seen = set()
+        for item in items:
+            result = ImportResult(type=kind, key=key_of(item), status="created")
+            results.append(result)
+
+            error = validate(item)
+            if item.room != pack.room:
+                error = "Item room does not match the pack room"
+            elif not error and key_of(item) in seen:
+                result.status = "duplicate"
+                result.detail = "Duplicate within the content pack"
+                continue
+            if error:
+                result.status = "invalid"
+                result.detail = error
+                continue
+
+            seen.add(key_of(item))
+            documents.append((result, to_document(item)))
+
+        if not documents:
+            continue
+
+        try:
+            collection.insert_many([document for _, document in documents], ordered=False)
+        except BulkWriteError as e:
+            # The unique (room, title/name/date) indexes reject items that already exist
+            for write_error in e.details["writeErrors"]:
+                result = documents[write_error["index"]][0]
+                if write_error["code"] == 11000:
+                    result.status = "duplicate"
+                    result.detail = "Already exists in the room"
+                else:
+                    result.status = "failed"
+                    result.detail = write_error.get("errmsg")
+
+        created = [result.key for result, _ in documents if result.status == "created"]
+        if created:
+            register_content(get_content_id_collection(testing), pack.room, completion_kind, created)
+
+    for challenge in pack.challenges:
+        daily_puzzle_cache.invalidate((testing, pack.room, challenge.date))
+
+    created = sum(1 for result in results if result.status == "created")
+    return {"message": f"Imported {created} of {len(results)} items", "results": results}
+
 @app.get("/inventory/{username}/{room}")
 def get_inventory(username: str, room: str, testing: bool = False, current_user: str = Depends(verify_token)):
     collection = get_user_data_collection(testing)
-    projects_collection = get_guided_projects_collection(testing)
+    projects_collection = get_guided_projects_read_collection(testing)
+    id_collection = get_content_id_collection(testing)
 
     if username != current_user:
         raise HTTPException(status_code=403, detail="Forbidden: Cannot access another user's inventory")
 
-    user_data = collection.find_one({"username": username, "room": room}, {"_id": 0})
+    user_data = collection.find_one({"username": username, "room": room}, {"_id": 0, "completions": 1, "completion_bits": 1})
 
     if not user_data:
         raise HTTPException(status_code=404, detail="User data not found")
 
-    completed_projects = user_data.get("completions", {}).get("projects", [])
+    completed_projects = read_completions(id_collection, user_data, room)["projects"]
     if not completed_projects:
         return {"items" : []}
 
@@ -693,6 +1576,78 @@ def get_inventory(username: str, room: str, testing: bool = False, current_user:
 
     return {"items" : inventory}
 
+@app.get("/bootstrap/{username}/{room}")
+async def get_bootstrap(username: str, room: str, fields: str = None, difficulty: str = None, date: str = None, summary: bool = False, testing: bool = False, current_user: str = Depends(verify_token)):
+    if username != current_user:
+        raise HTTPException(status_code=403, detail="Forbidden: Cannot access another user's data")
+
+    requested = [field for field in fields.split(",") if field] if fields else BOOTSTRAP_FIELDS
+    unknown = [field for field in requested if field not in BOOTSTRAP_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown bootstrap fields: {', '.join(unknown)}")
+
+    def load_daily_puzzle():
+        # Resolving the room's timezone may query the database, so it runs in the threadpool with the loader
+        return get_daily_puzzle(room, date or local_today(get_room_timezone(room, testing)), testing, current_user)
+
+    def load_lectures():
+        level = difficulty
+        if not level:
+            # Default to the lectures of the student's current level
+            user = get_user_data_collection(testing).find_one({"username": username, "room": room}, {"_id": 0, "level": 1})
+            level = (user or {}).get("level") or "easy"
+        return get_lectures(room, level, summary, testing, current_user)["lectures"]
+
+    # The token was verified once above, the loaders call the route handlers directly
+    loaders = {
+        "userData": lambda: get_user_data(username, room, testing, current_user),
+        "lectures": load_lectures,
+        "guidedProjects": lambda: get_guided_projects(room, testing, current_user)["guidedProjects"],
+        "dailyPuzzle": load_daily_puzzle,
+        "inventory": lambda: get_inventory(username, room, testing, current_user)["items"],
+        "leaderboard": lambda: get_leaderboard(room, testing, current_user).leaderboard
+    }
+
+    async def load(field):
+        try:
+            return await run_in_threadpool(loaders[field]), None
+        except HTTPException as e:
+            return None, {"status": e.status_code, "detail": e.detail}
+
+    results = await asyncio.gather(*(load(field) for field in requested))
+
+    response = {"errors": {}}
+    for field, (value, error) in zip(requested, results):
+        response[field] = value
+        if error:
+            response["errors"][field] = error
+
+    return response
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/health/live")
+def liveness():
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+def readiness():
+    if not startup_state["ready"]:
+        return JSONResponse(status_code=503, content={"status": "starting", "error": startup_state["error"]})
+
+    try:
+        latency = ping_database()
+    except PyMongoError as e:
+        return JSONResponse(status_code=503, content={"status": "unavailable", "error": str(e)})
+
+    return {
+        "status": "ready",
+        "prewarmedRooms": startup_state["prewarmedRooms"],
+        "mongo": {"pingMs": latency, "pool": pool_stats.snapshot()}
+    }
+
 @app.get("/")
 def home():
     return {"message": "FastAPI MongoDB Backend is Running!"}
@@ -0,0 +1,622 @@
+import copy
+import re
+import threading
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ReadPreference, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.operations import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+# An in-process stand-in for the subset of pymongo's Collection the app uses.
+# Documents are deep-copied on the way in and out, unique indexes are enforced and equality
+# lookups on indexed fields avoid a full scan. TTL indexes are accepted but never expire anything.
+
+_MISSING = object()
+
+def _get(document, path: str):
+    value = document
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        else:
+            return _MISSING
+    return value
+
+def _set(document, path: str, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.setdefault(part, {})
+    document[parts[-1]] = value
+
+def _unset(document, path: str):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.get(part)
+        if not isinstance(document, dict):
+            return
+    document.pop(parts[-1], None)
+
+def _type_rank(value):
+    if value is None or value is _MISSING:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, bytes):
+        return 6
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+def _sort_key(value):
+    rank = _type_rank(value)
+    if rank == 1:
+        return (rank, 0)
+    if rank in (4, 5):
+        return (rank, repr(value))
+    return (rank, value)
+
+def _compare(value, operand, operator):
+    # Comparisons only match values of the same BSON type bracket, like the server
+    if value is _MISSING or _type_rank(value) != _type_rank(operand) or _type_rank(value) == 1:
+        return False
+    return operator(value, operand)
+
+_COMPARISONS = {
+    "$gt": lambda a, b: a > b,
+    "$gte": lambda a, b: a >= b,
+    "$lt": lambda a, b: a < b,
+    "$lte": lambda a, b: a <= b
+}
+
+_TYPES = {
+    "string": str,
+    "int": int,
+    "long": int,
+    "double": float,
+    "bool": bool,
+    "object": dict,
+    "array": list,
+    "binData": bytes,
+    "objectId": ObjectId,
+    "date": datetime,
+    "null": type(None)
+}
+
+def _equals(value, operand):
+    if operand is None:
+        return value is _MISSING or value is None
+    if value is _MISSING:
+        return False
+    if isinstance(value, list) and not isinstance(operand, list):
+        return any(_equals(item, operand) for item in value)
+    return _type_rank(value) == _type_rank(operand) and value == operand
+
+def _match_operators(value, conditions: dict) -> bool:
+    for operator, operand in conditions.items():
+        if operator == "$eq":
+            matched = _equals(value, operand)
+        elif operator == "$ne":
+            matched = not _equals(value, operand)
+        elif operator in _COMPARISONS:
+            matched = _compare(value, operand, _COMPARISONS[operator])
+        elif operator == "$in":
+            matched = any(_equals(value, item) for item in operand)
+        elif operator == "$nin":
+            matched = not any(_equals(value, item) for item in operand)
+        elif operator == "$exists":
+            matched = (value is not _MISSING) == bool(operand)
+        elif operator == "$regex":
+            matched = isinstance(value, str) and re.search(operand, value) is not None
+        elif operator == "$type":
+            matched = value is not _MISSING and isinstance(value, _TYPES[operand]) and not (operand != "bool" and isinstance(value, bool))
+        else:
+            raise OperationFailure(f"Unsupported query operator {operator}")
+        if not matched:
+            return False
+    return True
+
+def matches(document: dict, query: dict) -> bool:
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(matches(document, clause) for clause in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(document, clause) for clause in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(document, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict) and condition and all(operator.startswith("$") for operator in condition):
+            if not _match_operators(_get(document, key), condition):
+                return False
+        elif not _equals(_get(document, key), condition):
+            return False
+    return True
+
+def _project(document: dict, projection):
+    if not projection:
+        return document
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+
+    include_id = bool(projection.get("_id", 1))
+    fields = {field: value for field, value in projection.items() if field != "_id"}
+
+    if fields and all(fields.values()):
+        projected = {}
+        if include_id and "_id" in document:
+            projected["_id"] = document["_id"]
+        for field in fields:
+            value = _get(document, field)
+            if value is not _MISSING:
+                _set(projected, field, value)
+        return projected
+
+    projected = dict(document)
+    for field in fields:
+        _unset(projected, field)
+    if not include_id:
+        projected.pop("_id", None)
+    return projected
+
+def _equality_seed(query: dict) -> dict:
+    # An upsert starts from the plain equality conditions of its filter
+    seed = {}
+    for key, condition in (query or {}).items():
+        if key.startswith("$"):
+            continue
+        if isinstance(condition, dict) and condition and all(operator.startswith("$") for operator in condition):
+            if "$eq" in condition:
+                _set(seed, key, copy.deepcopy(condition["$eq"]))
+            continue
+        _set(seed, key, copy.deepcopy(condition))
+    return seed
+
+def _apply_update(document: dict, update: dict, inserting: bool) -> bool:
+    if not any(key.startswith("$") for key in update):
+        raise ValueError("update only works with $ operators")
+
+    before = copy.deepcopy(document)
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            if operator == "$set" or (operator == "$setOnInsert" and inserting):
+                _set(document, path, copy.deepcopy(value))
+            elif operator == "$setOnInsert":
+                continue
+            elif operator == "$unset":
+                _unset(document, path)
+            elif operator == "$inc":
+                current = _get(document, path)
+                _set(document, path, (0 if current is _MISSING else current) + value)
+            elif operator == "$addToSet":
+                current = _get(document, path)
+                items = [] if current is _MISSING else current
+                additions = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                for item in additions:
+                    if item not in items:
+                        items.append(copy.deepcopy(item))
+                _set(document, path, items)
+            else:
+                raise OperationFailure(f"Unsupported update operator {operator}")
+    return document != before
+
+class MemoryCursor:
+    def __init__(self, documents, projection):
+        self._documents = documents
+        self._projection = projection
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+        self._iterator = None
+
+    def sort(self, key_or_list, direction=1):
+        self._sort = [(key_or_list, direction)] if isinstance(key_or_list, str) else list(key_or_list)
+        return self
+
+    def skip(self, count: int):
+        self._skip = count
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def batch_size(self, size: int):
+        return self
+
+    def _results(self):
+        documents = self._documents
+        for field, direction in reversed(self._sort):
+            documents = sorted(documents, key=lambda document: _sort_key(_get(document, field)), reverse=direction == -1)
+        documents = documents[self._skip:]
+        if self._limit:
+            documents = documents[:self._limit]
+        return [_project(copy.deepcopy(document), self._projection) for document in documents]
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._iterator is None:
+            self._iterator = iter(self._results())
+        return next(self._iterator)
+
+    def close(self):
+        self._iterator = iter(())
+
+class _Index:
+    def __init__(self, name: str, fields, unique: bool, partial_filter):
+        self.name = name
+        self.fields = fields
+        self.unique = unique
+        self.partial_filter = partial_filter
+        self.entries = {}
+
+    def key(self, document: dict):
+        if self.partial_filter and not matches(document, self.partial_filter):
+            return None
+        return tuple(_sort_key(_get(document, field)) for field in self.fields)
+
+    def add(self, document_id, document: dict):
+        key = self.key(document)
+        if key is not None:
+            self.entries.setdefault(key, set()).add(document_id)
+
+    def remove(self, document_id, document: dict):
+        key = self.key(document)
+        if key is not None and key in self.entries:
+            self.entries[key].discard(document_id)
+            if not self.entries[key]:
+                del self.entries[key]
+
+    def conflict(self, document_id, document: dict) -> bool:
+        key = self.key(document)
+        return self.unique and key is not None and bool(self.entries.get(key, set()) - {document_id})
+
+class MemoryCollection:
+    def __init__(self, name: str, database: str = "memory"):
+        self.name = name
+        self.full_name = f"{database}.{name}"
+        self.read_preference = ReadPreference.PRIMARY
+        self._documents = {}
+        self._indexes = {}
+        self._lock = threading.RLock()
+
+    def with_options(self, read_preference=None, **kwargs):
+        # Replica routing means nothing in-process, the view shares the same documents
+        view = copy.copy(self)
+        view.read_preference = read_preference or self.read_preference
+        return view
+
+    def _candidates(self, query: dict):
+        if query and "_id" in query and not isinstance(query["_id"], dict):
+            document = self._documents.get(query["_id"])
+            return [document] if document is not None else []
+
+        # Any index whose fields all have plain equality conditions narrows the scan
+        for index in self._indexes.values():
+            if index.partial_filter or not query:
+                continue
+            values = [query.get(field, _MISSING) for field in index.fields]
+            if all(value is not _MISSING and value is not None and not isinstance(value, (dict, list)) for value in values):
+                ids = index.entries.get(tuple(_sort_key(value) for value in values), set())
+                return [self._documents[document_id] for document_id in ids]
+
+        return list(self._documents.values())
+
+    def _matching(self, query: dict):
+        return [document for document in self._candidates(query) if matches(document, query)]
+
+    def _check_unique(self, document_id, document: dict):
+        for index in self._indexes.values():
+            if index.conflict(document_id, document):
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self.name} index: {index.name}",
+                    11000,
+                    {"code": 11000, "keyPattern": {field: 1 for field in index.fields}}
+                )
+
+    def _store(self, document: dict, previous: dict = None):
+        document_id = document["_id"]
+        self._check_unique(document_id, document)
+        for index in self._indexes.values():
+            if previous is not None:
+                index.remove(document_id, previous)
+            index.add(document_id, document)
+        self._documents[document_id] = document
+
+    def _insert(self, document: dict):
+        if "_id" not in document:
+            document["_id"] = ObjectId()
+        stored = copy.deepcopy(document)
+        if stored["_id"] in self._documents:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: _id_", 11000, {"code": 11000})
+        self._store(stored)
+        return stored["_id"]
+
+    def _remove(self, document: dict):
+        for index in self._indexes.values():
+            index.remove(document["_id"], document)
+        del self._documents[document["_id"]]
+
+    def _update(self, query: dict, update: dict, upsert: bool, many: bool):
+        matched = self._matching(query)
+        if not many:
+            matched = matched[:1]
+
+        if not matched:
+            if not upsert:
+                return {"n": 0, "nModified": 0}
+            document = _equality_seed(query)
+            _apply_update(document, update, inserting=True)
+            document_id = document.setdefault("_id", ObjectId())
+            self._store(document)
+            return {"n": 1, "nModified": 0, "upserted": document_id}
+
+        modified = 0
+        for document in matched:
+            updated = copy.deepcopy(document)
+            if _apply_update(updated, update, inserting=False):
+                self._store(updated, previous=document)
+                modified += 1
+        return {"n": len(matched), "nModified": modified}
+
+    def find(self, filter: dict = None, projection=None, sort=None, limit: int = 0, skip: int = 0, **kwargs):
+        with self._lock:
+            cursor = MemoryCursor(self._matching(filter), projection)
+        if sort:
+            cursor.sort(sort)
+        return cursor.skip(skip).limit(limit)
+
+    def find_one(self, filter=None, projection=None, *args, **kwargs):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        return next(iter(self.find(filter, projection, *args, **kwargs).limit(1)), None)
+
+    def count_documents(self, filter: dict, limit: int = 0, skip: int = 0, **kwargs) -> int:
+        with self._lock:
+            count = max(len(self._matching(filter)) - skip, 0)
+        return min(count, limit) if limit else count
+
+    def estimated_document_count(self, **kwargs) -> int:
+        return len(self._documents)
+
+    def insert_one(self, document: dict, **kwargs):
+        with self._lock:
+            return InsertOneResult(self._insert(document), True)
+
+    def insert_many(self, documents, ordered: bool = True, **kwargs):
+        inserted_ids = []
+        write_errors = []
+        with self._lock:
+            for index, document in enumerate(documents):
+                try:
+                    inserted_ids.append(self._insert(document))
+                except DuplicateKeyError as e:
+                    write_errors.append({"index": index, "code": 11000, "errmsg": str(e), "op": document})
+                    if ordered:
+                        break
+        if write_errors:
+            raise BulkWriteError({
+                "writeErrors": write_errors,
+                "writeConcernErrors": [],
+                "nInserted": len(inserted_ids),
+                "nUpserted": 0,
+                "nMatched": 0,
+                "nModified": 0,
+                "nRemoved": 0,
+                "upserted": []
+            })
+        return InsertManyResult(inserted_ids, True)
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False, **kwargs):
+        with self._lock:
+            return UpdateResult(self._update(filter, update, upsert, many=False), True)
+
+    def update_many(self, filter: dict, update: dict, upsert: bool = False, **kwargs):
+        with self._lock:
+            return UpdateResult(self._update(filter, update, upsert, many=True), True)
+
+    def replace_one(self, filter: dict, replacement: dict, upsert: bool = False, **kwargs):
+        with self._lock:
+            matched = self._matching(filter)[:1]
+            if not matched:
+                if not upsert:
+                    return UpdateResult({"n": 0, "nModified": 0}, True)
+                document = {**_equality_seed(filter), **copy.deepcopy(replacement)}
+                document_id = document.setdefault("_id", ObjectId())
+                self._store(document)
+                return UpdateResult({"n": 1, "nModified": 0, "upserted": document_id}, True)
+
+            previous = matched[0]
+            document = {**copy.deepcopy(replacement), "_id": previous["_id"]}
+            self._store(document, previous=previous)
+            return UpdateResult({"n": 1, "nModified": int(document != previous)}, True)
+
+    def find_one_and_update(self, filter: dict, update: dict, projection=None, upsert: bool = False, return_document=ReturnDocument.BEFORE, **kwargs):
+        with self._lock:
+            matched = self._matching(filter)[:1]
+            before = copy.deepcopy(matched[0]) if matched else None
+            result = self._update(filter, update, upsert, many=False)
+            if return_document == ReturnDocument.AFTER:
+                document_id = before["_id"] if before else result.get("upserted")
+                document = self._documents.get(document_id) if document_id is not None else None
+            else:
+                document = before
+            return _project(copy.deepcopy(document), projection) if document is not None else None
+
+    def delete_one(self, filter: dict, **kwargs):
+        with self._lock:
+            matched = self._matching(filter)[:1]
+            for document in matched:
+                self._remove(document)
+            return DeleteResult({"n": len(matched)}, True)
+
+    def delete_many(self, filter: dict, **kwargs):
+        with self._lock:
+            matched = self._matching(filter)
+            for document in matched:
+                self._remove(document)
+            return DeleteResult({"n": len(matched)}, True)
+
+    def bulk_write(self, requests, ordered: bool = True, **kwargs):
+        totals = {"nInserted": 0, "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": [], "writeErrors": [], "writeConcernErrors": []}
+        with self._lock:
+            for index, request in enumerate(requests):
+                try:
+                    if isinstance(request, InsertOne):
+                        self._insert(request._doc)
+                        totals["nInserted"] += 1
+                        continue
+                    if isinstance(request, (DeleteOne, DeleteMany)):
+                        matched = self._matching(request._filter)
+                        if isinstance(request, DeleteOne):
+                            matched = matched[:1]
+                        for document in matched:
+                            self._remove(document)
+                        totals["nRemoved"] += len(matched)
+                        continue
+                    if isinstance(request, ReplaceOne):
+                        result = self.replace_one(request._filter, request._doc, upsert=bool(request._upsert)).raw_result
+                    elif isinstance(request, (UpdateOne, UpdateMany)):
+                        result = self._update(request._filter, request._doc, bool(request._upsert), many=isinstance(request, UpdateMany))
+                    else:
+                        raise OperationFailure(f"Unsupported bulk operation {type(request).__name__}")
+                except DuplicateKeyError as e:
+                    totals["writeErrors"].append({"index": index, "code": 11000, "errmsg": str(e)})
+                    if ordered:
+                        break
+                    continue
+
+                if "upserted" in result:
+                    totals["nUpserted"] += 1
+                    totals["upserted"].append({"index": index, "_id": result["upserted"]})
+                else:
+                    totals["nMatched"] += result["n"]
+                    totals["nModified"] += result["nModified"]
+
+        if totals["writeErrors"]:
+            raise BulkWriteError(totals)
+        return BulkWriteResult(totals, True)
+
+    def aggregate(self, pipeline, **kwargs):
+        with self._lock:
+            documents = [copy.deepcopy(document) for document in self._documents.values()]
+        for stage in pipeline:
+            (operator, spec), = stage.items()
+            documents = _STAGES[operator](documents, spec)
+        return iter(documents)
+
+    def create_index(self, keys, unique: bool = False, name: str = None, partialFilterExpression: dict = None, **kwargs) -> str:
+        fields = [keys] if isinstance(keys, str) else [field for field, _ in keys]
+        name = name or "_".join(f"{field}_1" for field in fields)
+        with self._lock:
+            if name in self._indexes:
+                return name
+            index = _Index(name, fields, unique, partialFilterExpression)
+            for document_id, document in self._documents.items():
+                if index.conflict(document_id, document):
+                    raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {name}", 11000)
+                index.add(document_id, document)
+            self._indexes[name] = index
+        return name
+
+    def drop_index(self, name: str):
+        with self._lock:
+            if name not in self._indexes:
+                raise OperationFailure(f"index not found with name [{name}]")
+            del self._indexes[name]
+
+    def index_information(self):
+        information = {"_id_": {"key": [("_id", 1)]}}
+        for index in self._indexes.values():
+            information[index.name] = {"key": [(field, 1) for field in index.fields], "unique": index.unique}
+        return information
+
+    def drop(self):
+        with self._lock:
+            self._documents.clear()
+            self._indexes.clear()
+
+def _evaluate(document: dict, expression):
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = _get(document, expression[1:])
+        return None if value is _MISSING else value
+    if isinstance(expression, dict) and len(expression) == 1:
+        (operator, arguments), = expression.items()
+        if operator.startswith("$"):
+            if operator == "$size":
+                return len(_evaluate(document, arguments))
+            values = [_evaluate(document, argument) for argument in arguments]
+            if operator == "$ifNull":
+                return next((value for value in values if value is not None), None)
+            if operator == "$add":
+                return sum(values)
+            if operator == "$multiply":
+                product = 1
+                for value in values:
+                    product *= value
+                return product
+            raise OperationFailure(f"Unsupported expression operator {operator}")
+    if isinstance(expression, dict):
+        return {key: _evaluate(document, value) for key, value in expression.items()}
+    return expression
+
+def _project_stage(documents, spec: dict):
+    projected = []
+    for document in documents:
+        result = {}
+        if spec.get("_id", 1) and "_id" in document:
+            result["_id"] = document["_id"]
+        for field, expression in spec.items():
+            if field == "_id":
+                continue
+            if expression in (1, True):
+                value = _get(document, field)
+                if value is not _MISSING:
+                    _set(result, field, value)
+            elif expression not in (0, False):
+                _set(result, field, _evaluate(document, expression))
+        projected.append(result)
+    return projected
+
+def _group_stage(documents, spec: dict):
+    groups = {}
+    for document in documents:
+        group_id = _evaluate(document, spec["_id"])
+        key = repr(group_id)
+        group = groups.setdefault(key, {"_id": group_id, **{field: 0 for field in spec if field != "_id"}})
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            (operator, expression), = accumulator.items()
+            if operator != "$sum":
+                raise OperationFailure(f"Unsupported accumulator {operator}")
+            value = _evaluate(document, expression)
+            group[field] += value if isinstance(value, (int, float)) else 0
+    return list(groups.values())
+
+def _sort_stage(documents, spec: dict):
+    for field, direction in reversed(list(spec.items())):
+        documents = sorted(documents, key=lambda document: _sort_key(_get(document, field)), reverse=direction == -1)
+    return documents
+
+_STAGES = {
+    "$match": lambda documents, query: [document for document in documents if matches(document, query)],
+    "$project": _project_stage,
+    "$group": _group_stage,
+    "$sort": _sort_stage,
+    "$limit": lambda documents, count: documents[:count],
+    "$skip": lambda documents, count: documents[count:]
+}
@@ -0,0 +1,237 @@
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from config import *
+from completions import encode_completions, get_content_ids, read_completions, register_content
+from utils import compress_content
+
+def find_duplicate_user_data(collection: Collection):
+    pipeline = [
+        {"$group": {
+            "_id": {"username": "$username", "room": "$room"},
+            "count": {"$sum": 1}
+        }},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$project": {"_id": 0, "username": "$_id.username", "room": "$_id.room", "count": 1}},
+        {"$sort": {"room": 1, "username": 1}}
+    ]
+    return list(collection.aggregate(pipeline))
+
+def ensure_user_data_index(collection: Collection):
+    # The unique index cannot be built while duplicates exist, report them instead
+    duplicates = find_duplicate_user_data(collection)
+    if duplicates:
+        return duplicates
+
+    create_user_data_index(collection)
+    return []
+
+def create_user_data_index(collection: Collection):
+    collection.create_index(
+        [("username", ASCENDING), ("room", ASCENDING)],
+        unique=True,
+        name="username_room_unique"
+    )
+
+def ensure_daily_puzzle_index(collection: Collection):
+    collection.create_index(
+        [("room", ASCENDING), ("date", ASCENDING)],
+        unique=True,
+        name="room_date_unique"
+    )
+
+def ensure_content_indexes(lecture_collection: Collection, project_collection: Collection):
+    lecture_collection.create_index(
+        [("room", ASCENDING), ("title", ASCENDING)],
+        unique=True,
+        name="room_title_unique"
+    )
+    project_collection.create_index(
+        [("room", ASCENDING), ("name", ASCENDING)],
+        unique=True,
+        name="room_name_unique"
+    )
+
+def ensure_content_id_indexes(id_collection: Collection):
+    # Counter documents have no title/cid, keep them out of the unique indexes
+    id_collection.create_index(
+        [("room", ASCENDING), ("kind", ASCENDING), ("title", ASCENDING)],
+        unique=True,
+        partialFilterExpression={"cid": {"$exists": True}},
+        name="room_kind_title_unique"
+    )
+    id_collection.create_index(
+        [("room", ASCENDING), ("kind", ASCENDING), ("cid", ASCENDING)],
+        unique=True,
+        partialFilterExpression={"cid": {"$exists": True}},
+        name="room_kind_cid_unique"
+    )
+
+def ensure_indexes():
+    # Duplicates are only caught by these indexes (concurrent /user-data, /import-content), so every start-up
+    # builds them. create_index does nothing for an index that exists. Returns the ones duplicates kept
+    # from being built, run_migrations reports the duplicates themselves.
+    missing = []
+    for name, build in [
+        ("user_data (username, room)", lambda: create_user_data_index(user_data_collection)),
+        ("daily_puzzles (room, date)", lambda: ensure_daily_puzzle_index(daily_puzzle_collection)),
+        ("lectures/guided_projects (room, title/name)", lambda: ensure_content_indexes(lecture_collection, guided_projects_collection)),
+        ("content_ids (room, kind, title/cid)", lambda: ensure_content_id_indexes(content_id_collection)),
+        ("user_file_chunks (version, n), retired_at", lambda: ensure_user_file_chunk_index(user_file_chunk_collection)),
+        ("idempotency_keys (created_at)", lambda: ensure_idempotency_index(idempotency_collection))
+    ]:
+        try:
+            build()
+        except DuplicateKeyError:
+            missing.append(name)
+    return missing
+
+def register_existing_content(id_collection: Collection, lecture_collection: Collection, project_collection: Collection, puzzle_collection: Collection):
+    # Content created before ids were assigned on creation gets its ids here
+    registered = 0
+    for kind, collection, field in [("lectures", lecture_collection, "title"), ("projects", project_collection, "name"), ("puzzles", puzzle_collection, "date")]:
+        titles = {}
+        for document in collection.find({}, {"_id": 0, "room": 1, field: 1}):
+            titles.setdefault(document.get("room"), []).append(document.get(field))
+        for room, room_titles in titles.items():
+            known = get_content_ids(id_collection, room, kind, room_titles)
+            missing = [title for title in room_titles if title not in known]
+            register_content(id_collection, room, kind, missing)
+            registered += len(missing)
+    return registered
+
+def migrate_completions_to_bits(collection: Collection, id_collection: Collection, batch_size: int = 500):
+    migrated = 0
+    while True:
+        batch = list(collection.find(
+            {"completions": {"$exists": True}},
+            {"room": 1, "completions": 1, "completion_bits": 1}
+        ).limit(batch_size))
+        if not batch:
+            return migrated
+
+        operations = []
+        for user in batch:
+            completions = read_completions(id_collection, user, user.get("room"))
+            operations.append(
+                UpdateOne(
+                    # Skip documents changed since they were read, the next batch picks them up again
+                    {"_id": user["_id"], "completions": user["completions"]},
+                    {
+                        "$set": encode_completions(id_collection, user.get("room"), completions),
+                        "$unset": {"completions": ""}
+                    }
+                )
+            )
+        migrated += collection.bulk_write(operations).modified_count
+
+def ensure_user_file_chunk_index(chunk_collection: Collection):
+    chunk_collection.create_index(
+        [("version", ASCENDING), ("n", ASCENDING)],
+        unique=True,
+        name="version_n_unique"
+    )
+    # Chunks of replaced file versions are only marked, Mongo removes them once the grace period is over
+    chunk_collection.create_index(
+        [("retired_at", ASCENDING)],
+        expireAfterSeconds=USER_FILE_CHUNK_GRACE,
+        name="retired_at_ttl"
+    )
+
+def ensure_idempotency_index(collection: Collection):
+    collection.create_index(
+        [("created_at", ASCENDING)],
+        expireAfterSeconds=IDEMPOTENCY_KEY_TTL,
+        name="created_at_ttl"
+    )
+
+def backfill_room_members(classroom_collection: Collection, user_collection: Collection):
+    pipeline = [
+        {"$group": {"_id": "$room", "members": {"$sum": 1}}}
+    ]
+    members = {entry["_id"]: entry["members"] for entry in user_collection.aggregate(pipeline)}
+
+    operations = [
+        UpdateOne({"_id": room["_id"]}, {"$set": {"members": members.get(room["code"], 0)}})
+        for room in classroom_collection.find({"code": {"$exists": True}, "members": {"$exists": False}}, {"code": 1})
+    ]
+    if operations:
+        classroom_collection.bulk_write(operations)
+    return len(operations)
+
+def compress_user_files(collection: Collection, batch_size: int = 500):
+    stats = {"documents": 0, "bytes_before": 0, "bytes_after": 0}
+    last_id = None
+    while True:
+        query = {"content": {"$type": "string"}, "encoding": {"$ne": "zlib"}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = list(collection.find(query, {"content": 1}).sort("_id", ASCENDING).limit(batch_size))
+        if not batch:
+            return stats
+        last_id = batch[-1]["_id"]
+
+        operations = []
+        for file in batch:
+            content, encoding = compress_content(file["content"])
+            if encoding == "identity":
+                continue
+            operations.append(
+                UpdateOne(
+                    # Leave files rewritten since they were read alone
+                    {"_id": file["_id"], "content": file["content"]},
+                    {"$set": {"content": content, "encoding": encoding}}
+                )
+            )
+            stats["documents"] += 1
+            stats["bytes_before"] += len(file["content"].encode("utf-8"))
+            stats["bytes_after"] += len(content)
+
+        if operations:
+            collection.bulk_write(operations)
+
+def run_migrations():
+    ok = True
+
+    duplicates = ensure_user_data_index(user_data_collection)
+    if duplicates:
+        ok = False
+        print("Cannot enforce unique (username, room) on user_data, duplicates found:")
+        for duplicate in duplicates:
+            print(f"  {duplicate['username']} in room {duplicate['room']}: {duplicate['count']} documents")
+    else:
+        print("user_data: unique (username, room) index in place")
+
+    try:
+        ensure_daily_puzzle_index(daily_puzzle_collection)
+        print("daily_puzzles: unique (room, date) index in place")
+    except DuplicateKeyError:
+        ok = False
+        print("Cannot enforce unique (room, date) on daily_puzzles, a room has two puzzles for the same date")
+
+    try:
+        ensure_content_indexes(lecture_collection, guided_projects_collection)
+        print("lectures/guided_projects: unique (room, title/name) indexes in place")
+    except DuplicateKeyError:
+        ok = False
+        print("Cannot enforce unique lecture titles / project names per room, duplicates exist")
+
+    ensure_content_id_indexes(content_id_collection)
+    registered = register_existing_content(content_id_collection, lecture_collection, guided_projects_collection, daily_puzzle_collection)
+    print(f"content_ids: registered {registered} existing content items")
+    migrated = migrate_completions_to_bits(user_data_collection, content_id_collection)
+    print(f"user_data: converted {migrated} documents to completion bitsets")
+
+    backfilled = backfill_room_members(classroom_data_collection, user_data_collection)
+    print(f"classroom_data: backfilled member counters for {backfilled} rooms")
+
+    ensure_user_file_chunk_index(user_file_chunk_collection)
+    ensure_idempotency_index(idempotency_collection)
+
+    stats = compress_user_files(user_file_collection)
+    saved = stats["bytes_before"] - stats["bytes_after"]
+    print(f"user_files: compressed {stats['documents']} documents, {stats['bytes_before']} -> {stats['bytes_after']} bytes ({saved} saved)")
+
+    return ok
+
+if __name__ == "__main__":
+    raise SystemExit(0 if run_migrations() else 1)
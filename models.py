@@ -1,5 +1,6 @@
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
+from datetime import datetime
 
 class UserRegister(BaseModel):
     email: str
@@ -20,6 +21,20 @@ class UserFileList(BaseModel):
     files: List[UserFile]
     room: str
 
+class UserFileManifestEntry(BaseModel):
+    name: str
+    purpose: str
+    hash: str
+    size: int
+    updated_at: Optional[datetime] = None
+
+class UserFileMetadata(BaseModel):
+    name: str
+    purpose: str
+    size: Optional[int] = None
+    updated_at: Optional[datetime] = None
+    chunked: bool = False
+
 class SlideData(BaseModel):
     name: str
     content: str
@@ -38,6 +53,11 @@ class LectureData(BaseModel):
     passmark: int
     room: str
 
+class LectureSummary(BaseModel):
+    title: str
+    required: List[str]
+    passmark: int
+
 class StepData(BaseModel):
     title: str
     description: str
@@ -80,6 +100,20 @@ class PuzzleCompletionRequest(BaseModel):
     room: str
     puzzle: str
 
+class CompletionEvent(BaseModel):
+    type: str
+    title: str
+
+class CompletionBatchRequest(BaseModel):
+    username: str
+    room: str
+    events: List[CompletionEvent]
+
+class CompletionResult(BaseModel):
+    type: str
+    title: str
+    status: str
+
 class CodeRequest(BaseModel):
     code: str
 
@@ -87,6 +121,11 @@ class RoomData(BaseModel):
     owner: str
     name: str
     capacity: int
+    timezone: str = "UTC"
+
+class JoinRoomRequest(BaseModel):
+    username: str
+    code: str
 
 class TutorRegister(BaseModel):
     username: str
@@ -102,6 +141,24 @@ class ChallengeData(BaseModel):
     room: str
     tests: List[str]
 
+class DailyPuzzle(BaseModel):
+    date: str
+    name: str
+    description: str
+    tests: List[str]
+
+class ContentPack(BaseModel):
+    room: str
+    lectures: List[LectureData] = []
+    projects: List[GuidedProjectData] = []
+    challenges: List[ChallengeData] = []
+
+class ImportResult(BaseModel):
+    type: str
+    key: str
+    status: str
+    detail: Optional[str] = None
+
 class InventoryItem(BaseModel):
     name: str
     solution: str
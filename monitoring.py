@@ -0,0 +1,222 @@
+import threading
+import time
+from contextlib import contextmanager
+from pymongo import monitoring
+
+# Metrics in the Prometheus text exposition format, served by /metrics in main.py.
+# Counters and histograms are updated as things happen, gauges are read from a callback on every scrape.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_metrics = []
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels[name] for name in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in sorted(values.items())]
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        counts, _ = self._values.get(tuple(labels[name] for name in self.labelnames), ([0], 0.0))
+        return counts[-1]
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        lines = []
+        for key, (counts, total) in sorted(values.items()):
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(bound))])} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {counts[-1]}")
+        return lines
+
+class Gauge:
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), callback=None):
+        # callback() returns a list of (label values, value)
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        _metrics.append(self)
+
+    def samples(self):
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in self.callback()]
+
+class CallbackCounter(Gauge):
+    # A counter kept elsewhere, e.g. cache hits, read on every scrape
+    type = "counter"
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+http_requests = Counter("http_requests_total", "Requests handled, by route template and status.", ["method", "route", "status"])
+http_request_duration = Histogram("http_request_duration_seconds", "Request latency, by route template.", ["method", "route"])
+mongo_command_duration = Histogram(
+    "mongo_command_duration_seconds",
+    "Mongo command round trips reported by the driver.",
+    ["command", "collection", "outcome"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+bcrypt_duration = Histogram("bcrypt_duration_seconds", "Password hashing and verification time.", ["operation"], buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 2))
+code_execution_duration = Histogram("code_execution_duration_seconds", "Time spent running submitted code.", ["outcome"])
+
+class CommandTimings(monitoring.CommandListener):
+    def __init__(self):
+        # The collection is only on the started event, keep it until the command finishes
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def _finish(self, event, outcome: str):
+        with self._lock:
+            collection = self._collections.pop((event.connection_id, event.request_id), "")
+        mongo_command_duration.observe(event.duration_micros / 1_000_000, command=event.command_name, collection=collection, outcome=outcome)
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        with self._lock:
+            self._collections[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ""
+
+    def succeeded(self, event):
+        self._finish(event, "success")
+
+    def failed(self, event):
+        self._finish(event, "failure")
+
+# pymongo has no public API for pool usage, so the connection pool events are counted instead
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self.open = 0
+        self.checked_out = 0
+        self.created = 0
+        self.closed = 0
+        self.checkout_failures = 0
+        self.pools = 0
+        self._lock = threading.Lock()
+
+    def _count(self, **changes):
+        with self._lock:
+            for name, change in changes.items():
+                setattr(self, name, getattr(self, name) + change)
+
+    def pool_created(self, event):
+        self._count(pools=1)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        self._count(pools=-1)
+
+    def connection_created(self, event):
+        self._count(open=1, created=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._count(open=-1, closed=1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._count(checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        self._count(checked_out=1)
+
+    def connection_checked_in(self, event):
+        self._count(checked_out=-1)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "pools": self.pools,
+                "open": self.open,
+                "inUse": self.checked_out,
+                "idle": self.open - self.checked_out,
+                "created": self.created,
+                "closed": self.closed,
+                "checkoutFailures": self.checkout_failures
+            }
+
+pool_stats = PoolStats()
+command_timings = CommandTimings()
+
+Gauge(
+    "mongo_pool_connections",
+    "Connections in the driver's pools.",
+    ["state"],
+    lambda: [((state,), value) for state, value in pool_stats.snapshot().items() if state in ("open", "inUse", "idle")]
+)
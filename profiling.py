@@ -0,0 +1,146 @@
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+
+# A wall-clock sampling profiler for single requests. While a profiled request runs, a sampler thread
+# reads the stack of every busy thread (the event loop and the threadpool workers) at a fixed interval.
+# Stacks are kept in the folded format flamegraph.pl and speedscope read ("a;b;c 12").
+# Threads are not tied to a request, so other requests running at the same time show up too,
+# maxConcurrentRequests in each profile says when that may have happened.
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# A thread whose innermost frame is here and that runs no app code is parked, not working
+IDLE_MODULES = ("threading.py", "queue.py", "selectors.py")
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    path = code.co_filename
+    if path.startswith(APP_DIR):
+        path = os.path.relpath(path, APP_DIR)
+    else:
+        path = "/".join(path.split(os.sep)[-2:])
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+def thread_stack(frame):
+    # Outermost call first
+    stack = []
+    while frame is not None:
+        stack.append(frame)
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+def is_idle(stack) -> bool:
+    if not stack[-1].f_code.co_filename.endswith(IDLE_MODULES):
+        return False
+    return not any(frame.f_code.co_filename.startswith(APP_DIR) for frame in stack)
+
+def call_tree(folded: dict) -> dict:
+    root = {"name": "all", "samples": 0, "children": {}}
+    for stack, count in folded.items():
+        root["samples"] += count
+        node = root
+        for name in stack.split(";"):
+            node = node["children"].setdefault(name, {"name": name, "samples": 0, "children": {}})
+            node["samples"] += count
+
+    def finish(node):
+        children = sorted(node["children"].values(), key=lambda child: child["samples"], reverse=True)
+        return {"name": node["name"], "samples": node["samples"], "children": [finish(child) for child in children]}
+    return finish(root)
+
+def top_functions(folded: dict, limit: int = 20):
+    own, total = {}, {}
+    for stack, count in folded.items():
+        names = stack.split(";")[1:]  # the first entry is the thread name
+        if not names:
+            continue
+        own[names[-1]] = own.get(names[-1], 0) + count
+        for name in set(names):
+            total[name] = total.get(name, 0) + count
+    functions = [{"function": name, "self": own.get(name, 0), "total": samples} for name, samples in total.items()]
+    functions.sort(key=lambda function: (function["self"], function["total"]), reverse=True)
+    return functions[:limit]
+
+class SamplingProfiler:
+    def __init__(self, interval: float, max_duration: float, in_flight=lambda: 1):
+        self.interval = interval
+        self.max_duration = max_duration
+        self.in_flight = in_flight
+        self.folded = {}
+        self.samples = 0
+        self.max_in_flight = 0
+        self.started = 0
+        self.duration = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started
+
+    def sample(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own or names.get(ident) == "profiler":
+                continue
+            stack = thread_stack(frame)
+            if not stack or is_idle(stack):
+                continue
+            key = ";".join([names.get(ident, str(ident))] + [frame_label(frame) for frame in stack])
+            self.folded[key] = self.folded.get(key, 0) + 1
+        self.samples += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight())
+
+    def _run(self):
+        deadline = time.perf_counter() + self.max_duration
+        while not self._stop.is_set() and time.perf_counter() < deadline:
+            self.sample()
+            self._stop.wait(self.interval)
+
+class ProfileStore:
+    def __init__(self, max_profiles: int):
+        self._profiles = deque(maxlen=max_profiles)
+        self._lock = threading.Lock()
+
+    def add(self, profiler: SamplingProfiler, profile_id: str = None, **request) -> str:
+        profile_id = profile_id or uuid.uuid4().hex
+        profile = {
+            "id": profile_id,
+            **request,
+            "startedAt": time.time() - profiler.duration,
+            "durationMs": profiler.duration * 1000,
+            "intervalMs": profiler.interval * 1000,
+            "samples": profiler.samples,
+            "maxConcurrentRequests": profiler.max_in_flight,
+            "folded": dict(profiler.folded)
+        }
+        with self._lock:
+            self._profiles.append(profile)
+        return profile_id
+
+    def get(self, profile_id: str):
+        with self._lock:
+            return next((profile for profile in self._profiles if profile["id"] == profile_id), None)
+
+    def summaries(self, route: str = None):
+        with self._lock:
+            profiles = list(self._profiles)
+        return [
+            {key: value for key, value in profile.items() if key != "folded"}
+            for profile in reversed(profiles)
+            if route is None or profile["route"] == route
+        ]
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
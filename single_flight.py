@@ -0,0 +1,65 @@
+import functools
+import inspect
+import threading
+from monitoring import Counter
+
+# Identical reads that arrive while one is already running wait for it and share its result (or error)
+# instead of repeating the same queries. Nothing is kept once the call returns, see cache.py for that.
+# Results are shared between callers, so they must not be modified.
+
+shared_calls = Counter("single_flight_shared_total", "Calls answered with the result of an identical call already running.", ["function"])
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            shared_calls.inc(function=self.name)
+            if call.error:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args, **kwargs)
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+def single_flight(*key_params: str):
+    # Calls are identical when these arguments are equal, leave out anything identifying the caller
+    def decorator(function):
+        signature = inspect.signature(function)
+        unknown = [name for name in key_params if name not in signature.parameters]
+        if unknown:
+            raise TypeError(f"{function.__name__} has no parameters {', '.join(unknown)}")
+        group = SingleFlight(function.__name__)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            key = tuple(arguments.arguments[name] for name in key_params)
+            return group.do(key, function, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,201 @@
+import json
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Set by the metrics middleware in main.py so commands can be traced back to the route that issued them
+current_request_scope = ContextVar("current_request_scope", default=None)
+
+# Where each command keeps its filter, anything else (inserts, pings, getMores) is not tracked
+FILTER_FIELDS = {
+    "find": "filter",
+    "aggregate": "pipeline",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query",
+    "update": "updates",
+    "delete": "deletes"
+}
+EXPLAINABLE = {"find", "aggregate", "count", "distinct", "findAndModify"}
+
+def redact(value):
+    # Keep field names and operators, drop every value so no user data ends up in the log
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    if isinstance(value, list) and any(isinstance(item, dict) for item in value):
+        return [redact(item) for item in value]
+    return "?"
+
+def filter_shape(command_name: str, command) -> dict:
+    field = FILTER_FIELDS[command_name]
+    if command_name == "update":
+        return {"updates": [redact(statement.get("q", {})) for statement in command.get(field, [])]}
+    if command_name == "delete":
+        return {"deletes": [redact(statement.get("q", {})) for statement in command.get(field, [])]}
+    shape = {field: redact(command.get(field, {}))}
+    if command.get("sort"):
+        # Sort values are directions, not data
+        shape["sort"] = dict(command["sort"])
+    return shape
+
+def docs_returned(command_name: str, reply) -> int:
+    if command_name in ("find", "aggregate"):
+        return len(reply.get("cursor", {}).get("firstBatch", []))
+    if command_name == "distinct":
+        return len(reply.get("values", []))
+    if command_name == "findAndModify":
+        return 1 if reply.get("value") else 0
+    return reply.get("n", 0)
+
+def current_route() -> str:
+    scope = current_request_scope.get()
+    if scope is None:
+        return "background"
+    route = scope.get("route")
+    return route.path if route else "unmatched"
+
+def plan_summary(plan: dict) -> dict:
+    # Stage names and indexes only, bounds and filters hold the values of the explained query
+    plan = plan.get("queryPlan", plan)
+    summary = {key: plan[key] for key in ("stage", "indexName", "keyPattern", "direction") if key in plan}
+    if "inputStage" in plan:
+        summary["inputStage"] = plan_summary(plan["inputStage"])
+    if "inputStages" in plan:
+        summary["inputStages"] = [plan_summary(stage) for stage in plan["inputStages"]]
+    return summary
+
+def _stages(plan: dict):
+    yield plan.get("stage")
+    if "inputStage" in plan:
+        yield from _stages(plan["inputStage"])
+    for stage in plan.get("inputStages", []):
+        yield from _stages(stage)
+
+def _query_planner(reply):
+    if isinstance(reply, dict):
+        if "queryPlanner" in reply:
+            return reply["queryPlanner"]
+        values = reply.values()
+    elif isinstance(reply, list):
+        values = reply
+    else:
+        return None
+    for value in values:
+        planner = _query_planner(value)
+        if planner:
+            return planner
+    return None
+
+def explain_summary(reply) -> dict:
+    planner = _query_planner(reply)
+    if not planner:
+        return {"error": "No query plan in the explain output"}
+    winning_plan = plan_summary(planner.get("winningPlan", {}))
+    return {
+        "winningPlan": winning_plan,
+        "collectionScan": "COLLSCAN" in _stages(winning_plan),
+        "rejectedPlans": len(planner.get("rejectedPlans", []))
+    }
+
+class SlowQueryLog(monitoring.CommandListener):
+    def __init__(self, threshold_ms: float, max_shapes: int = 500, explain: bool = False):
+        self.threshold_ms = threshold_ms
+        self.max_shapes = max_shapes
+        self.explain = explain
+        # Client used to run explain, set once the storage engine is created
+        self.explain_client = None
+        self._pending = {}
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if event.command_name in FILTER_FIELDS:
+            with self._lock:
+                self._pending[(event.connection_id, event.request_id)] = (event.command, event.database_name, current_route())
+
+    def succeeded(self, event):
+        self._finish(event, event.reply)
+
+    def failed(self, event):
+        self._finish(event, None)
+
+    def _finish(self, event, reply):
+        if event.command_name not in FILTER_FIELDS:
+            return
+        with self._lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+        duration_ms = event.duration_micros / 1000
+        if pending is None or duration_ms < self.threshold_ms:
+            return
+        command, database, route = pending
+        self.record(database, event.command_name, command, route, duration_ms, docs_returned(event.command_name, reply) if reply else 0)
+
+    def record(self, database: str, command_name: str, command, route: str, duration_ms: float, returned: int):
+        collection = command.get(command_name)
+        shape = filter_shape(command_name, command)
+        key = (database, command_name, collection, json.dumps(shape, sort_keys=True, default=str))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            first_occurrence = entry is None
+            if first_occurrence:
+                if len(self._entries) >= self.max_shapes:
+                    # Forget the shape that was slow the longest time ago
+                    del self._entries[next(iter(self._entries))]
+                entry = {
+                    "database": database,
+                    "command": command_name,
+                    "collection": collection,
+                    "shape": shape,
+                    "count": 0,
+                    "totalMs": 0.0,
+                    "maxMs": 0.0,
+                    "maxDocsReturned": 0,
+                    "routes": {},
+                    "firstSeen": now,
+                    "explain": None
+                }
+            entry["count"] += 1
+            entry["totalMs"] += duration_ms
+            entry["maxMs"] = max(entry["maxMs"], duration_ms)
+            entry["lastMs"] = duration_ms
+            entry["lastDocsReturned"] = returned
+            entry["maxDocsReturned"] = max(entry["maxDocsReturned"], returned)
+            entry["routes"][route] = entry["routes"].get(route, 0) + 1
+            entry["lastSeen"] = now
+            self._entries[key] = entry
+            run_explain = first_occurrence and self.explain and self.explain_client is not None and command_name in EXPLAINABLE
+            if run_explain:
+                entry["explain"] = "pending"
+
+        logger.warning("Slow %s on %s.%s from %s: %.1f ms, %d docs, shape %s", command_name, database, collection, route, duration_ms, returned, key[3])
+        if run_explain:
+            # Never from the listener itself, it runs on the thread waiting for the reply
+            threading.Thread(target=self._explain, args=(key, database, command), name="slow-query-explain", daemon=True).start()
+
+    def _explain(self, key, database: str, command):
+        explainable = {field: value for field, value in command.items() if not field.startswith("$") and field not in ("lsid", "txnNumber", "autocommit", "startTransaction")}
+        try:
+            reply = self.explain_client[database].command({"explain": explainable, "verbosity": "queryPlanner"})
+            summary = explain_summary(reply)
+        except Exception as error:
+            summary = {"error": str(error)}
+        with self._lock:
+            if key in self._entries:
+                self._entries[key]["explain"] = summary
+
+    def top(self, limit: int = 20, sort: str = "totalMs"):
+        with self._lock:
+            entries = [dict(entry, routes=dict(entry["routes"])) for entry in self._entries.values()]
+        entries.sort(key=lambda entry: entry[sort], reverse=True)
+        for entry in entries:
+            entry["avgMs"] = entry["totalMs"] / entry["count"]
+        return entries[:limit]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,49 @@
+from pymongo import MongoClient
+from memory_storage import MemoryCollection
+
+# Every collection the app uses comes from one storage engine, picked with STORAGE_ENGINE:
+#   mongo  -> pymongo collections on MONGO_URI
+#   memory -> in-process collections, nothing survives a restart; for tests and benchmarks
+
+class MongoStorage:
+    name = "mongo"
+
+    def __init__(self, uri: str, database: str, options: dict):
+        self.client = MongoClient(uri, **options)
+        self.db = self.client[database]
+
+    def collection(self, name: str, read_preference=None):
+        collection = self.db[name]
+        return collection.with_options(read_preference=read_preference) if read_preference else collection
+
+    def ping(self):
+        self.client.admin.command("ping")
+
+    def close(self):
+        self.client.close()
+
+class MemoryStorage:
+    name = "memory"
+
+    def __init__(self, database: str = "memory"):
+        self.database = database
+        self.collections = {}
+
+    def collection(self, name: str, read_preference=None):
+        if name not in self.collections:
+            self.collections[name] = MemoryCollection(name, self.database)
+        collection = self.collections[name]
+        return collection.with_options(read_preference=read_preference) if read_preference else collection
+
+    def ping(self):
+        pass
+
+    def close(self):
+        pass
+
+def create_storage(engine: str, uri: str, database: str, options: dict):
+    if engine == "mongo":
+        return MongoStorage(uri, database, options)
+    if engine == "memory":
+        return MemoryStorage(database)
+    raise ValueError(f"Unknown STORAGE_ENGINE {engine!r}, use mongo or memory")
@@ -1,11 +1,43 @@
 import pytest
+import threading
+import time
+import utils
+from datetime import datetime, timedelta, timezone
 from fastapi.testclient import TestClient
+import main
+import cleanup
 from main import app
-from config import mock_collection
-from utils import hash_password, create_access_token
+from config import storage, test_storage, user_credentials_collection, tutor_credentials_collection, READ_PREFERENCES, MONGO_CONTENT_READ_PREFERENCE
+from pymongo import ReadPreference
+from utils import hash_password, create_access_token, hash_content, local_today
 from models import *
+from migrations import find_duplicate_user_data, ensure_user_data_index, migrate_completions_to_bits, compress_user_files
+from completions import clear_content_id_cache, read_completions, register_content, get_content_ids
+from cache import clear_caches, room_cache, daily_puzzle_cache
+from idempotency import idempotency_record_id, request_fingerprint
 client = TestClient(app)
 
+# What the endpoints use with testing=True
+mock_user_credentials = main.get_user_credentials_collection(True)
+mock_tutor_credentials = main.get_tutor_credentials_collection(True)
+mock_rooms = main.get_classroom_data_collection(True)
+mock_user_data = main.get_user_data_collection(True)
+mock_user_files = main.get_user_file_collection(True)
+mock_file_chunks = main.get_user_file_chunk_collection(True)
+mock_lectures = main.get_lecture_collection(True)
+mock_projects = main.get_guided_projects_collection(True)
+mock_puzzles = main.get_daily_puzzle_collection(True)
+mock_content_ids = main.get_content_id_collection(True)
+mock_idempotency_keys = main.get_idempotency_collection(True)
+
+@pytest.fixture(scope="session", autouse=True)
+def seed_principals():
+    # Tokens are always checked against the real credential collections, testing=True doesn't reach them
+    if storage.name != "memory":
+        pytest.fail("Refusing to seed test users into a real database, run the tests with STORAGE_ENGINE=memory")
+    user_credentials_collection.update_one({"username": "testuser"}, {"$set": {"verified": True}}, upsert=True)
+    tutor_credentials_collection.update_one({"username": "testtutor"}, {"$set": {"verified": True, "approved": True}}, upsert=True)
+
 @pytest.fixture(scope="session")
 def auth_token():
     return create_access_token("testuser")
@@ -16,9 +48,21 @@ def tutor_token():
 
 @pytest.fixture(scope="function", autouse=True)
 def clean_db():
-    mock_collection.delete_many({})  # Clear the database before and after each test
+    # Clear the test collections before and after each test
+    for collection in test_storage.collections.values():
+        collection.drop()
+    clear_content_id_cache()
+    clear_caches()
     yield
-    mock_collection.delete_many({})
+    for collection in test_storage.collections.values():
+        collection.drop()
+    clear_content_id_cache()
+    clear_caches()
+
+def register_test_content(room="ABCDEF", lectures=(), projects=(), puzzles=()):
+    # Completions only count for content that was created, which assigns its id
+    for kind, titles in (("lectures", lectures), ("projects", projects), ("puzzles", puzzles)):
+        register_content(mock_content_ids, room, kind, list(titles))
 
 @pytest.mark.asyncio
 async def test_register_user():
@@ -35,7 +79,7 @@ async def test_register_user():
 
 @pytest.mark.asyncio
 async def test_register_duplicate_user():
-    mock_collection.insert_one({
+    mock_user_credentials.insert_one({
         "username": "testuser", 
         "email": "test@example.com", 
         "password": hash_password("password")
@@ -65,7 +109,7 @@ def test_register_invalid_email():
     assert response.json()["detail"] == "Invalid email format"
 
 def test_login_invalid_password():
-    mock_collection.insert_one({
+    mock_user_credentials.insert_one({
         "username": "testuser", 
         "password": hash_password("correctpassword"), 
         "verified": True
@@ -82,7 +126,7 @@ def test_login_invalid_password():
     assert response.json()["detail"] == "Invalid username or password"
 
 def test_login_unverified_email():
-    mock_collection.insert_one({
+    mock_user_credentials.insert_one({
         "username": "unverified_user", 
         "password": hash_password("password"),
         "verified": False
@@ -99,7 +143,7 @@ def test_login_unverified_email():
     assert response.json()["detail"] == "Email not verified. Please check your inbox."
 
 def test_login_success():
-    mock_collection.insert_one({
+    mock_user_credentials.insert_one({
         "username": "testuser", 
         "password": hash_password("mypassword"), 
         "verified": True
@@ -116,7 +160,7 @@ def test_login_success():
     assert response.json()["message"] == "Login successful!"
 
 def test_invalid_token():
-    mock_collection.insert_one({
+    mock_user_credentials.insert_one({
         "username": "testuser", 
         "password": hash_password("mypassword"),
         "verified": False, 
@@ -125,7 +169,7 @@ def test_invalid_token():
 
     response = client.get("/verify/invalidtoken?testing=True")
 
-    user = mock_collection.find_one({"username": "testuser"})
+    user = mock_user_credentials.find_one({"username": "testuser"})
     
     assert response.status_code == 400
     assert response.json()["detail"] == "Invalid or expired token"
@@ -133,7 +177,7 @@ def test_invalid_token():
     assert "token" in user
 
 def test_valid_token():
-    mock_collection.insert_one({
+    mock_user_credentials.insert_one({
         "username": "testuser", 
         "password": hash_password("mypassword"),
         "verified": False, 
@@ -142,7 +186,7 @@ def test_valid_token():
 
     response = client.get("/verify/token?testing=True")
 
-    user = mock_collection.find_one({"username": "testuser"})
+    user = mock_user_credentials.find_one({"username": "testuser"})
 
     assert response.status_code == 200
     assert response.json()["message"] == "Email verified successfully! You can now log in."
@@ -150,7 +194,7 @@ def test_valid_token():
     assert "token" not in user
 
 def test_get_daily_puzzle_valid_date(auth_token):
-    mock_collection.insert_one({
+    mock_puzzles.insert_one({
         "date": "2024-03-05",
         "name": "Test Puzzle",
         "description": "Solve this challenge",
@@ -182,15 +226,102 @@ def test_get_daily_puzzle_not_found(auth_token):
     assert response.status_code == 404
     assert response.json()["detail"] == "No puzzle available"
 
+def test_get_daily_puzzle_cached_until_created(auth_token):
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.get("/daily-puzzle/ABCDEF/2024-03-05?testing=True", headers=headers)
+    assert response.status_code == 404
+
+    # The miss is cached, a puzzle inserted behind the API's back is not seen
+    mock_puzzles.insert_one({
+        "date": "2024-03-05",
+        "name": "Test Puzzle",
+        "description": "Solve this challenge",
+        "tests": ["add(2,5) == 7"],
+        "room" : "ABCDEF"
+    })
+    response = client.get("/daily-puzzle/ABCDEF/2024-03-05?testing=True", headers=headers)
+    assert response.status_code == 404
+
+    # Creating the challenge through the API invalidates the cached entry
+    mock_puzzles.delete_many({})
+    mock_rooms.insert_one({"owner": "testtutor", "name": "testroom", "capacity": 10, "code": "ABCDEF"})
+    challenge_data = ChallengeData(
+        date="2024-03-05",
+        name="Test Challenge",
+        description="This is a test challenge",
+        room="ABCDEF",
+        tests=["add(2, 3) == 5"]
+    )
+    tutor_headers = {"Authorization": f"Bearer {create_access_token('testtutor')}"}
+    client.post("/create-challenge", json=challenge_data.model_dump(), params={"testing": "True"}, headers=tutor_headers)
+
+    response = client.get("/daily-puzzle/ABCDEF/2024-03-05?testing=True", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["name"] == "Test Challenge"
+
+def test_get_daily_puzzle_miss_expires(auth_token, monkeypatch):
+    # Another instance may create the puzzle, so a miss is only cached for ROOM_CACHE_TTL
+    monkeypatch.setattr(main, "ROOM_CACHE_TTL", 0)
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.get("/daily-puzzle/ABCDEF/2024-03-05?testing=True", headers=headers)
+    assert response.status_code == 404
+
+    mock_puzzles.insert_one({
+        "date": "2024-03-05",
+        "name": "Test Puzzle",
+        "description": "Solve this challenge",
+        "tests": ["add(2,5) == 7"],
+        "room" : "ABCDEF"
+    })
+    response = client.get("/daily-puzzle/ABCDEF/2024-03-05?testing=True", headers=headers)
+    assert response.status_code == 200
+
+def test_get_daily_puzzles_month(auth_token):
+    for date in ["2024-03-05", "2024-03-01", "2024-04-01"]:
+        mock_puzzles.insert_one({
+            "date": date,
+            "name": f"Puzzle {date}",
+            "description": "Solve this challenge",
+            "tests": ["add(2,5) == 7"],
+            "room" : "ABCDEF"
+        })
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.get("/daily-puzzles/ABCDEF/2024-03?testing=True", headers=headers)
+
+    assert response.status_code == 200
+    puzzles = response.json()["puzzles"]
+    assert [puzzle["date"] for puzzle in puzzles] == ["2024-03-01", "2024-03-05"]
+
+    # The month was prefetched into the per-day cache
+    mock_puzzles.delete_many({})
+    response = client.get("/daily-puzzle/ABCDEF/2024-03-05?testing=True", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["name"] == "Puzzle 2024-03-05"
+
+def test_get_daily_puzzles_invalid_month(auth_token):
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.get("/daily-puzzles/ABCDEF/March?testing=True", headers=headers)
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid month format. Use YYYY-MM."
+
+    # Unpadded months parse, but would never match the stored dates
+    response = client.get("/daily-puzzles/ABCDEF/2024-3?testing=True", headers=headers)
+    assert response.status_code == 400
+    response = client.get("/daily-puzzle/ABCDEF/2024-3-05?testing=True", headers=headers)
+    assert response.status_code == 400
+    assert len(daily_puzzle_cache) == 0
+
 def test_get_user_files_success(auth_token):
-    mock_collection.insert_one({
+    mock_user_files.insert_one({
         "owner": "testuser",
         "content": "def add(x, y):\nreturn x + y",
         "name": "file1",
         "purpose": "daily puzzle",
         "room": "ABCDEF"
     })
-    mock_collection.insert_one({
+    mock_user_files.insert_one({
         "owner": "testuser",
         "content": "x = 123",
         "name": "file2",
@@ -215,6 +346,67 @@ def test_get_user_files_empty(auth_token):
     assert response.status_code == 200
     assert len(response.json()["files"]) == 0
 
+def test_get_user_files_metadata_paginated(auth_token):
+    file_data = UserFileList(
+        files=[UserFile(owner="testuser", content=f"x = {i}", name=f"file{i}", purpose="playground") for i in range(3)],
+        room="ABCDEF"
+    )
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    client.post("/upload-files", json=file_data.model_dump(), params={"testing": "True"}, headers=headers)
+
+    response = client.get("/user-files/ABCDEF/testuser", params={"testing": "True", "metadata": "True", "limit": 2}, headers=headers)
+
+    assert response.status_code == 200
+    page = response.json()
+    assert [file["name"] for file in page["files"]] == ["file0", "file1"]
+    assert page["files"][0]["size"] == 5
+    assert all("content" not in file for file in page["files"])
+    assert page["next"] is not None
+
+    response = client.get("/user-files/ABCDEF/testuser", params={"testing": "True", "metadata": "True", "limit": 2, "after": page["next"]}, headers=headers)
+
+    page = response.json()
+    assert [file["name"] for file in page["files"]] == ["file2"]
+    assert page["next"] is None
+
+def test_get_user_files_invalid_cursor(auth_token):
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.get("/user-files/ABCDEF/testuser", params={"testing": "True", "after": "nope"}, headers=headers)
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+def test_get_user_files_invalid_limit(auth_token):
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    for limit in [0, -1, main.USER_FILE_PAGE_LIMIT + 1]:
+        response = client.get("/user-files/ABCDEF/testuser", params={"testing": "True", "limit": limit}, headers=headers)
+        assert response.status_code == 422
+
+    response = client.get("/user-files/ABCDEF/testuser", params={"testing": "True", "after": "f" * 1000}, headers=headers)
+    assert response.status_code == 422
+
+def test_get_user_file(auth_token):
+    mock_user_files.insert_one({
+        "owner": "testuser",
+        "content": "x = 123",
+        "name": "file1",
+        "purpose": "playground",
+        "room": "ABCDEF"
+    })
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.get("/user-file/ABCDEF/testuser", params={"testing": "True", "name": "file1", "purpose": "playground"}, headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["content"] == "x = 123"
+    assert "_id" not in response.json()
+
+    response = client.get("/user-file/ABCDEF/testuser", params={"testing": "True", "name": "file1", "purpose": "daily puzzle"}, headers=headers)
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "File not found"
+
 @pytest.mark.asyncio
 async def test_upload_user_files(auth_token):
     file_data = UserFileList(
@@ -228,11 +420,11 @@ async def test_upload_user_files(auth_token):
 
     assert response.status_code == 200
     assert response.json()["message"] == "Successfully updated 0 files, inserted 2 new files."
-    assert mock_collection.count_documents({"owner": "testuser", "room": "ABCDEF"}) == 2
+    assert mock_user_files.count_documents({"owner": "testuser", "room": "ABCDEF"}) == 2
 
 @pytest.mark.asyncio
 async def test_upload_user_files_update(auth_token):
-    mock_collection.insert_one({
+    mock_user_files.insert_one({
         "owner": "testuser",
         "content": "old content",
         "name": "file1",
@@ -252,14 +444,247 @@ async def test_upload_user_files_update(auth_token):
     assert "updated 1" in response.json()["message"]
     assert "inserted 0" in response.json()["message"]
 
-    updated_file = mock_collection.find_one({"owner": "testuser", "room": "ABCDEF", "name": "file1"})
+    updated_file = mock_user_files.find_one({"owner": "testuser", "room": "ABCDEF", "name": "file1"})
     
     assert updated_file is not None
     assert updated_file["content"] == "new content"
-    assert mock_collection.count_documents({"owner": "testuser", "room": "ABCDEF", "name": "file1"}) == 1
+    assert mock_user_files.count_documents({"owner": "testuser", "room": "ABCDEF", "name": "file1"}) == 1
+
+@pytest.mark.asyncio
+async def test_upload_user_files_unchanged_skipped(auth_token):
+    file_data = UserFileList(
+        files=[UserFile(owner="testuser", content="x = 1", name="file1", purpose="playground"),
+               UserFile(owner="testuser", content="y = 2", name="file2", purpose="playground")],
+        room="ABCDEF"
+    )
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    client.post("/upload-files", json=file_data.model_dump(), params={"testing": "True"}, headers=headers)
+
+    file_data.files[1].content = "y = 3"
+    response = client.post("/upload-files", json=file_data.model_dump(), params={"testing": "True"}, headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["message"] == "Successfully updated 1 files, inserted 0 new files."
+    assert response.json()["skipped"] == 1
+
+    response = client.post("/upload-files", json=file_data.model_dump(), params={"testing": "True"}, headers=headers)
+
+    assert response.json() == {"message": "No operations", "skipped": 2}
+
+def test_get_user_files_manifest(auth_token):
+    mock_user_files.insert_one({
+        "owner": "testuser",
+        "content": "x = 123",
+        "name": "legacy",
+        "purpose": "playground",
+        "room": "ABCDEF"
+    })
+    file_data = UserFileList(
+        files=[UserFile(owner="testuser", content="def add(x, y):\n    return x + y", name="file1", purpose="daily puzzle")],
+        room="ABCDEF"
+    )
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    client.post("/upload-files", json=file_data.model_dump(), params={"testing": "True"}, headers=headers)
+    response = client.get("/user-files-manifest/ABCDEF/testuser?testing=True", headers=headers)
+
+    assert response.status_code == 200
+    manifest = {entry["name"]: entry for entry in response.json()["files"]}
+    assert manifest["legacy"]["hash"] == hash_content("x = 123")
+    assert manifest["legacy"]["size"] == 7
+    assert manifest["legacy"]["updated_at"] is None
+    assert manifest["file1"]["hash"] == hash_content("def add(x, y):\n    return x + y")
+    assert manifest["file1"]["updated_at"] is not None
+    assert all("content" not in entry for entry in response.json()["files"])
+
+def test_upload_user_files_compressed(auth_token):
+    large_content = "print('hello world')\n" * 200
+    file_data = UserFileList(
+        files=[UserFile(owner="testuser", content=large_content, name="big", purpose="playground"),
+               UserFile(owner="testuser", content="x = 1", name="small", purpose="playground")],
+        room="ABCDEF"
+    )
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    client.post("/upload-files", json=file_data.model_dump(), params={"testing": "True"}, headers=headers)
+
+    stored = mock_user_files.find_one({"name": "big"})
+    assert stored["encoding"] == "zlib"
+    assert len(stored["content"]) < len(large_content)
+    assert mock_user_files.find_one({"name": "small"})["content"] == "x = 1"
+
+    response = client.get("/user-files/ABCDEF/testuser?testing=True", headers=headers)
+    files = {file["name"]: file for file in response.json()["files"]}
+    assert files["big"]["content"] == large_content
+    assert files["small"]["content"] == "x = 1"
+    assert "encoding" not in files["big"]
+
+def test_compress_user_files_migration():
+    large_content = "print('hello world')\n" * 200
+    mock_user_files.insert_one({"owner": "testuser", "content": large_content, "name": "big", "purpose": "playground", "room": "ABCDEF"})
+    mock_user_files.insert_one({"owner": "testuser", "content": "x = 1", "name": "small", "purpose": "playground", "room": "ABCDEF"})
+
+    stats = compress_user_files(mock_user_files, batch_size=1)
+
+    assert stats["documents"] == 1
+    assert stats["bytes_before"] == len(large_content)
+    assert stats["bytes_after"] < stats["bytes_before"]
+    assert mock_user_files.find_one({"name": "big"})["encoding"] == "zlib"
+    assert compress_user_files(mock_user_files)["documents"] == 0
+
+def test_upload_user_files_chunked(auth_token, monkeypatch):
+    monkeypatch.setattr(main, "USER_FILE_CHUNK_THRESHOLD", 64)
+    monkeypatch.setattr(main, "USER_FILE_CHUNK_SIZE", 32)
+    content = "".join(f"x{i} = {i * i}\n" for i in range(100))
+    file_data = UserFileList(
+        files=[UserFile(owner="testuser", content=content, name="big", purpose="playground")],
+        room="ABCDEF"
+    )
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    client.post("/upload-files", json=file_data.model_dump(), params={"testing": "True"}, headers=headers)
+
+    stored = mock_user_files.find_one({"name": "big"})
+    assert "content" not in stored
+    assert mock_file_chunks.count_documents({"version": stored["chunk_version"]}) == stored["chunk_count"] > 1
+
+    response = client.get("/user-files/ABCDEF/testuser?testing=True", headers=headers)
+    listed = response.json()["files"][0]
+    assert listed["chunked"] == True
+    assert "content" not in listed
+
+    response = client.get("/download-file/ABCDEF/testuser", params={"testing": "True", "name": "big", "purpose": "playground"}, headers=headers)
+    assert response.status_code == 200
+    assert response.text == content
+
+    # Replacing the file with a small one retires the old chunks, downloads still streaming them can finish
+    file_data.files[0].content = "x = 1"
+    client.post("/upload-files", json=file_data.model_dump(), params={"testing": "True"}, headers=headers)
+    old_chunks = list(mock_file_chunks.find({"version": stored["chunk_version"]}))
+    assert len(old_chunks) == stored["chunk_count"]
+    assert all("retired_at" in chunk for chunk in old_chunks)
+    assert mock_user_files.find_one({"name": "big"})["content"] == "x = 1"
+
+def test_upload_user_files_chunked_lost_race(auth_token, monkeypatch):
+    monkeypatch.setattr(main, "USER_FILE_CHUNK_THRESHOLD", 64)
+    monkeypatch.setattr(main, "USER_FILE_CHUNK_SIZE", 32)
+    mock_user_files.insert_one({"owner": "testuser", "room": "ABCDEF", "name": "big", "purpose": "playground", "content": "x = 1", "hash": "old"})
+
+    # Another upload of the same file commits between our read and our update
+    split_into_chunks = main.split_into_chunks
+    def concurrent_upload(data, size):
+        mock_user_files.update_one({"name": "big"}, {"$set": {"chunk_version": "theirs", "hash": "theirs"}})
+        return split_into_chunks(data, size)
+    monkeypatch.setattr(main, "split_into_chunks", concurrent_upload)
+
+    content = "".join(f"x{i} = {i * i}\n" for i in range(100))
+    file_data = UserFileList(
+        files=[UserFile(owner="testuser", content=content, name="big", purpose="playground")],
+        room="ABCDEF"
+    )
+    response = client.post("/upload-files", json=file_data.model_dump(), params={"testing": "True"}, headers={"Authorization": f"Bearer {auth_token}"})
+    assert response.status_code == 200
+    assert response.json()["message"] == "Successfully updated 0 files, inserted 0 new files."
+
+    # The winner's pointer is kept and the losing chunks are not left behind
+    assert mock_user_files.find_one({"name": "big"})["chunk_version"] == "theirs"
+    assert mock_file_chunks.count_documents({}) == 0
+
+def test_download_user_file(auth_token):
+    mock_user_files.insert_one({
+        "owner": "testuser",
+        "content": "x = 123",
+        "name": "file1",
+        "purpose": "playground",
+        "room": "ABCDEF"
+    })
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.get("/download-file/ABCDEF/testuser", params={"testing": "True", "name": "file1", "purpose": "playground"}, headers=headers)
+    assert response.status_code == 200
+    assert response.text == "x = 123"
+
+    response = client.get("/download-file/ABCDEF/testuser", params={"testing": "True", "name": "missing", "purpose": "playground"}, headers=headers)
+    assert response.status_code == 404
+    assert response.json()["detail"] == "File not found"
+
+def test_upload_user_files_write_behind(auth_token, monkeypatch):
+    monkeypatch.setattr(main, "USER_FILE_WRITE_BEHIND", True)
+    monkeypatch.setattr(main.user_file_buffer, "window", 60)
+    before = main.user_file_buffer.stats()
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    for content in ["x = 1", "x = 2", "x = 3"]:
+        file_data = UserFileList(
+            files=[UserFile(owner="testuser", content=content, name="file1", purpose="playground")],
+            room="ABCDEF"
+        )
+        response = client.post("/upload-files", json=file_data.model_dump(), params={"testing": "True"}, headers=headers)
+        assert response.json() == {"message": "Queued 1 files", "queued": 1}
+
+    assert mock_user_files.count_documents({"owner": "testuser"}) == 0
+
+    # Reading the files flushes the pending uploads first
+    response = client.get("/user-files/ABCDEF/testuser?testing=True", headers=headers)
+    assert [file["content"] for file in response.json()["files"]] == ["x = 3"]
+
+    after = main.user_file_buffer.stats()
+    assert after["written"] - before["written"] == 1
+    assert after["saved"] - before["saved"] == 2
+    assert after["pending"] == 0
+
+def test_write_behind_flush_on_stop(auth_token, monkeypatch):
+    monkeypatch.setattr(main, "USER_FILE_WRITE_BEHIND", True)
+    monkeypatch.setattr(main.user_file_buffer, "window", 60)
+
+    file_data = UserFileList(
+        files=[UserFile(owner="testuser", content="x = 1", name="file1", purpose="playground")],
+        room="ABCDEF"
+    )
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    client.post("/upload-files", json=file_data.model_dump(), params={"testing": "True"}, headers=headers)
+
+    main.user_file_buffer.stop()
+
+    assert mock_user_files.find_one({"owner": "testuser", "name": "file1"})["content"] == "x = 1"
+
+def test_write_behind_stats_requires_admin(tutor_token, monkeypatch):
+    headers = {"Authorization": f"Bearer {tutor_token}"}
+    assert client.get("/write-behind/stats").status_code in (401, 403)
+    assert client.get("/write-behind/stats", headers=headers).status_code == 403
+
+    monkeypatch.setattr(utils, "ADMIN_USERNAMES", {"testtutor"})
+    response = client.get("/write-behind/stats", headers=headers)
+    assert response.status_code == 200
+    assert "pending" in response.json()["userFiles"]
+
+def test_write_behind_has_pending_during_flush():
+    from write_behind import WriteBehindBuffer
+    writing, release, written = threading.Event(), threading.Event(), []
+    def writer(group, items):
+        writing.set()
+        release.wait(5)
+        written.extend(items)
+    buffer = WriteBehindBuffer("test", 60, writer)
+    buffer.submit("group", "file1", "x = 1")
+
+    flusher = threading.Thread(target=buffer.flush)
+    flusher.start()
+    writing.wait(5)
+    # Taken out of the buffer but not written yet, a read must still wait for it
+    assert buffer.has_pending("group")
+    assert not buffer.has_pending("other")
+
+    release.set()
+    buffer.flush("group")
+    assert written == ["x = 1"]
+    assert not buffer.has_pending("group")
+    flusher.join()
+    buffer.stop()
 
 def test_get_lectures_success(auth_token):
-    mock_collection.insert_one({
+    mock_lectures.insert_one({
         "difficulty": "easy",
         "title": "Intro to Python",
         "slides": [{"name": "slide1", "content": "Content of slide 1"}],
@@ -268,7 +693,7 @@ def test_get_lectures_success(auth_token):
         "passmark" : 50,
         "room": "ABCDEF"
     })
-    mock_collection.insert_one({
+    mock_lectures.insert_one({
         "difficulty": "easy",
         "title": "Basic Data Structures",
         "slides": [{"name": "slide1", "content": "Content of slide 1"}],
@@ -293,6 +718,13 @@ def test_get_lectures_success(auth_token):
     assert len(lectures[0]["required"]) == 0
     assert len(lectures[1]["required"]) == 1
 
+def test_content_reads_use_content_read_preference():
+    assert main.get_lecture_read_collection(False).read_preference == READ_PREFERENCES[MONGO_CONTENT_READ_PREFERENCE]
+    assert main.get_guided_projects_read_collection(False).read_preference == READ_PREFERENCES[MONGO_CONTENT_READ_PREFERENCE]
+    assert main.get_user_data_collection(False).read_preference == ReadPreference.PRIMARY
+    mock_lectures.insert_one({"title": "Intro", "room": "ABCDEF"})
+    assert main.get_lecture_read_collection(True).count_documents({"room": "ABCDEF"}) == 1
+
 def test_get_lectures_no_matches(auth_token):
     headers = {"Authorization": f"Bearer {auth_token}"}
     response = client.get("/lectures/ABCDEF/advanced?testing=True", headers=headers)
@@ -300,8 +732,74 @@ def test_get_lectures_no_matches(auth_token):
     assert response.status_code == 404
     assert response.json()["detail"] == "No lectures found for the given difficulty."
 
+def test_get_lectures_summary(auth_token):
+    mock_lectures.insert_one({
+        "difficulty": "easy",
+        "title": "Intro to Python",
+        "slides": [{"name": "slide1", "content": "Content of slide 1"}],
+        "quiz": [{"question": "What is 2+2?", "answer": "4", "options": ["3", "4", "5", "6"]}],
+        "required": [],
+        "passmark" : 50,
+        "room": "ABCDEF"
+    })
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.get("/lectures/ABCDEF/easy?testing=True&summary=True", headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["lectures"] == [{"title": "Intro to Python", "required": [], "passmark": 50}]
+
+def test_get_lectures_summary_no_matches(auth_token):
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.get("/lectures/ABCDEF/advanced?testing=True&summary=True", headers=headers)
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "No lectures found for the given difficulty."
+
+def test_get_lecture_part(auth_token):
+    mock_lectures.insert_one({
+        "difficulty": "easy",
+        "title": "Intro to Python",
+        "slides": [{"name": "slide1", "content": "Content of slide 1"}, {"name": "slide2", "content": "Content of slide 2"}],
+        "quiz": [{"question": "What is 2+2?", "answer": "4", "options": ["3", "4", "5", "6"]}],
+        "required": [],
+        "passmark" : 50,
+        "room": "ABCDEF"
+    })
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.get("/lecture/ABCDEF/slides", params={"testing": "True", "title": "Intro to Python"}, headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["title"] == "Intro to Python"
+    assert len(response.json()["slides"]) == 2
+    assert "quiz" not in response.json()
+
+    response = client.get("/lecture/ABCDEF/quiz", params={"testing": "True", "title": "Intro to Python"}, headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["quiz"][0]["answer"] == "4"
+
+def test_get_lecture_part_invalid(auth_token):
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.get("/lecture/ABCDEF/answers", params={"testing": "True", "title": "Intro to Python"}, headers=headers)
+    assert response.status_code == 400
+
+    response = client.get("/lecture/ABCDEF/slides", params={"testing": "True", "title": "Missing"}, headers=headers)
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Lecture not found"
+
+def test_get_lecture_part_title_with_slash(auth_token):
+    mock_lectures.insert_one({"title": "I/O basics", "slides": [{"name": "slide1", "content": "open()"}], "quiz": [], "room": "ABCDEF"})
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.get("/lecture/ABCDEF/slides", params={"testing": "True", "title": "I/O basics"}, headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["title"] == "I/O basics"
+
 def test_get_guided_projects_success(auth_token):
-    mock_collection.insert_one({
+    mock_projects.insert_one({
         "name": "Simple Greeting Program",
         "description": "Write a Python program that asks for the user's name and then prints a greeting message.",
         "difficulty": "easy",
@@ -358,7 +856,8 @@ def test_get_guided_projects_not_found(auth_token):
     assert response.json()["detail"] == "No guided projects found."
 
 def test_get_user_data_success(auth_token):
-    mock_collection.insert_one({
+    register_test_content(lectures=["Intro 1"], puzzles=["2025-03-10", "2025-03-12"])
+    mock_user_data.insert_one({
         "username": "testuser",
         "completions": {
             "lectures": ["Intro 1"],
@@ -385,8 +884,8 @@ def test_get_user_data_not_found(auth_token):
     assert response.status_code == 404
     assert response.json()["detail"] == "No user data found"
 
-def test_get_user_data_many(auth_token):
-    mock_collection.insert_one({
+def test_find_duplicate_user_data():
+    mock_user_data.insert_one({
         "username": "testuser",
         "completions": {
             "lectures": ["Intro 1"],
@@ -396,7 +895,7 @@ def test_get_user_data_many(auth_token):
         "room": "ABCDEF",
         "level": "easy"
     })
-    mock_collection.insert_one({
+    mock_user_data.insert_one({
         "username": "testuser",
         "completions": {
             "lectures": [],
@@ -407,13 +906,70 @@ def test_get_user_data_many(auth_token):
         "level": "easy"
     })
 
+    duplicates = find_duplicate_user_data(mock_user_data)
+
+    assert duplicates == [{"username": "testuser", "room": "ABCDEF", "count": 2}]
+    assert ensure_user_data_index(mock_user_data) == duplicates
+
+def test_create_user_data_conflict(auth_token):
+    mock_user_data.insert_one({
+        "username": "testuser",
+        "completions": {
+            "lectures": [],
+            "projects": [],
+            "puzzles": []
+        },
+        "room": "ABCDEF",
+        "level": "intermediate"
+    })
+    assert ensure_user_data_index(mock_user_data) == []
+
+    user_data = UserData(
+        username="testuser",
+        completions=CompletionData(
+            lectures=[],
+            projects=[],
+            puzzles=[]
+        ),
+        room="ABCDEF",
+        level="easy"
+    )
+
     headers = {"Authorization": f"Bearer {auth_token}"}
-    response = client.get("/user-data/testuser/ABCDEF?testing=True", headers=headers)
+    try:
+        response = client.post("/user-data", json=user_data.model_dump(), params={"testing": "True"}, headers=headers)
+    finally:
+        mock_user_data.drop_index("username_room_unique")
 
     assert response.status_code == 409
-    assert response.json()["detail"] == "More than one user data found -> problem :("
+    assert response.json()["detail"] == "User data already exists for this room"
+
+def test_migrate_completions_to_bits():
+    register_test_content(lectures=["Intro 1", "Intro 2"], puzzles=["2025-03-10"])
+    mock_user_data.insert_one({
+        "username": "testuser",
+        "completions": {
+            "lectures": ["Intro 1", "Intro 2"],
+            "projects": [],
+            "puzzles": ["2025-03-10"]
+        },
+        "room": "ABCDEF",
+        "level": "easy"
+    })
+
+    assert migrate_completions_to_bits(mock_user_data, mock_content_ids) == 1
+
+    user_data = mock_user_data.find_one({"username": "testuser"})
+    assert "completions" not in user_data
+    assert user_data["completion_counts"] == {"lectures": 2, "projects": 0, "puzzles": 1}
+    assert read_completions(mock_content_ids, user_data, "ABCDEF") == {
+        "lectures": ["Intro 1", "Intro 2"],
+        "projects": [],
+        "puzzles": ["2025-03-10"]
+    }
 
 def test_create_user_data(auth_token):
+    mock_rooms.insert_one({"owner": "testtutor", "name": "testroom", "capacity": 10, "code": "ABCDEF", "members": 0})
     user_data = UserData(
         username="testuser",
         completions=CompletionData(
@@ -431,11 +987,38 @@ def test_create_user_data(auth_token):
     assert response.status_code == 200
     assert response.json()["message"] == "User data created successfully"
 
-    created_data_count = mock_collection.count_documents({"username": "testuser", "room": "ABCDEF"})
+    created_data_count = mock_user_data.count_documents({"username": "testuser", "room": "ABCDEF"})
     assert created_data_count == 1
+    assert mock_rooms.find_one({"code": "ABCDEF"})["members"] == 1
+
+    # Updating existing data doesn't take another seat
+    response = client.post("/user-data", json=user_data.model_dump(), params={"testing": "True"}, headers=headers)
+    assert response.json()["message"] == "User data updated successfully"
+    assert mock_rooms.find_one({"code": "ABCDEF"})["members"] == 1
+
+def test_create_user_data_room_full(auth_token):
+    mock_rooms.insert_one({"owner": "testtutor", "name": "testroom", "capacity": 1, "code": "ABCDEF", "members": 1})
+    user_data = UserData(username="testuser", completions=CompletionData(lectures=[], projects=[], puzzles=[]), room="ABCDEF", level="easy")
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.post("/user-data", json=user_data.model_dump(), params={"testing": "True"}, headers=headers)
+
+    assert response.status_code == 409
+    assert response.json()["detail"] == "Room is full"
+    assert mock_user_data.count_documents({"username": "testuser"}) == 0
+
+def test_create_user_data_room_not_found(auth_token):
+    user_data = UserData(username="testuser", completions=CompletionData(lectures=[], projects=[], puzzles=[]), room="ZZZZZZ", level="easy")
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.post("/user-data", json=user_data.model_dump(), params={"testing": "True"}, headers=headers)
+
+    assert response.status_code == 404
+    assert mock_user_data.count_documents({"username": "testuser"}) == 0
 
 def test_update_user_data(auth_token):
-    mock_collection.insert_one({
+    register_test_content(lectures=["Intro 1"], projects=["a", "b", "c"], puzzles=["2025-03-10", "2025-03-12"])
+    mock_user_data.insert_one({
         "username": "testuser",
         "completions": {
             "lectures": [],
@@ -463,15 +1046,19 @@ def test_update_user_data(auth_token):
     assert response.status_code == 200
     assert response.json()["message"] == "User data updated successfully"
 
-    user_data_count = mock_collection.count_documents({"username": "testuser", "room": "ABCDEF"})
+    user_data_count = mock_user_data.count_documents({"username": "testuser", "room": "ABCDEF"})
     assert user_data_count == 1
 
-    updated_user_data = mock_collection.find_one({"username": "testuser", "room": "ABCDEF"})
-    assert len(updated_user_data["completions"]["projects"]) == 3
-    assert updated_user_data["completions"]["puzzles"][1] == "2025-03-12"
+    updated_user_data = mock_user_data.find_one({"username": "testuser", "room": "ABCDEF"})
+    completions = read_completions(mock_content_ids, updated_user_data, "ABCDEF")
+    assert len(completions["projects"]) == 3
+    assert completions["puzzles"][1] == "2025-03-12"
+    assert "completions" not in updated_user_data
+    assert updated_user_data["completion_counts"]["projects"] == 3
 
 def test_update_lecture_completion(auth_token):
-    mock_collection.insert_one({
+    register_test_content(lectures=["Existing Lecture", "New Lecture"])
+    mock_user_data.insert_one({
         "username": "testuser",
         "completions": {
             "lectures": ["Existing Lecture"],
@@ -492,12 +1079,14 @@ def test_update_lecture_completion(auth_token):
     assert response.status_code == 200
     assert response.json()["message"] == "Lectures completion updated successfully"
 
-    user_data = mock_collection.find_one({"username": "testuser"})
-    assert "New Lecture" in user_data["completions"]["lectures"]
-    assert len(user_data["completions"]["lectures"]) == 2
+    user_data = mock_user_data.find_one({"username": "testuser"})
+    completions = read_completions(mock_content_ids, user_data, "ABCDEF")
+    assert "New Lecture" in completions["lectures"]
+    assert len(completions["lectures"]) == 2
 
 def test_update_lecture_completion_with_promotion(auth_token):
-    mock_collection.insert_one({
+    register_test_content(lectures=["Existing Lecture", "New Lecture"])
+    mock_user_data.insert_one({
         "username": "testuser",
         "completions": {
             "lectures": ["Existing Lecture"],
@@ -507,7 +1096,7 @@ def test_update_lecture_completion_with_promotion(auth_token):
         "room":"ABCDEF",
         "level":"intermediate"
     })
-    mock_collection.insert_one({
+    mock_lectures.insert_one({
         "difficulty": "intermediate",
         "title": "New Lecture",
         "room":"ABCDEF"
@@ -517,19 +1106,129 @@ def test_update_lecture_completion_with_promotion(auth_token):
         room="ABCDEF",
         lecture="New Lecture"
     )
-
-    headers = {"Authorization": f"Bearer {auth_token}"}
-    response = client.post("/update-lecture-completion", json=new_lecture_request.model_dump(), params={"testing": "True"}, headers=headers)
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.post("/update-lecture-completion", json=new_lecture_request.model_dump(), params={"testing": "True"}, headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["message"] == "Promoted to advanced level"
+
+def test_update_project_completion(auth_token):
+    register_test_content(projects=["Existing Project", "New Project"])
+    mock_user_data.insert_one({
+        "username": "testuser",
+        "completions": {
+            "lectures": [],
+            "projects": ["Existing Project"],
+            "puzzles": []
+        },
+        "room":"ABCDEF"
+    })
+
+    new_project_request = ProjectCompletionRequest(
+        username="testuser",
+        room="ABCDEF",
+        project="New Project"
+    )
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.post("/update-project-completion", json=new_project_request.model_dump(), params={"testing": "True"}, headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["message"] == "Projects completion updated successfully"
+
+    user_data = mock_user_data.find_one({"username": "testuser"})
+    completions = read_completions(mock_content_ids, user_data, "ABCDEF")
+    assert "New Project" in completions["projects"]
+    assert len(completions["projects"]) == 2
+
+def test_update_puzzle_completion(auth_token):
+    register_test_content(puzzles=["2025-03-10", "2025-03-12"])
+    mock_user_data.insert_one({
+        "username": "testuser",
+        "completions": {
+            "lectures": [],
+            "projects": [],
+            "puzzles": ["2025-03-10"]
+        },
+        "room":"ABCDEF"
+    })
+
+    new_puzzle_request = PuzzleCompletionRequest(
+        username="testuser",
+        room="ABCDEF",
+        puzzle="2025-03-12"
+    )
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.post("/update-puzzle-completion", json=new_puzzle_request.model_dump(), params={"testing": "True"}, headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["message"] == "Puzzles completion updated successfully"
+
+    user_data = mock_user_data.find_one({"username": "testuser"})
+    completions = read_completions(mock_content_ids, user_data, "ABCDEF")
+    assert "2025-03-12" in completions["puzzles"]
+    assert len(completions["puzzles"]) == 2
+
+def test_update_lecture_completion_no_changes(auth_token):
+    register_test_content(lectures=["Same Lecture"])
+    mock_user_data.insert_one({
+        "username": "testuser",
+        "completions": {
+            "lectures": ["Same Lecture"],
+            "projects": [],
+            "puzzles": []
+        },
+        "room":"ABCDEF"
+    })
+
+    new_lecture_request = LectureCompletionRequest(
+        username="testuser",
+        room="ABCDEF",
+        lecture="Same Lecture"
+    )
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.post("/update-lecture-completion", json=new_lecture_request.model_dump(), params={"testing": "True"}, headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["message"] == "No changes made"
+
+    user_data = mock_user_data.find_one({"username": "testuser"})
+    completions = read_completions(mock_content_ids, user_data, "ABCDEF")
+    assert len(completions["lectures"]) == 1
+
+def test_update_lecture_completion_unknown_lecture(auth_token):
+    register_test_content(lectures=["Real Lecture"])
+    mock_user_data.insert_one({"username": "testuser", "completions": {"lectures": [], "projects": [], "puzzles": []}, "room": "ABCDEF"})
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.post("/update-lecture-completion", json={"username": "testuser", "room": "ABCDEF", "lecture": "Made Up"}, params={"testing": "True"}, headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["message"] == "No changes made"
+    # Made-up titles never get an id, so they can't grow the completion bitsets
+    assert mock_content_ids.count_documents({"room": "ABCDEF"}) == 1
+
+    batch_request = CompletionBatchRequest(
+        username="testuser",
+        room="ABCDEF",
+        events=[CompletionEvent(type="lecture", title="Real Lecture"), CompletionEvent(type="lecture", title="Made Up")]
+    )
+    response = client.post("/update-completions", json=batch_request.model_dump(), params={"testing": "True"}, headers=headers)
 
     assert response.status_code == 200
-    assert response.json()["message"] == "Promoted to advanced level"
+    assert [result["status"] for result in response.json()["results"]] == ["completed", "invalid"]
+    assert mock_content_ids.count_documents({"room": "ABCDEF"}) == 1
 
-def test_update_project_completion(auth_token):
-    mock_collection.insert_one({
+def test_update_project_completion_no_changes(auth_token):
+    register_test_content(projects=["Same Project"])
+    mock_user_data.insert_one({
         "username": "testuser",
         "completions": {
             "lectures": [],
-            "projects": ["Existing Project"],
+            "projects": ["Same Project"],
             "puzzles": []
         },
         "room":"ABCDEF"
@@ -538,21 +1237,22 @@ def test_update_project_completion(auth_token):
     new_project_request = ProjectCompletionRequest(
         username="testuser",
         room="ABCDEF",
-        project="New Project"
+        project="Same Project"
     )
 
     headers = {"Authorization": f"Bearer {auth_token}"}
     response = client.post("/update-project-completion", json=new_project_request.model_dump(), params={"testing": "True"}, headers=headers)
 
     assert response.status_code == 200
-    assert response.json()["message"] == "Projects completion updated successfully"
+    assert response.json()["message"] == "No changes made"
 
-    user_data = mock_collection.find_one({"username": "testuser"})
-    assert "New Project" in user_data["completions"]["projects"]
-    assert len(user_data["completions"]["projects"]) == 2
+    user_data = mock_user_data.find_one({"username": "testuser"})
+    completions = read_completions(mock_content_ids, user_data, "ABCDEF")
+    assert len(completions["projects"]) == 1
 
-def test_update_puzzle_completion(auth_token):
-    mock_collection.insert_one({
+def test_update_puzzle_completion_no_changes(auth_token):
+    register_test_content(puzzles=["2025-03-10"])
+    mock_user_data.insert_one({
         "username": "testuser",
         "completions": {
             "lectures": [],
@@ -565,96 +1265,200 @@ def test_update_puzzle_completion(auth_token):
     new_puzzle_request = PuzzleCompletionRequest(
         username="testuser",
         room="ABCDEF",
-        puzzle="2025-03-12"
+        puzzle="2025-03-10"
     )
 
     headers = {"Authorization": f"Bearer {auth_token}"}
     response = client.post("/update-puzzle-completion", json=new_puzzle_request.model_dump(), params={"testing": "True"}, headers=headers)
 
     assert response.status_code == 200
-    assert response.json()["message"] == "Puzzles completion updated successfully"
+    assert response.json()["message"] == "No changes made"
 
-    user_data = mock_collection.find_one({"username": "testuser"})
-    assert "2025-03-12" in user_data["completions"]["puzzles"]
-    assert len(user_data["completions"]["puzzles"]) == 2
+    user_data = mock_user_data.find_one({"username": "testuser"})
+    completions = read_completions(mock_content_ids, user_data, "ABCDEF")
+    assert len(completions["puzzles"]) == 1
 
-def test_update_lecture_completion_no_changes(auth_token):
-    mock_collection.insert_one({
+def test_update_completions_batch(auth_token):
+    register_test_content(lectures=["Existing Lecture"], projects=["New Project"], puzzles=["2025-03-12"])
+    mock_user_data.insert_one({
         "username": "testuser",
         "completions": {
-            "lectures": ["Same Lecture"],
+            "lectures": ["Existing Lecture"],
             "projects": [],
             "puzzles": []
         },
-        "room":"ABCDEF"
+        "room": "ABCDEF",
+        "level": "easy"
     })
 
-    new_lecture_request = LectureCompletionRequest(
+    batch_request = CompletionBatchRequest(
         username="testuser",
         room="ABCDEF",
-        lecture="Same Lecture"
+        events=[
+            CompletionEvent(type="lecture", title="Existing Lecture"),
+            CompletionEvent(type="project", title="New Project"),
+            CompletionEvent(type="puzzle", title="2025-03-12"),
+            CompletionEvent(type="puzzle", title="2025-03-12"),
+            CompletionEvent(type="badge", title="Unknown")
+        ]
     )
 
     headers = {"Authorization": f"Bearer {auth_token}"}
-    response = client.post("/update-lecture-completion", json=new_lecture_request.model_dump(), params={"testing": "True"}, headers=headers)
+    response = client.post("/update-completions", json=batch_request.model_dump(), params={"testing": "True"}, headers=headers)
 
     assert response.status_code == 200
-    assert response.json()["message"] == "No changes made"
-
-    user_data = mock_collection.find_one({"username": "testuser"})
-    assert len(user_data["completions"]["lectures"]) == 1
-
-def test_update_project_completion_no_changes(auth_token):
-    mock_collection.insert_one({
+    assert response.json()["message"] == "Completions updated successfully"
+    statuses = [result["status"] for result in response.json()["results"]]
+    assert statuses == ["unchanged", "completed", "completed", "unchanged", "invalid"]
+
+    user_data = mock_user_data.find_one({"username": "testuser"})
+    completions = read_completions(mock_content_ids, user_data, "ABCDEF")
+    assert completions["projects"] == ["New Project"]
+    assert completions["puzzles"] == ["2025-03-12"]
+
+def test_update_completions_batch_with_promotion(auth_token):
+    register_test_content(lectures=["Lecture 1", "Lecture 2"])
+    mock_user_data.insert_one({
         "username": "testuser",
         "completions": {
             "lectures": [],
-            "projects": ["Same Project"],
+            "projects": [],
             "puzzles": []
         },
-        "room":"ABCDEF"
+        "room": "ABCDEF",
+        "level": "easy"
     })
+    mock_lectures.insert_one({"difficulty": "easy", "title": "Lecture 1", "room": "ABCDEF"})
+    mock_lectures.insert_one({"difficulty": "easy", "title": "Lecture 2", "room": "ABCDEF"})
 
-    new_project_request = ProjectCompletionRequest(
+    batch_request = CompletionBatchRequest(
         username="testuser",
         room="ABCDEF",
-        project="Same Project"
+        events=[
+            CompletionEvent(type="lecture", title="Lecture 1"),
+            CompletionEvent(type="lecture", title="Lecture 2")
+        ]
     )
 
     headers = {"Authorization": f"Bearer {auth_token}"}
-    response = client.post("/update-project-completion", json=new_project_request.model_dump(), params={"testing": "True"}, headers=headers)
+    response = client.post("/update-completions", json=batch_request.model_dump(), params={"testing": "True"}, headers=headers)
 
     assert response.status_code == 200
-    assert response.json()["message"] == "No changes made"
+    assert response.json()["message"] == "Promoted to intermediate level"
 
-    user_data = mock_collection.find_one({"username": "testuser"})
-    assert len(user_data["completions"]["projects"]) == 1
+    user_data = mock_user_data.find_one({"username": "testuser"})
+    completions = read_completions(mock_content_ids, user_data, "ABCDEF")
+    assert user_data["level"] == "intermediate"
+    assert sorted(completions["lectures"]) == ["Lecture 1", "Lecture 2"]
 
-def test_update_puzzle_completion_no_changes(auth_token):
-    mock_collection.insert_one({
+def test_update_completions_batch_no_user_data(auth_token):
+    register_test_content(lectures=["Lecture 1"])
+    batch_request = CompletionBatchRequest(
+        username="testuser",
+        room="ABCDEF",
+        events=[CompletionEvent(type="lecture", title="Lecture 1")]
+    )
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.post("/update-completions", json=batch_request.model_dump(), params={"testing": "True"}, headers=headers)
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "No user data found"
+
+def test_idempotency_key_replays_response(auth_token):
+    register_test_content(projects=["New Project"])
+    mock_user_data.insert_one({
         "username": "testuser",
         "completions": {
             "lectures": [],
             "projects": [],
-            "puzzles": ["2025-03-10"]
+            "puzzles": []
         },
-        "room":"ABCDEF"
+        "room": "ABCDEF"
     })
-
-    new_puzzle_request = PuzzleCompletionRequest(
+    project_request = ProjectCompletionRequest(
         username="testuser",
         room="ABCDEF",
-        puzzle="2025-03-10"
+        project="New Project"
     )
 
-    headers = {"Authorization": f"Bearer {auth_token}"}
-    response = client.post("/update-puzzle-completion", json=new_puzzle_request.model_dump(), params={"testing": "True"}, headers=headers)
+    headers = {"Authorization": f"Bearer {auth_token}", "Idempotency-Key": "retry-1"}
+    first = client.post("/update-project-completion", json=project_request.model_dump(), params={"testing": "True"}, headers=headers)
+    second = client.post("/update-project-completion", json=project_request.model_dump(), params={"testing": "True"}, headers=headers)
 
-    assert response.status_code == 200
+    assert first.json()["message"] == "Projects completion updated successfully"
+    assert second.status_code == 200
+    assert second.json() == first.json()
+    assert second.headers["Idempotent-Replayed"] == "true"
+
+    # Without the in-process cache the stored response is replayed
+    clear_caches()
+    third = client.post("/update-project-completion", json=project_request.model_dump(), params={"testing": "True"}, headers=headers)
+    assert third.json() == first.json()
+
+    # A new key executes the handler again
+    headers["Idempotency-Key"] = "retry-2"
+    response = client.post("/update-project-completion", json=project_request.model_dump(), params={"testing": "True"}, headers=headers)
     assert response.json()["message"] == "No changes made"
 
-    user_data = mock_collection.find_one({"username": "testuser"})
-    assert len(user_data["completions"]["puzzles"]) == 1
+def test_idempotency_key_different_request(auth_token):
+    headers = {"Authorization": f"Bearer {auth_token}", "Idempotency-Key": "retry-1"}
+    client.post("/update-puzzle-completion", json=PuzzleCompletionRequest(username="testuser", room="ABCDEF", puzzle="2025-03-10").model_dump(), params={"testing": "True"}, headers=headers)
+    response = client.post("/update-puzzle-completion", json=PuzzleCompletionRequest(username="testuser", room="ABCDEF", puzzle="2025-03-11").model_dump(), params={"testing": "True"}, headers=headers)
+
+    assert response.status_code == 422
+    assert response.json()["detail"] == "Idempotency-Key was already used for a different request"
+
+def test_idempotency_key_in_progress(auth_token):
+    body = PuzzleCompletionRequest(username="testuser", room="ABCDEF", puzzle="2025-03-10").model_dump_json().encode("utf-8")
+    mock_idempotency_keys.insert_one({
+        "_id": idempotency_record_id("retry-1", "POST", "/update-puzzle-completion", f"Bearer {auth_token}"),
+        "fingerprint": request_fingerprint("testing=True", body),
+        "state": "pending"
+    })
+
+    headers = {"Authorization": f"Bearer {auth_token}", "Idempotency-Key": "retry-1", "Content-Type": "application/json"}
+    response = client.post("/update-puzzle-completion", content=body, params={"testing": "True"}, headers=headers)
+
+    assert response.status_code == 409
+    assert response.json()["detail"] == "A request with this Idempotency-Key is still in progress"
+
+def test_idempotency_key_released_on_retryable_status(auth_token, monkeypatch):
+    register_test_content(projects=["New Project"])
+    mock_user_data.insert_one({"username": "testuser", "completions": {"lectures": [], "projects": [], "puzzles": []}, "room": "ABCDEF"})
+    from fastapi import HTTPException
+    def conflict(*args):
+        raise HTTPException(status_code=409, detail="Completions were updated concurrently, please retry")
+    monkeypatch.setattr(main, "add_completions", conflict)
+
+    body = ProjectCompletionRequest(username="testuser", room="ABCDEF", project="New Project").model_dump()
+    headers = {"Authorization": f"Bearer {auth_token}", "Idempotency-Key": "retry-1"}
+    response = client.post("/update-project-completion", json=body, params={"testing": "True"}, headers=headers)
+    assert response.status_code == 409
+    assert mock_idempotency_keys.count_documents({}) == 0
+
+    # The retry with the same key executes instead of replaying the conflict
+    monkeypatch.undo()
+    response = client.post("/update-project-completion", json=body, params={"testing": "True"}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["message"] == "Projects completion updated successfully"
+
+def test_idempotency_key_expired_lease(auth_token):
+    body = PuzzleCompletionRequest(username="testuser", room="ABCDEF", puzzle="2025-03-10").model_dump_json().encode("utf-8")
+    record_id = idempotency_record_id("retry-1", "POST", "/update-puzzle-completion", f"Bearer {auth_token}")
+    # Left behind by a worker that crashed mid-request
+    mock_idempotency_keys.insert_one({
+        "_id": record_id,
+        "fingerprint": request_fingerprint("testing=True", body),
+        "state": "pending",
+        "claimed_at": datetime.now(timezone.utc) - timedelta(hours=1)
+    })
+
+    headers = {"Authorization": f"Bearer {auth_token}", "Idempotency-Key": "retry-1", "Content-Type": "application/json"}
+    response = client.post("/update-puzzle-completion", content=body, params={"testing": "True"}, headers=headers)
+
+    assert response.status_code != 409
+    assert mock_idempotency_keys.find_one({"_id": record_id})["state"] == "completed"
 
 def test_execute_code_successful(auth_token):
     code_request = CodeRequest(
@@ -679,7 +1483,7 @@ def test_execute_code_unsuccessful(auth_token):
     assert response.json()["status"] == "error"
 
 def test_create_classroom_duplicate_name(tutor_token):
-    mock_collection.insert_one({
+    mock_rooms.insert_one({
         "owner": "boss", 
         "name": "test-clasroom", 
         "capacity": 3
@@ -698,7 +1502,7 @@ def test_create_classroom_duplicate_name(tutor_token):
     assert response.json()["detail"] == "Name for classroom already taken"
 
 def test_create_classroom_duplicate_code(tutor_token):
-    mock_collection.insert_one({
+    mock_rooms.insert_one({
         "owner": "testtutor", 
         "name": "test-clasroom", 
         "capacity": 3,
@@ -719,7 +1523,7 @@ def test_create_classroom_duplicate_code(tutor_token):
 
     assert response.json()["code"] != 'ABC123'
 
-    count = mock_collection.count_documents({"code": "ABC123"})
+    count = mock_rooms.count_documents({"code": "ABC123"})
     assert count == 1
 
 
@@ -735,7 +1539,7 @@ def test_create_classroom_success(tutor_token):
 
     assert response.status_code == 200
 
-    count = mock_collection.count_documents({"name": "test-clasroom"})
+    count = mock_rooms.count_documents({"name": "test-clasroom"})
     assert count == 1
 
 
@@ -756,7 +1560,7 @@ async def test_register_tutor():
 
 @pytest.mark.asyncio
 async def test_register_duplicate_tutor():
-    mock_collection.insert_one({
+    mock_tutor_credentials.insert_one({
         "username": "testtutor", 
         "email": "test@example.com", 
         "password": hash_password("password")
@@ -790,7 +1594,7 @@ def test_register_invalid_email_tutor():
     assert response.json()["detail"] == "Invalid email format"
 
 def test_login_tutor_invalid_password():
-    mock_collection.insert_one({
+    mock_tutor_credentials.insert_one({
         "username": "testtutor", 
         "password": hash_password("correctpassword"), 
         "verified": True
@@ -807,7 +1611,7 @@ def test_login_tutor_invalid_password():
     assert response.json()["detail"] == "Invalid username or password"
 
 def test_login_tutor_unverified_email():
-    mock_collection.insert_one({
+    mock_tutor_credentials.insert_one({
         "username": "unverified_tutor", 
         "password": hash_password("password"),
         "verified": False
@@ -824,7 +1628,7 @@ def test_login_tutor_unverified_email():
     assert response.json()["detail"] == "Email not verified. Please check your inbox."
 
 def test_login_tutor_not_approved():
-    mock_collection.insert_one({
+    mock_tutor_credentials.insert_one({
         "username": "unapproved_tutor", 
         "password": hash_password("password"),
         "approved": False
@@ -841,7 +1645,7 @@ def test_login_tutor_not_approved():
     assert response.json()["detail"] == "Account not approved yet. Please wait until notified or contact an admin."
 
 def test_login_tutor_success():
-    mock_collection.insert_one({
+    mock_tutor_credentials.insert_one({
         "username": "testtutor", 
         "password": hash_password("mypassword"), 
         "verified": True
@@ -858,7 +1662,7 @@ def test_login_tutor_success():
     assert response.json()["message"] == "Login successful!"
 
 def test_get_single_room(tutor_token):
-    mock_collection.insert_one({
+    mock_rooms.insert_one({
         "owner": "testtutor", 
         "name": "testroom", 
         "capacity": 2
@@ -872,12 +1676,12 @@ def test_get_single_room(tutor_token):
     assert response.json()["rooms"][0]["name"] == "testroom"
 
 def test_get_multiple_rooms(tutor_token):
-    mock_collection.insert_one({
+    mock_rooms.insert_one({
         "owner": "testtutor", 
         "name": "testroom", 
         "capacity": 2
     })
-    mock_collection.insert_one({
+    mock_rooms.insert_one({
         "owner": "testtutor", 
         "name": "testroom2", 
         "capacity": 4
@@ -896,6 +1700,80 @@ def test_get_no_rooms(tutor_token):
     assert response.status_code == 200
     assert len(response.json()["rooms"]) == 0
 
+def test_get_room_by_code_cached(auth_token, tutor_token):
+    mock_rooms.insert_one({
+        "owner": "testtutor",
+        "name": "testroom",
+        "capacity": 2,
+        "code": "ABCDEF"
+    })
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.get("/room/ABCDEF?testing=True", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["name"] == "testroom"
+
+    # Served from the cache even though the document changed behind the API's back
+    mock_rooms.update_one({"code": "ABCDEF"}, {"$set": {"name": "renamed"}})
+    response = client.get("/room/ABCDEF?testing=True", headers=headers)
+    assert response.json()["name"] == "testroom"
+
+    # Deleting the room through the API invalidates the entry
+    client.delete("/delete-room/ABCDEF?testing=True", headers={"Authorization": f"Bearer {tutor_token}"})
+    response = client.get("/room/ABCDEF?testing=True", headers=headers)
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Room code doesn't exist"
+
+def test_join_room(auth_token):
+    mock_rooms.insert_one({
+        "owner": "testtutor",
+        "name": "testroom",
+        "capacity": 1,
+        "code": "ABCDEF"
+    })
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    join_request = JoinRoomRequest(username="testuser", code="ABCDEF")
+    response = client.post("/join-room", json=join_request.model_dump(), params={"testing": "True"}, headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["message"] == "Joined room successfully"
+    assert mock_rooms.find_one({"code": "ABCDEF"})["members"] == 1
+
+    user_data = client.get("/user-data/testuser/ABCDEF?testing=True", headers=headers).json()
+    assert user_data["level"] == "easy"
+    assert user_data["completions"] == {"lectures": [], "projects": [], "puzzles": []}
+
+    response = client.post("/join-room", json=join_request.model_dump(), params={"testing": "True"}, headers=headers)
+
+    assert response.json()["message"] == "Already a member of this room"
+    assert mock_rooms.find_one({"code": "ABCDEF"})["members"] == 1
+
+def test_join_room_full(auth_token):
+    mock_rooms.insert_one({
+        "owner": "testtutor",
+        "name": "testroom",
+        "capacity": 2,
+        "members": 2,
+        "code": "ABCDEF"
+    })
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    join_request = JoinRoomRequest(username="testuser", code="ABCDEF")
+    response = client.post("/join-room", json=join_request.model_dump(), params={"testing": "True"}, headers=headers)
+
+    assert response.status_code == 409
+    assert response.json()["detail"] == "Room is full"
+    assert mock_user_data.count_documents({"username": "testuser"}) == 0
+
+def test_join_room_not_found(auth_token):
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    join_request = JoinRoomRequest(username="testuser", code="ABCDEF")
+    response = client.post("/join-room", json=join_request.model_dump(), params={"testing": "True"}, headers=headers)
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Room code doesn't exist"
+
 def test_delete_no_room(tutor_token):
     headers = {"Authorization": f"Bearer {tutor_token}"}
     response = client.delete("/delete-room/ABCDEF?testing=True", headers=headers)
@@ -904,23 +1782,403 @@ def test_delete_no_room(tutor_token):
     assert response.json()["detail"] == "Room not found"
 
 def test_delete_room(tutor_token):
-    mock_collection.insert_one({
+    mock_rooms.insert_one({
         "owner": "testtutor", 
         "name": "testroom", 
         "capacity": 2,
         "code": "ABCDEF"
     })
 
-    count = mock_collection.count_documents({"code": "ABCDEF"})
+    count = mock_rooms.count_documents({"code": "ABCDEF"})
     assert count == 1
 
     headers = {"Authorization": f"Bearer {tutor_token}"}
     response = client.delete("/delete-room/ABCDEF?testing=True", headers=headers)
     
     assert response.status_code == 200
-    count = mock_collection.count_documents({"code": "ABCDEF"})
+    count = mock_rooms.count_documents({"code": "ABCDEF"})
     assert count == 0
 
+def test_benchmark_covers_every_route():
+    import benchmark
+    assert benchmark.uncovered_routes(benchmark.scenarios(benchmark.VOLUMES)) == []
+
+def test_liveness():
+    response = client.get("/health/live")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ok"}
+
+def test_readiness_before_start_up(monkeypatch):
+    monkeypatch.setitem(main.startup_state, "ready", False)
+    response = client.get("/health/ready")
+    assert response.status_code == 503
+    assert response.json()["status"] == "starting"
+
+def test_readiness_after_start_up(monkeypatch):
+    monkeypatch.setattr(main, "startup_state", {"ready": False, "prewarmedRooms": 0, "error": None})
+    main.start_up()
+    # Start-up builds the unique indexes duplicate detection relies on
+    assert "username_room_unique" in main.get_user_data_collection(False).index_information()
+    assert "room_title_unique" in main.get_lecture_collection(False).index_information()
+
+    response = client.get("/health/ready")
+    assert response.status_code == 200
+    assert response.json()["status"] == "ready"
+    assert response.json()["mongo"]["pingMs"] >= 0
+    assert "inUse" in response.json()["mongo"]["pool"]
+
+def test_start_up_retries_until_mongo_answers(monkeypatch):
+    monkeypatch.setattr(main, "startup_state", {"ready": False, "prewarmedRooms": 0, "error": None})
+    monkeypatch.setattr(main, "STARTUP_RETRY_DELAY", 0.01)
+    pings = []
+    def ping():
+        pings.append(1)
+        if len(pings) < 3:
+            raise ConnectionError("Mongo is not up yet")
+        return 1.0
+    monkeypatch.setattr(main, "ping_database", ping)
+
+    main.start_up(threading.Event())
+
+    assert len(pings) == 3
+    assert main.startup_state["ready"]
+    assert main.startup_state["error"] is None
+
+def test_start_up_stops_on_shutdown(monkeypatch):
+    monkeypatch.setattr(main, "startup_state", {"ready": False, "prewarmedRooms": 0, "error": None})
+    def ping():
+        raise ConnectionError("Mongo is down")
+    monkeypatch.setattr(main, "ping_database", ping)
+    stop = threading.Event()
+    stop.set()
+
+    main.start_up(stop)
+
+    assert not main.startup_state["ready"]
+    assert main.startup_state["error"] == "Mongo is down"
+
+def test_metrics(auth_token):
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    client.get("/room/ABCDEF?testing=True", headers=headers)
+    room_cache.get((True, "ABCDEF"))
+    hash_password("password123")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'http_requests_total{method="GET",route="/room/{code}",status="' in body
+    assert 'http_request_duration_seconds_count{method="GET",route="/room/{code}"}' in body
+    assert 'bcrypt_duration_seconds_count{operation="hash"}' in body
+    assert 'cache_misses_total{cache="room"}' in body
+    assert "# TYPE cache_hits_total counter" in body
+
+def test_metrics_unmatched_route():
+    client.get("/no-such-route")
+    assert 'route="unmatched",status="404"' in client.get("/metrics").text
+
+def test_mongo_command_timings():
+    from types import SimpleNamespace
+    from monitoring import command_timings, mongo_command_duration
+    before = mongo_command_duration.count(command="find", collection="lectures", outcome="success")
+    command_timings.started(SimpleNamespace(command={"find": "lectures", "filter": {}}, command_name="find", connection_id=("localhost", 27017), request_id=1))
+    command_timings.succeeded(SimpleNamespace(command_name="find", connection_id=("localhost", 27017), request_id=1, duration_micros=1500))
+    assert mongo_command_duration.count(command="find", collection="lectures", outcome="success") == before + 1
+
+def slow_find(log, request_id, duration_micros, filter):
+    from types import SimpleNamespace
+    connection = ("localhost", 27017)
+    log.started(SimpleNamespace(command_name="find", command={"find": "lectures", "filter": filter, "$db": "test_db"}, database_name="test_db", connection_id=connection, request_id=request_id))
+    log.succeeded(SimpleNamespace(command_name="find", reply={"cursor": {"firstBatch": [{}, {}]}}, connection_id=connection, request_id=request_id, duration_micros=duration_micros))
+
+def test_slow_query_log_redacts_and_groups_shapes():
+    from slow_queries import SlowQueryLog
+    log = SlowQueryLog(threshold_ms=50)
+    slow_find(log, 1, 10_000, {"room": "ABCDEF", "difficulty": "easy"})
+    slow_find(log, 2, 80_000, {"room": "ABCDEF", "difficulty": "easy"})
+    slow_find(log, 3, 120_000, {"room": "GHIJKL", "difficulty": "advanced"})
+    slow_find(log, 4, 60_000, {"$or": [{"room": "ABCDEF"}, {"members": {"$gte": 3}}]})
+
+    queries = log.top()
+    assert len(queries) == 2
+    assert queries[0]["shape"] == {"filter": {"room": "?", "difficulty": "?"}}
+    assert (queries[0]["count"], queries[0]["maxMs"], queries[0]["lastDocsReturned"]) == (2, 120.0, 2)
+    assert queries[0]["routes"] == {"background": 2}
+    assert queries[1]["shape"] == {"filter": {"$or": [{"room": "?"}, {"members": {"$gte": "?"}}]}}
+    assert "ABCDEF" not in str(queries)
+
+def test_slow_query_log_explains_first_occurrence():
+    from slow_queries import SlowQueryLog
+    explained = []
+
+    class FakeDatabase:
+        def command(self, command):
+            explained.append(command)
+            return {"queryPlanner": {"winningPlan": {"stage": "COLLSCAN", "filter": {"room": {"$eq": "ABCDEF"}}}, "rejectedPlans": []}}
+
+    log = SlowQueryLog(threshold_ms=50, explain=True)
+    log.explain_client = {"test_db": FakeDatabase()}
+    slow_find(log, 1, 80_000, {"room": "ABCDEF"})
+    slow_find(log, 2, 80_000, {"room": "GHIJKL"})
+
+    deadline = time.time() + 2
+    while log.top()[0]["explain"] == "pending" and time.time() < deadline:
+        time.sleep(0.01)
+    assert log.top()[0]["explain"] == {"winningPlan": {"stage": "COLLSCAN"}, "collectionScan": True, "rejectedPlans": 0}
+    assert explained == [{"explain": {"find": "lectures", "filter": {"room": "ABCDEF"}}, "verbosity": "queryPlanner"}]
+
+def test_slow_queries_endpoint(tutor_token, monkeypatch):
+    headers = {"Authorization": f"Bearer {tutor_token}"}
+    assert client.get("/admin/slow-queries", headers=headers).status_code == 403
+
+    monkeypatch.setattr(utils, "ADMIN_USERNAMES", {"testtutor"})
+    monkeypatch.setattr(main, "slow_query_log", main.slow_query_log.__class__(threshold_ms=50))
+    slow_find(main.slow_query_log, 1, 80_000, {"room": "ABCDEF"})
+    response = client.get("/admin/slow-queries?sort=maxMs", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["thresholdMs"] == 50
+    assert response.json()["queries"][0]["collection"] == "lectures"
+
+def test_profile_request_with_admin_header(tutor_token, monkeypatch):
+    monkeypatch.setattr(utils, "ADMIN_USERNAMES", {"testtutor"})
+    main.profile_store.clear()
+    headers = {"Authorization": f"Bearer {tutor_token}", "X-Profile": "1"}
+    response = client.get("/rooms/testtutor?testing=True", headers=headers)
+    assert response.status_code == 200
+    profile_id = response.headers["X-Profile-Id"]
+
+    headers = {"Authorization": f"Bearer {tutor_token}"}
+    profile = client.get(f"/admin/profiles/{profile_id}", headers=headers).json()
+    assert (profile["route"], profile["status"]) == ("/rooms/{owner}", 200)
+    assert profile["samples"] >= 1
+    assert profile["callTree"]["samples"] == sum(child["samples"] for child in profile["callTree"]["children"])
+    assert [summary["id"] for summary in client.get("/admin/profiles?route=/rooms/{owner}", headers=headers).json()["profiles"]] == [profile_id]
+
+    folded = client.get(f"/admin/profiles/{profile_id}?format=folded", headers=headers)
+    assert folded.headers["content-type"].startswith("text/plain")
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in folded.text.splitlines())
+
+def test_profile_header_requires_admin(tutor_token, auth_token):
+    for token in (tutor_token, auth_token):
+        response = client.get("/rooms/testtutor?testing=True", headers={"Authorization": f"Bearer {token}", "X-Profile": "1"})
+        assert "X-Profile-Id" not in response.headers
+    assert client.get("/admin/profiles", headers={"Authorization": f"Bearer {tutor_token}"}).status_code == 403
+
+def test_profile_sample_rate(monkeypatch):
+    monkeypatch.setattr(main, "PROFILE_SAMPLE_RATE", 1.0)
+    assert "X-Profile-Id" in client.get("/health/live").headers
+
+def test_profile_call_tree():
+    from profiling import call_tree, top_functions
+    folded = {"worker;main;verify_token;decode": 3, "worker;main;find_one": 5, "loop;serialize": 2}
+    tree = call_tree(folded)
+    assert tree["samples"] == 10
+    assert [(child["name"], child["samples"]) for child in tree["children"]] == [("worker", 8), ("loop", 2)]
+    assert top_functions(folded)[0] == {"function": "find_one", "self": 5, "total": 5}
+    assert {"function": "main", "self": 0, "total": 8} in top_functions(folded)
+
+@pytest.mark.asyncio
+async def test_priority_class_queues_and_hands_over_slots():
+    import asyncio
+    from admission import PriorityClass
+    priority = PriorityClass("heavy", limit=1, max_queue=1, queue_timeout=1)
+    classes = {"heavy": priority}
+
+    assert await priority.acquire(classes) is None
+    waiting = asyncio.ensure_future(priority.acquire(classes))
+    await asyncio.sleep(0)
+    assert priority.queue_depth == 1
+    assert await priority.acquire(classes) == "queue_full"
+
+    priority.release()
+    assert await waiting is None
+    assert (priority.in_flight, priority.queue_depth) == (1, 0)
+    priority.release()
+    assert priority.in_flight == 0
+    assert priority.rejections == {"queue_full": 1}
+
+@pytest.mark.asyncio
+async def test_priority_class_timeout_and_shedding():
+    from admission import PriorityClass
+    interactive = PriorityClass("interactive", limit=0, max_queue=5, queue_timeout=0.01)
+    heavy = PriorityClass("heavy", limit=5, shed_when_waiting="interactive")
+    classes = {"interactive": interactive, "heavy": heavy}
+
+    assert await heavy.acquire(classes) is None
+    assert await interactive.acquire(classes) == "timeout"
+    assert interactive.queue_depth == 0
+
+    interactive._waiters.append(object())
+    assert await heavy.acquire(classes) == "shed"
+    assert heavy.rejections == {"shed": 1}
+
+def test_admission_rejects_with_retry_after(auth_token, monkeypatch):
+    from admission import PriorityClass
+    monkeypatch.setitem(main.priority_classes, "heavy", PriorityClass("heavy", limit=0, max_queue=0, retry_after=5))
+    headers = {"Authorization": f"Bearer {auth_token}"}
+
+    response = client.post("/execute-code", json={"code": "print(1)"}, headers=headers)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+    assert client.get("/room/ABCDEF?testing=True", headers=headers).status_code != 503
+
+    metrics = client.get("/metrics").text
+    assert 'admission_rejections_total{priority="heavy",reason="queue_full"} 1' in metrics
+    assert 'http_requests_total{method="POST",route="/execute-code",status="503"}' in metrics
+    assert 'admission_in_flight{priority="interactive"} 0' in metrics
+
+def test_admission_holds_slot_while_streaming(auth_token, monkeypatch):
+    mock_user_files.insert_one({"owner": "testuser", "content": "x = 123", "name": "file1", "purpose": "playground", "room": "ABCDEF"})
+    seen = []
+    def stream(chunk_collection, file):
+        yield b"x = "
+        # The first chunk has been sent, the endpoint and the middlewares' call_next have returned
+        seen.append((main.priority_classes["heavy"].in_flight, main.requests_in_flight))
+        yield b"123"
+    monkeypatch.setattr(main, "iter_file_content", stream)
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.get("/download-file/ABCDEF/testuser", params={"testing": "True", "name": "file1", "purpose": "playground"}, headers=headers)
+
+    assert response.text == "x = 123"
+    assert seen == [(1, 1)]
+    assert main.priority_classes["heavy"].in_flight == 0
+    assert main.requests_in_flight == 0
+
+def test_single_flight_shares_concurrent_calls():
+    from fastapi import HTTPException
+    from single_flight import single_flight
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    @single_flight("room")
+    def load(room, user):
+        calls.append((room, user))
+        started.set()
+        release.wait(2)
+        if room == "MISSING":
+            raise HTTPException(status_code=404, detail="No lectures found")
+        return {"room": room}
+
+    results = []
+    first = threading.Thread(target=lambda: results.append(load("ABCDEF", "ana")))
+    first.start()
+    started.wait(2)
+    others = [threading.Thread(target=lambda user=user: results.append(load("ABCDEF", user))) for user in ("bob", "cid")]
+    for thread in others:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in [first] + others:
+        thread.join()
+
+    assert calls == [("ABCDEF", "ana")]
+    assert results == [{"room": "ABCDEF"}] * 3
+    assert results[0] is results[1]
+
+    load("ABCDEF", "dan")
+    assert len(calls) == 2
+    with pytest.raises(HTTPException):
+        load("MISSING", "ana")
+
+def test_single_flight_unknown_parameter():
+    from single_flight import single_flight
+    with pytest.raises(TypeError):
+        single_flight("difficulty")(lambda room: room)
+
+def test_prewarm_caches():
+    mock_rooms.insert_one({"owner": "testtutor", "name": "big", "capacity": 10, "code": "ABCDEF", "members": 5, "timezone": "Europe/Bucharest"})
+    mock_rooms.insert_one({"owner": "testtutor", "name": "small", "capacity": 10, "code": "GHIJKL", "members": 1})
+    today = local_today("Europe/Bucharest")
+    mock_puzzles.insert_one({"date": today, "room": "ABCDEF", "name": "Puzzle", "description": "Solve it", "tests": []})
+
+    assert main.prewarm_caches(True) == 2
+    assert room_cache.get((True, "ABCDEF"))["name"] == "big"
+    assert daily_puzzle_cache.get((True, "ABCDEF", today))["name"] == "Puzzle"
+    assert daily_puzzle_cache.get((True, "GHIJKL", local_today("UTC"))) is None
+
+def test_delete_room_cleans_up_content(tutor_token, monkeypatch):
+    monkeypatch.setattr(cleanup, "ROOM_CLEANUP_BATCH_SIZE", 2)
+    monkeypatch.setattr(cleanup, "ROOM_CLEANUP_PAUSE", 0)
+
+    mock_rooms.insert_one({"owner": "testtutor", "name": "testroom", "capacity": 2, "code": "ABCDEF"})
+    mock_user_data.insert_many([{"username": f"user{n}", "room": "ABCDEF"} for n in range(3)])
+    mock_user_files.insert_one({"owner": "user0", "name": "main.py", "room": "ABCDEF", "chunk_version": "v1"})
+    mock_file_chunks.insert_many([{"version": "v1", "n": n, "data": b"x"} for n in range(2)])
+    mock_lectures.insert_one({"title": "Lecture", "room": "ABCDEF"})
+    mock_content_ids.insert_one({"_id": "counter:ABCDEF:lectures", "next": 1})
+    mock_user_data.insert_one({"username": "other", "room": "OTHER1"})
+
+    headers = {"Authorization": f"Bearer {tutor_token}"}
+    response = client.delete("/delete-room/ABCDEF?testing=True", headers=headers)
+    assert response.status_code == 200
+
+    assert mock_user_data.count_documents({"room": "ABCDEF"}) == 0
+    assert mock_file_chunks.count_documents({"version": "v1"}) == 0
+    assert mock_content_ids.count_documents({"_id": "counter:ABCDEF:lectures"}) == 0
+    assert mock_user_data.count_documents({"room": "OTHER1"}) == 1
+
+    response = client.get("/room-cleanup/ABCDEF?testing=True", headers=headers)
+    assert response.status_code == 200
+    job = response.json()
+    assert job["status"] == "done"
+    assert job["target_room"] == "ABCDEF"
+    assert job["deleted"] == {"user_files": 1, "user_data": 3, "lectures": 1, "guided_projects": 0, "daily_puzzles": 0, "content_ids": 1}
+
+def test_room_cleanup_resumes(tutor_token):
+    jobs = main.get_room_cleanup_collection(True)
+    cleanup.create_room_cleanup_job(jobs, "ABCDEF", "testtutor")
+    # A crashed worker left an expired lease behind
+    jobs.update_one({"_id": cleanup.room_cleanup_job_id("ABCDEF")}, {"$set": {"status": "running", "lease_until": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+    mock_user_data.insert_many([{"username": f"user{n}", "room": "ABCDEF"} for n in range(3)])
+
+    # Already stopped, so a single sweep runs
+    stop = threading.Event()
+    stop.set()
+    cleanup.resume_room_cleanups(jobs, main.get_room_scoped_collections(True), stop)
+
+    assert mock_user_data.count_documents({"room": "ABCDEF"}) == 0
+    assert cleanup.get_room_cleanup_job(jobs, "ABCDEF")["status"] == "done"
+    assert not cleanup.room_cleanup_pending(jobs, "ABCDEF")
+
+def test_room_cleanup_sweeper_keeps_running(monkeypatch):
+    monkeypatch.setattr(cleanup, "ROOM_CLEANUP_SWEEP_INTERVAL", 0.01)
+    jobs = main.get_room_cleanup_collection(True)
+    stop = threading.Event()
+    sweeper = threading.Thread(target=cleanup.resume_room_cleanups, args=(jobs, main.get_room_scoped_collections(True), stop))
+    sweeper.start()
+
+    # A job that failed after start-up, with nothing pending when the sweeper started
+    mock_user_data.insert_many([{"username": f"user{n}", "room": "ABCDEF"} for n in range(3)])
+    cleanup.create_room_cleanup_job(jobs, "ABCDEF", "testtutor")
+    deadline = time.time() + 5
+    while cleanup.room_cleanup_pending(jobs, "ABCDEF") and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert sweeper.is_alive()
+    stop.set()
+    sweeper.join()
+    assert cleanup.get_room_cleanup_job(jobs, "ABCDEF")["status"] == "done"
+    assert mock_user_data.count_documents({"room": "ABCDEF"}) == 0
+
+def test_room_code_reserved_after_cleanup():
+    jobs = main.get_room_cleanup_collection(True)
+    cleanup.create_room_cleanup_job(jobs, "ABCDEF", "testtutor")
+    assert cleanup.room_code_reserved(jobs, "ABCDEF")
+
+    # Other instances may still cache the old room's content ids until ROOM_CACHE_TTL has passed
+    jobs.update_one({"_id": cleanup.room_cleanup_job_id("ABCDEF")}, {"$set": {"status": "done", "finished_at": datetime.now(timezone.utc)}})
+    assert cleanup.room_code_reserved(jobs, "ABCDEF")
+
+    jobs.update_one({"_id": cleanup.room_cleanup_job_id("ABCDEF")}, {"$set": {"finished_at": datetime.now(timezone.utc) - timedelta(days=1)}})
+    assert not cleanup.room_code_reserved(jobs, "ABCDEF")
+
+def test_room_cleanup_not_found(tutor_token):
+    headers = {"Authorization": f"Bearer {tutor_token}"}
+    response = client.get("/room-cleanup/ABCDEF?testing=True", headers=headers)
+    assert response.status_code == 404
+
 def test_leaderboard_empty(auth_token):
     headers = {"Authorization": f"Bearer {auth_token}"}
     response = client.get("/leaderboard/ABCDEF?testing=True", headers=headers)
@@ -929,7 +2187,7 @@ def test_leaderboard_empty(auth_token):
     assert response.json() == {"leaderboard": []}
 
 def test_leaderboard_success(auth_token):
-    mock_collection.insert_one({
+    mock_user_data.insert_one({
         "username": "testuser1",
         "completions": {
             "lectures": ["Lecture 1"],
@@ -939,7 +2197,7 @@ def test_leaderboard_success(auth_token):
         "room": "ABCDEF",
         "level": "easy"
     })
-    mock_collection.insert_one({
+    mock_user_data.insert_one({
         "username": "testuser2",
         "completions": {
             "lectures": ["Lecture 1"],
@@ -959,8 +2217,41 @@ def test_leaderboard_success(auth_token):
     assert leaderboard[0]["username"] == "testuser1"
     assert leaderboard[1]["username"] == "testuser2"
 
+def test_leaderboard_completion_bits(auth_token):
+    register_test_content(lectures=["Lecture 1"], puzzles=["2025-03-12"])
+    mock_user_data.insert_one({
+        "username": "testuser1",
+        "completions": {
+            "lectures": ["Lecture 1"],
+            "projects": [],
+            "puzzles": []
+        },
+        "room": "ABCDEF",
+        "level": "easy"
+    })
+    mock_user_data.insert_one({
+        "username": "testuser2",
+        "completions": {
+            "lectures": [],
+            "projects": [],
+            "puzzles": ["2025-03-12"]
+        },
+        "room": "ABCDEF",
+        "level": "easy"
+    })
+    migrate_completions_to_bits(mock_user_data, mock_content_ids)
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.get("/leaderboard/ABCDEF?testing=True", headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["leaderboard"] == [
+        {"username": "testuser2", "score": 20},
+        {"username": "testuser1", "score": 5}
+    ]
+
 def test_create_challenge_success(tutor_token):
-    mock_collection.insert_one({
+    mock_rooms.insert_one({
         "owner": "testtutor",
         "name": "testroom",
         "capacity": 10,
@@ -980,11 +2271,11 @@ def test_create_challenge_success(tutor_token):
     assert response.status_code == 200
     assert response.json()["message"] == "Challenge created successfully!"
 
-    count = mock_collection.count_documents({"name": "Test Challenge", "room": "ABCDEF"})
+    count = mock_puzzles.count_documents({"name": "Test Challenge", "room": "ABCDEF"})
     assert count == 1
 
 def test_create_challenge_invalid_date(tutor_token):
-    mock_collection.insert_one({
+    mock_rooms.insert_one({
         "owner": "testtutor",
         "name": "testroom",
         "capacity": 10,
@@ -1005,13 +2296,13 @@ def test_create_challenge_invalid_date(tutor_token):
     assert response.json()["detail"] == "Invalid date format. Use YYYY-MM-DD."
 
 def test_create_challenge_existing(tutor_token):
-    mock_collection.insert_one({
+    mock_rooms.insert_one({
         "owner": "testtutor",
         "name": "testroom",
         "capacity": 10,
         "code": "ABCDEF"
     })
-    mock_collection.insert_one({
+    mock_puzzles.insert_one({
         "name": "Existing Challenge",
         "description": "This is an existing challenge",
         "room": "ABCDEF",
@@ -1034,7 +2325,7 @@ def test_create_challenge_existing(tutor_token):
     assert response.json()["detail"] == "Challenge for this date already exists"
 
 def test_create_lecture_success(tutor_token):
-    mock_collection.insert_one({
+    mock_rooms.insert_one({
         "owner": "testtutor",
         "name": "testroom",
         "capacity": 10,
@@ -1057,17 +2348,18 @@ def test_create_lecture_success(tutor_token):
     assert response.status_code == 200
     assert response.json()["message"] == "Lecture created successfully!"
 
-    count = mock_collection.count_documents({"title": "Test Lecture", "room": "ABCDEF"})
+    count = mock_lectures.count_documents({"title": "Test Lecture", "room": "ABCDEF"})
     assert count == 1
+    assert list(get_content_ids(mock_content_ids, "ABCDEF", "lectures", ["Test Lecture"])) == ["Test Lecture"]
 
 def test_create_lecture_existing(tutor_token):
-    mock_collection.insert_one({
+    mock_rooms.insert_one({
         "owner": "testtutor",
         "name": "testroom",
         "capacity": 10,
         "code": "ABCDEF"
     })
-    mock_collection.insert_one({
+    mock_lectures.insert_one({
         "title": "Existing Lecture",
         "room": "ABCDEF",
         "difficulty": "easy",
@@ -1094,7 +2386,7 @@ def test_create_lecture_existing(tutor_token):
     assert response.json()["detail"] == "Lecture with this title already exists in the room"
 
 def test_create_project_success(tutor_token):
-    mock_collection.insert_one({
+    mock_rooms.insert_one({
         "owner": "testtutor",
         "name": "testroom",
         "capacity": 10,
@@ -1124,17 +2416,17 @@ def test_create_project_success(tutor_token):
     assert response.status_code == 200
     assert response.json()["message"] == "Project created successfully!"
 
-    count = mock_collection.count_documents({"name": "Test Project", "room": "ABCDEF"})
+    count = mock_projects.count_documents({"name": "Test Project", "room": "ABCDEF"})
     assert count == 1
 
 def test_create_project_existing(tutor_token):
-    mock_collection.insert_one({
+    mock_rooms.insert_one({
         "owner": "testtutor",
         "name": "testroom",
         "capacity": 10,
         "code": "ABCDEF"
     })
-    mock_collection.insert_one({
+    mock_projects.insert_one({
         "name": "Existing Project",
         "room": "ABCDEF",
         "description": "This is an existing project",
@@ -1177,7 +2469,7 @@ def test_create_project_existing(tutor_token):
     assert response.json()["detail"] == "Project with this name already exists in the room"
 
 def test_create_project_invalid_code(tutor_token):
-    mock_collection.insert_one({
+    mock_rooms.insert_one({
         "owner": "testtutor",
         "name": "testroom",
         "capacity": 10,
@@ -1207,8 +2499,127 @@ def test_create_project_invalid_code(tutor_token):
     assert response.status_code == 400
     assert response.json()["detail"] == "Each step's code must contain exactly one '____' as placeholder."
     
+def test_import_content(tutor_token):
+    mock_rooms.insert_one({
+        "owner": "testtutor",
+        "name": "testroom",
+        "capacity": 10,
+        "code": "ABCDEF"
+    })
+    lecture = LectureData(
+        difficulty="easy",
+        title="Imported Lecture",
+        slides=[SlideData(name="Slide 1", content="Content")],
+        quiz=[QuizData(question="Q", answer="A", options=["A", "B"])],
+        required=[],
+        passmark=1,
+        room="ABCDEF"
+    )
+    project = GuidedProjectData(
+        name="Imported Project",
+        description="Has no placeholder",
+        room="ABCDEF",
+        difficulty="easy",
+        steps=[
+            StepData(
+                title="Step 1",
+                description="Description for step 1",
+                code="print()",
+                options=["print('Hello World')"],
+                answer="print('Hello World')",
+                hint="Hint for step 1"
+            )
+        ],
+        solution="print('Hello World')"
+    )
+    pack = ContentPack(
+        room="ABCDEF",
+        lectures=[lecture, lecture, lecture.model_copy(update={"title": "Other Room", "room": "OTHER1"})],
+        projects=[project],
+        challenges=[
+            ChallengeData(date="2025-01-01", name="Puzzle", description="Solve it", room="ABCDEF", tests=["assert True"]),
+            ChallengeData(date="2025-13-01", name="Puzzle", description="Solve it", room="ABCDEF", tests=["assert True"])
+        ]
+    )
+
+    headers = {"Authorization": f"Bearer {tutor_token}"}
+    response = client.post("/import-content", json=pack.model_dump(), params={"testing": "True"}, headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["message"] == "Imported 2 of 6 items"
+    assert [(result["type"], result["status"]) for result in response.json()["results"]] == [
+        ("lecture", "created"),
+        ("lecture", "duplicate"),
+        ("lecture", "invalid"),
+        ("project", "invalid"),
+        ("challenge", "created"),
+        ("challenge", "invalid")
+    ]
+    assert mock_lectures.count_documents({"title": "Imported Lecture", "room": "ABCDEF"}) == 1
+    assert mock_puzzles.count_documents({"date": "2025-01-01", "room": "ABCDEF"}) == 1
+    assert mock_projects.count_documents({"name": "Imported Project"}) == 0
+    assert mock_content_ids.count_documents({"room": "ABCDEF"}) == 2
+    assert list(get_content_ids(mock_content_ids, "ABCDEF", "puzzles", ["2025-01-01", "2025-13-01"])) == ["2025-01-01"]
+
+def test_import_content_existing(tutor_token):
+    mock_rooms.insert_one({
+        "owner": "testtutor",
+        "name": "testroom",
+        "capacity": 10,
+        "code": "ABCDEF"
+    })
+    mock_lectures.insert_one({"title": "Existing Lecture", "room": "ABCDEF"})
+
+    lectures = [
+        LectureData(
+            difficulty="easy",
+            title=title,
+            slides=[],
+            quiz=[],
+            required=[],
+            passmark=0,
+            room="ABCDEF"
+        )
+        for title in ["Existing Lecture", "New Lecture"]
+    ]
+
+    headers = {"Authorization": f"Bearer {tutor_token}"}
+    response = client.post("/import-content", json=ContentPack(room="ABCDEF", lectures=lectures).model_dump(), params={"testing": "True"}, headers=headers)
+
+    # The import builds the unique indexes it relies on
+    assert response.status_code == 200
+    assert response.json()["message"] == "Imported 1 of 2 items"
+    assert [result["status"] for result in response.json()["results"]] == ["duplicate", "created"]
+    assert mock_lectures.count_documents({"title": "New Lecture"}) == 1
+    assert "room_title_unique" in mock_lectures.index_information()
+
+def test_import_content_with_duplicates(tutor_token):
+    mock_rooms.insert_one({"owner": "testtutor", "name": "testroom", "capacity": 10, "code": "ABCDEF"})
+    mock_lectures.insert_many([{"title": "Twice", "room": "ABCDEF"}, {"title": "Twice", "room": "ABCDEF"}])
+    lecture = LectureData(difficulty="easy", title="Twice", slides=[], quiz=[], required=[], passmark=0, room="ABCDEF")
+
+    headers = {"Authorization": f"Bearer {tutor_token}"}
+    response = client.post("/import-content", json=ContentPack(room="ABCDEF", lectures=[lecture]).model_dump(), params={"testing": "True"}, headers=headers)
+
+    assert response.status_code == 409
+    assert mock_lectures.count_documents({"title": "Twice"}) == 2
+
+def test_import_content_forbidden(tutor_token):
+    mock_rooms.insert_one({
+        "owner": "othertutor",
+        "name": "testroom",
+        "capacity": 10,
+        "code": "ABCDEF"
+    })
+
+    headers = {"Authorization": f"Bearer {tutor_token}"}
+    response = client.post("/import-content", json=ContentPack(room="ABCDEF").model_dump(), params={"testing": "True"}, headers=headers)
+
+    assert response.status_code == 403
+
 def test_get_inventory_success(auth_token):
-    mock_collection.insert_one({
+    register_test_content(projects=["Project 1", "Project 2"])
+    mock_user_data.insert_one({
         "username": "testuser",
         "room": "ABCDEF",
         "completions": {
@@ -1217,7 +2628,7 @@ def test_get_inventory_success(auth_token):
             "puzzles": []
         }
     })
-    mock_collection.insert_one({
+    mock_projects.insert_one({
         "name": "Project 1",
         "description": "Desc 1",
         "difficulty": "easy",
@@ -1225,7 +2636,7 @@ def test_get_inventory_success(auth_token):
         "solution": "print(1)",
         "room": "ABCDEF"
     })
-    mock_collection.insert_one({
+    mock_projects.insert_one({
         "name": "Project 2",
         "description": "Desc 2",
         "difficulty": "easy",
@@ -1249,7 +2660,7 @@ def test_get_inventory_no_user_data(auth_token):
     assert response.status_code == 404
 
 def test_get_inventory_no_projects(auth_token):
-    mock_collection.insert_one({
+    mock_user_data.insert_one({
         "username": "testuser",
         "room": "ABCDEF",
         "completions": {
@@ -1267,7 +2678,7 @@ def test_get_inventory_no_projects(auth_token):
     assert len(inventory) == 0
 
 def test_get_inventory_project_not_found(auth_token):
-    mock_collection.insert_one({
+    mock_user_data.insert_one({
         "username": "testuser",
         "room": "ABCDEF",
         "completions": {
@@ -1282,3 +2693,81 @@ def test_get_inventory_project_not_found(auth_token):
     inventory = response.json()["items"]
 
     assert len(inventory) == 0
+
+def test_bootstrap_selected_fields(auth_token):
+    register_test_content(lectures=["Intro 1"])
+    mock_user_data.insert_one({
+        "username": "testuser",
+        "completions": {
+            "lectures": ["Intro 1"],
+            "projects": [],
+            "puzzles": []
+        },
+        "room": "ABCDEF",
+        "level": "easy"
+    })
+    mock_puzzles.insert_one({
+        "date": "2024-03-05",
+        "name": "Test Puzzle",
+        "description": "Solve this challenge",
+        "tests": ["add(2,5) == 7"],
+        "room": "ABCDEF"
+    })
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.get("/bootstrap/testuser/ABCDEF?testing=True&fields=userData,dailyPuzzle&date=2024-03-05", headers=headers)
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["errors"] == {}
+    assert data["userData"]["completions"]["lectures"] == ["Intro 1"]
+    assert data["dailyPuzzle"]["name"] == "Test Puzzle"
+    assert "lectures" not in data
+    assert "leaderboard" not in data
+
+def test_bootstrap_defaults_to_room_date(auth_token, monkeypatch):
+    import asyncio
+    on_event_loop = []
+    resolve = main.get_room_timezone
+    def get_room_timezone(room, testing):
+        try:
+            asyncio.get_running_loop()
+            on_event_loop.append(True)
+        except RuntimeError:
+            on_event_loop.append(False)
+        return resolve(room, testing)
+    monkeypatch.setattr(main, "get_room_timezone", get_room_timezone)
+    mock_rooms.insert_one({"owner": "testtutor", "name": "testroom", "capacity": 10, "code": "ABCDEF", "timezone": "Pacific/Kiritimati"})
+    mock_puzzles.insert_one({
+        "date": local_today("Pacific/Kiritimati"),
+        "name": "Today's Puzzle",
+        "description": "Solve this challenge",
+        "tests": ["add(2,5) == 7"],
+        "room": "ABCDEF"
+    })
+
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.get("/bootstrap/testuser/ABCDEF?testing=True&fields=dailyPuzzle", headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["dailyPuzzle"]["name"] == "Today's Puzzle"
+    # The room lookup may hit the database, it must not run on the event loop
+    assert on_event_loop and not any(on_event_loop)
+
+def test_bootstrap_reports_missing_sections(auth_token):
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.get("/bootstrap/testuser/ABCDEF?testing=True&fields=lectures,guidedProjects,leaderboard", headers=headers)
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["lectures"] is None
+    assert data["errors"]["lectures"] == {"status": 404, "detail": "No lectures found for the given difficulty."}
+    assert data["errors"]["guidedProjects"]["status"] == 404
+    assert data["leaderboard"] == []
+
+def test_bootstrap_unknown_field(auth_token):
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    response = client.get("/bootstrap/testuser/ABCDEF?testing=True&fields=userData,friends", headers=headers)
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Unknown bootstrap fields: friends"
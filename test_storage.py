@@ -0,0 +1,113 @@
+import pytest
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from memory_storage import MemoryCollection
+from storage import MemoryStorage, create_storage
+
+@pytest.fixture
+def collection():
+    return MemoryCollection("test")
+
+def test_find_operators(collection):
+    collection.insert_many([
+        {"username": "ana", "room": "ABCDEF", "level": "easy", "score": 5},
+        {"username": "bob", "room": "ABCDEF", "level": "advanced", "score": 20},
+        {"username": "cid", "room": "OTHER1", "score": None}
+    ])
+
+    assert [user["username"] for user in collection.find({"room": "ABCDEF", "score": {"$gte": 10}})] == ["bob"]
+    assert collection.count_documents({"username": {"$in": ["ana", "cid"]}}) == 2
+    assert collection.count_documents({"score": {"$lt": 100}}) == 2
+    assert collection.count_documents({"level": {"$exists": False}}) == 1
+    assert collection.count_documents({"$or": [{"level": "easy"}, {"room": "OTHER1"}]}) == 2
+    assert collection.count_documents({"username": {"$regex": "^b"}}) == 1
+    assert collection.count_documents({"score": None}) == 1
+    assert collection.find_one({"username": "ana"}, {"_id": 0, "level": 1}) == {"level": "easy"}
+    assert [user["username"] for user in collection.find({}, {"username": 1}).sort("score", -1).limit(2)] == ["bob", "ana"]
+
+def test_update_operators_and_upsert(collection):
+    collection.insert_one({"username": "ana", "room": "ABCDEF", "completions": {"lectures": []}})
+
+    result = collection.update_one({"username": "ana"}, {"$addToSet": {"completions.lectures": "Intro"}, "$set": {"level": "easy"}})
+    assert result.modified_count == 1
+    assert collection.update_one({"username": "ana"}, {"$addToSet": {"completions.lectures": "Intro"}}).modified_count == 0
+
+    collection.update_one({"username": "ana"}, {"$unset": {"level": ""}, "$inc": {"members": 2}})
+    user = collection.find_one({"username": "ana"}, {"_id": 0})
+    assert user == {"username": "ana", "room": "ABCDEF", "completions": {"lectures": ["Intro"]}, "members": 2}
+
+    result = collection.update_one({"username": "bob", "room": "ABCDEF"}, {"$setOnInsert": {"level": "easy"}}, upsert=True)
+    assert result.upserted_id is not None
+    assert collection.find_one({"username": "bob"}, {"_id": 0}) == {"username": "bob", "room": "ABCDEF", "level": "easy"}
+
+    counter = collection.find_one_and_update({"_id": "counter"}, {"$inc": {"next": 3}}, upsert=True, return_document=ReturnDocument.AFTER)
+    assert counter == {"_id": "counter", "next": 3}
+
+def test_returned_documents_are_copies(collection):
+    collection.insert_one({"username": "ana", "tags": ["a"]})
+    collection.find_one({"username": "ana"})["tags"].append("b")
+    assert collection.find_one({"username": "ana"})["tags"] == ["a"]
+
+def test_unique_index(collection):
+    collection.create_index([("username", 1), ("room", 1)], unique=True, name="username_room_unique")
+    collection.insert_one({"username": "ana", "room": "ABCDEF"})
+
+    with pytest.raises(DuplicateKeyError):
+        collection.insert_one({"username": "ana", "room": "ABCDEF"})
+
+    with pytest.raises(BulkWriteError) as error:
+        collection.insert_many([{"username": "ana", "room": "ABCDEF"}, {"username": "bob", "room": "ABCDEF"}], ordered=False)
+    assert [(write_error["index"], write_error["code"]) for write_error in error.value.details["writeErrors"]] == [(0, 11000)]
+    assert collection.count_documents({}) == 2
+
+    collection.drop_index("username_room_unique")
+    collection.insert_one({"username": "ana", "room": "ABCDEF"})
+
+def test_unique_index_rejects_existing_duplicates(collection):
+    collection.insert_many([{"date": "2025-01-01", "room": "ABCDEF"}, {"date": "2025-01-01", "room": "ABCDEF"}])
+    with pytest.raises(DuplicateKeyError):
+        collection.create_index([("room", 1), ("date", 1)], unique=True)
+
+def test_bulk_write_upserts(collection):
+    result = collection.bulk_write([
+        UpdateOne({"owner": "ana", "name": "main.py"}, {"$set": {"content": "print(1)"}}, upsert=True),
+        UpdateOne({"owner": "ana", "name": "main.py"}, {"$set": {"content": "print(2)"}}, upsert=True)
+    ])
+    assert (result.upserted_count, result.modified_count) == (1, 1)
+    assert collection.find_one({"name": "main.py"})["content"] == "print(2)"
+
+def test_leaderboard_aggregation(collection):
+    collection.insert_many([
+        {"username": "ana", "room": "ABCDEF", "completion_counts": {"lectures": 1, "puzzles": 1, "projects": 0}},
+        {"username": "bob", "room": "ABCDEF", "completions": {"lectures": ["A", "B"], "puzzles": [], "projects": ["P"]}},
+        {"username": "cid", "room": "OTHER1", "completion_counts": {"lectures": 9, "puzzles": 9, "projects": 9}}
+    ])
+    score = {"$add": [
+        {"$multiply": [{"$ifNull": ["$completion_counts.lectures", {"$size": {"$ifNull": ["$completions.lectures", []]}}]}, 5]},
+        {"$multiply": [{"$ifNull": ["$completion_counts.puzzles", {"$size": {"$ifNull": ["$completions.puzzles", []]}}]}, 20]},
+        {"$multiply": [{"$ifNull": ["$completion_counts.projects", {"$size": {"$ifNull": ["$completions.projects", []]}}]}, 10]}
+    ]}
+    pipeline = [
+        {"$match": {"room": "ABCDEF", "username": {"$exists": True}}},
+        {"$project": {"_id": 0, "username": 1, "score": score}},
+        {"$sort": {"score": -1, "username": 1}},
+        {"$limit": 3}
+    ]
+    assert list(collection.aggregate(pipeline)) == [{"username": "ana", "score": 25}, {"username": "bob", "score": 20}]
+
+    grouped = collection.aggregate([
+        {"$group": {"_id": "$room", "members": {"$sum": 1}}},
+        {"$sort": {"_id": 1}}
+    ])
+    assert list(grouped) == [{"_id": "ABCDEF", "members": 2}, {"_id": "OTHER1", "members": 1}]
+
+def test_memory_storage_shares_collections():
+    storage = create_storage("memory", None, "test_db", {})
+    assert isinstance(storage, MemoryStorage)
+
+    storage.collection("lectures").insert_one({"title": "Intro"})
+    assert storage.collection("lectures", read_preference=None).count_documents({}) == 1
+    assert storage.collection("guided_projects").count_documents({}) == 0
+
+    with pytest.raises(ValueError):
+        create_storage("sqlite", None, "test_db", {})
@@ -91,4 +91,38 @@ def test_valid_date():
     assert verify_valid_date("2025-13-01") == False  # Invalid month
     assert verify_valid_date("2025-01-32") == False  # Invalid day
     assert verify_valid_date("2025-01-01") == True   # Valid date
-    assert verify_valid_date("") == False
\ No newline at end of file
+    assert verify_valid_date("") == False
+
+def test_valid_timezone():
+    assert verify_valid_timezone("UTC") == True
+    assert verify_valid_timezone("Europe/Bucharest") == True
+    assert verify_valid_timezone("Mars/Olympus") == False
+    assert verify_valid_timezone("") == False
+
+def test_utc_without_timezone_database(monkeypatch):
+    # Windows without tzdata has no IANA database at all
+    import utils
+    def missing(name):
+        raise ZoneInfoNotFoundError(name)
+    monkeypatch.setattr(utils, "ZoneInfo", missing)
+
+    assert verify_valid_timezone("UTC") == True
+    assert verify_valid_timezone("Europe/Bucharest") == False
+    assert local_today("UTC") == datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+def test_next_local_midnight():
+    midnight = datetime.fromtimestamp(next_local_midnight("Europe/Bucharest"), tz=ZoneInfo("Europe/Bucharest"))
+    assert (midnight.hour, midnight.minute, midnight.second) == (0, 0, 0)
+    assert midnight > datetime.now(timezone.utc)
+    assert midnight - datetime.now(timezone.utc) <= timedelta(days=1)
+
+def test_compress_content():
+    small = "x = 1"
+    assert compress_content(small) == (small, "identity")
+
+    large = "print('hello world')\n" * 200
+    compressed, encoding = compress_content(large)
+    assert encoding == "zlib"
+    assert len(compressed) < len(large)
+    assert decompress_content(compressed, encoding) == large
+    assert decompress_content(small) == small
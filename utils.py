@@ -3,22 +3,28 @@ import secrets
 import string
 import re
 import ast
+import hashlib
+import zlib
 from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from fastapi import Depends, HTTPException, status
 from fastapi_mail import FastMail, MessageSchema
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import jwt, JWTError
 from config import *
+from monitoring import bcrypt_duration
 
 bearer_scheme = HTTPBearer()
 
 def hash_password(password: str) -> str:
     salt = bcrypt.gensalt()
-    hashed_password = bcrypt.hashpw(password.encode("utf-8"), salt)
+    with bcrypt_duration.time(operation="hash"):
+        hashed_password = bcrypt.hashpw(password.encode("utf-8"), salt)
     return hashed_password.decode("utf-8")
 
 def verify_password(password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(password.encode("utf-8"), hashed_password.encode("utf-8"))
+    with bcrypt_duration.time(operation="verify"):
+        return bcrypt.checkpw(password.encode("utf-8"), hashed_password.encode("utf-8"))
 
 def generate_unique_token() -> str:
     while True:
@@ -42,7 +48,7 @@ async def send_verification_email(email: str, token: str, type: str):
         subtype="plain"
     )
 
-    fm = FastMail(conf)
+    fm = FastMail(get_mail_config())
     await fm.send_message(message)
 
 def is_safe_code(code: str) -> bool:
@@ -130,6 +136,18 @@ def verify_tutor_token(credentials: HTTPAuthorizationCredentials = Depends(beare
 
     return username
 
+def verify_admin_token(username: str = Depends(verify_tutor_token)) -> str:
+    if username not in ADMIN_USERNAMES:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return username
+
+def is_admin_token(token: str) -> bool:
+    try:
+        verify_admin_token(verify_tutor_token(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)))
+    except HTTPException:
+        return False
+    return True
+
 def get_next_level(current: str):
     order = ["easy", "intermediate", "advanced"]
     try:
@@ -143,4 +161,59 @@ def verify_valid_date(date_str: str) -> bool:
         datetime.strptime(date_str, "%Y-%m-%d")
         return True
     except ValueError:
-        return False
\ No newline at end of file
+        return False
+
+def get_tzinfo(timezone_name: str):
+    # UTC needs no IANA database, Windows only has one when tzdata is installed
+    if timezone_name == "UTC":
+        return timezone.utc
+    try:
+        return ZoneInfo(timezone_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+def verify_valid_timezone(timezone_name: str) -> bool:
+    return get_tzinfo(timezone_name) is not None
+
+def local_today(timezone_name: str) -> str:
+    tz = get_tzinfo(timezone_name) or timezone.utc
+    return datetime.now(tz).strftime("%Y-%m-%d")
+
+def next_local_midnight(timezone_name: str) -> float:
+    tz = get_tzinfo(timezone_name) or timezone.utc
+    now = datetime.now(tz)
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight.timestamp()
+
+def hash_content(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def compress_content(content: str):
+    raw = content.encode("utf-8")
+    if len(raw) >= USER_FILE_COMPRESSION_THRESHOLD:
+        compressed = zlib.compress(raw, 6)
+        if len(compressed) < len(raw):
+            return compressed, "zlib"
+    return content, "identity"
+
+def decompress_content(content, encoding: str = None) -> str:
+    # Documents stored before compression have no encoding marker
+    if encoding == "zlib":
+        return zlib.decompress(content).decode("utf-8")
+    return content
+
+def split_into_chunks(data: bytes, chunk_size: int):
+    return [data[start:start + chunk_size] for start in range(0, len(data), chunk_size)]
+
+def iter_file_content(chunk_collection: Collection, file: dict):
+    if not file.get("chunk_version"):
+        yield decompress_content(file["content"], file.get("encoding")).encode("utf-8")
+        return
+
+    # Small cursor batches so only a few chunks are held in memory at once
+    decompressor = zlib.decompressobj() if file.get("encoding") == "zlib" else None
+    chunks_cursor = chunk_collection.find({"version": file["chunk_version"]}, {"_id": 0, "data": 1}).sort("n", 1).batch_size(4)
+    for chunk in chunks_cursor:
+        yield decompressor.decompress(chunk["data"]) if decompressor else chunk["data"]
+    if decompressor:
+        yield decompressor.flush()
@@ -0,0 +1,95 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Acknowledged writes are held in memory for at most `window` seconds before being flushed.
+# They are flushed on a graceful shutdown, but are lost if the process is killed before that.
+
+class WriteBehindBuffer:
+    def __init__(self, name: str, window: float, writer):
+        # writer(group, items) persists the latest item of every key in a group with a single bulk write
+        self.name = name
+        self.window = window
+        self.writer = writer
+        self.submitted = 0
+        self.written = 0
+        self.flushes = 0
+        self._pending = {}
+        # Groups taken out of _pending whose write hasn't finished yet
+        self._flushing = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def submit(self, group, key, item):
+        with self._lock:
+            # A newer write to the same key replaces the pending one
+            self._pending[(group, key)] = item
+            self.submitted += 1
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name=f"{self.name}-write-behind", daemon=True)
+                self._thread.start()
+
+    def has_pending(self, group) -> bool:
+        # Also true while the group is being written, flush(group) then waits for that write
+        with self._lock:
+            return group in self._flushing or any(pending_group == group for pending_group, _ in self._pending)
+
+    def flush(self, group=None):
+        with self._flush_lock:
+            with self._lock:
+                taken = {
+                    pending_key: item for pending_key, item in self._pending.items()
+                    if group is None or pending_key[0] == group
+                }
+                for pending_key in taken:
+                    del self._pending[pending_key]
+
+                groups = {}
+                for (pending_group, key), item in taken.items():
+                    groups.setdefault(pending_group, {})[key] = item
+                self._flushing.update(groups)
+
+            for pending_group, items in groups.items():
+                try:
+                    self.writer(pending_group, list(items.values()))
+                except Exception:
+                    logger.exception("Flushing %s write-behind buffer failed, requeueing %d writes", self.name, len(items))
+                    with self._lock:
+                        for key, item in items.items():
+                            # Keep anything submitted while the flush was running
+                            self._pending.setdefault((pending_group, key), item)
+                        self._flushing.discard(pending_group)
+                    continue
+                with self._lock:
+                    self.written += len(items)
+                    self.flushes += 1
+                    self._flushing.discard(pending_group)
+
+    def stop(self):
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        self._stop.set()
+        if thread:
+            thread.join()
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+            return {
+                "submitted": self.submitted,
+                "written": self.written,
+                "pending": pending,
+                "saved": self.submitted - self.written - pending,
+                "flushes": self.flushes,
+                "window": self.window
+            }
+
+    def _run(self):
+        while not self._stop.wait(self.window):
+            self.flush()